@@ -18,7 +18,7 @@ if [ ! "$(ls -A data/pdfs 2>/dev/null)" ]; then
 fi
 
 # Check if embeddings exist
-if [ ! -f "data/embeddings/docs.index" ] || [ ! -f "data/embeddings/chunks_metadata.json" ]; then
+if [ ! -f "data/embeddings/docs.index" ] || { [ ! -f "data/embeddings/chunks.store" ] && [ ! -f "data/embeddings/chunks_metadata.json" ]; }; then
     echo -e "${YELLOW}Embeddings not found. Running data processing pipeline...${NC}"
     python scripts/prepare_data.py
 fi
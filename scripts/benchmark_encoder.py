@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compare encoder backends on latency, throughput, memory and embedding agreement
+
+Each backend runs in its own subprocess so its peak RSS is measured in
+isolation. Agreement is the cosine similarity between each backend's
+embeddings and those of the fp32 torch backend (or the fp32 ONNX graph when
+torch is not benchmarked) for the same texts, plus the overlap of their
+top-k neighbours among the chunks. Texts are the indexed chunks; queries
+are short snippets taken from them. Needs the local model files written by
+scripts/export_encoder.py.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.chunk_store import open_chunk_store
+from src.chatbot.encoder import ENCODER_BACKENDS, MODEL_DIR, load_encoder
+
+def load_texts(num_texts: int, store_path: str, metadata_path: str):
+    """Chunk texts to encode as documents, and query-length snippets taken from them"""
+    chunks = open_chunk_store(store_path, metadata_path)
+    texts = [chunks[i]["text"] for i in range(min(num_texts, len(chunks)))]
+    queries = [" ".join(text.split()[:12]) for text in texts]
+    return texts, queries
+
+def run_backend(backend: str, model_dir: str, threads: int, texts: list, queries: list,
+                batch_size: int, vectors_path: str) -> dict:
+    """Measure one backend in the current process"""
+    start = time.perf_counter()
+    encoder = load_encoder(backend, model_dir=model_dir, threads=threads)
+    load_seconds = time.perf_counter() - start
+
+    # Warm up, so one-off initialisation is not counted as query latency
+    encoder.encode(queries[:8])
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        encoder.encode([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    doc_vectors = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype='float32')
+    batch_seconds = time.perf_counter() - start
+    query_vectors = np.asarray(encoder.encode(queries, batch_size=batch_size), dtype='float32')
+    np.save(vectors_path, np.concatenate([doc_vectors, query_vectors]))
+
+    latencies = np.array(latencies)
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "query_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "query_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+        "batch_texts_per_s": round(len(texts) / batch_seconds, 1) if batch_seconds > 0 else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def cosine(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
+
+def top_k(docs: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def agreement(reference: np.ndarray, vectors: np.ndarray, num_texts: int, k: int) -> dict:
+    """Compare a backend's vectors with the fp32 reference vectors"""
+    similarities = cosine(reference, vectors)
+    ref_top = top_k(reference[:num_texts], reference[num_texts:], k)
+    top = top_k(vectors[:num_texts], vectors[num_texts:], k)
+    overlap = np.mean([len(set(a) & set(b)) / len(a) for a, b in zip(ref_top, top)])
+    return {
+        "cosine_mean": round(float(similarities.mean()), 5),
+        "cosine_min": round(float(similarities.min()), 5),
+        f"top{k}_overlap": round(float(overlap), 4),
+    }
+
+def print_table(results: list, k: int):
+    columns = ["backend", "query_ms_p50", "query_ms_p99", "batch_texts_per_s", "peak_rss_mb",
+               "load_seconds", "cosine_mean", "cosine_min", f"top{k}_overlap"]
+    widths = [max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in results:
+        print("  ".join(str(r.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the torch, ONNX and int8 ONNX encoder backends")
+    parser.add_argument("--backends", nargs="+", choices=ENCODER_BACKENDS,
+                        default=[backend for backend in ENCODER_BACKENDS if backend != "hash"])
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--store-path", default="data/embeddings/chunks.store")
+    parser.add_argument("--metadata-path", default="data/embeddings/chunks_metadata.json")
+    parser.add_argument("--texts", type=int, default=256, help="Number of chunks to encode")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=None, help="Inference threads per backend")
+    parser.add_argument("-k", type=int, default=5, help="Neighbours compared for top-k overlap")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--vectors-path", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    texts, queries = load_texts(args.texts, args.store_path, args.metadata_path)
+
+    if args.worker:
+        result = run_backend(args.worker, args.model_dir, args.threads, texts, queries,
+                             args.batch_size, args.vectors_path)
+        print(json.dumps(result))
+        return
+
+    print(f"Benchmarking {len(args.backends)} backends on {len(texts)} texts and {len(queries)} queries")
+    results = []
+    vectors = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for backend in args.backends:
+            vectors_path = os.path.join(tmp_dir, f"{backend}.npy")
+            command = [sys.executable, os.path.abspath(__file__), "--worker", backend,
+                       "--vectors-path", vectors_path, "--model-dir", args.model_dir,
+                       "--store-path", args.store_path, "--metadata-path", args.metadata_path,
+                       "--texts", str(args.texts), "--batch-size", str(args.batch_size)]
+            if args.threads:
+                command += ["--threads", str(args.threads)]
+            print(f"Running {backend}...", flush=True)
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"⚠️ {backend} failed:\n{completed.stderr.strip()[-2000:]}")
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            vectors[backend] = np.load(vectors_path)
+
+    # Agreement is measured against fp32 vectors: torch, else the unquantized ONNX graph
+    reference = next((backend for backend in ("torch", "onnx") if backend in vectors), None)
+    if reference:
+        for result in results:
+            result["reference"] = reference
+            result.update(agreement(vectors[reference], vectors[result["backend"]], len(texts), args.k))
+    elif results:
+        print("Agreement needs an fp32 backend (torch or onnx) as the reference; skipping it")
+
+    if not results:
+        return
+    print()
+    print_table(results, args.k)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"num_texts": len(texts), "num_queries": len(queries), "results": results}, f, indent=2)
+        print(f"\n✅ Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
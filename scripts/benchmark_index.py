@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Compare FAISS index types on recall, latency, build time and size
+
+Recall@k is measured against the exact Flat index over the same vectors.
+Vectors come from the existing Flat docs.index by default, so no model
+download is needed; use --synthetic to benchmark at larger corpus sizes.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+import faiss
+from create_embeddings import INDEX_TYPES, METRICS, build_index, prepare_vectors
+
+def load_vectors(index_path: str) -> np.ndarray:
+    """Read all vectors back out of an existing (Flat) index"""
+    index = faiss.read_index(index_path)
+    return index.reconstruct_n(0, index.ntotal)
+
+def synthetic_vectors(num_vectors: int, dimension: int, seed: int = 42) -> np.ndarray:
+    """Clustered random vectors, which behave more like text embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    num_clusters = max(1, num_vectors // 100)
+    centers = rng.standard_normal((num_clusters, dimension)).astype('float32')
+    assignments = rng.integers(0, num_clusters, num_vectors)
+    return centers[assignments] + 0.3 * rng.standard_normal((num_vectors, dimension)).astype('float32')
+
+def make_queries(vectors: np.ndarray, num_queries: int, seed: int = 0) -> np.ndarray:
+    """Perturbed copies of corpus vectors, so queries are near but not on the data"""
+    rng = np.random.default_rng(seed)
+    picks = vectors[rng.integers(0, len(vectors), num_queries)]
+    noise = rng.standard_normal(picks.shape).astype('float32') * picks.std() * 0.1
+    return np.ascontiguousarray(picks + noise, dtype='float32')
+
+def index_size_bytes(index) -> int:
+    with tempfile.NamedTemporaryFile(suffix=".index", delete=False) as f:
+        path = f.name
+    try:
+        faiss.write_index(index, path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+def recall_at_k(ground_truth: np.ndarray, found: np.ndarray) -> float:
+    hits = sum(len(set(truth) & set(row)) for truth, row in zip(ground_truth, found))
+    return hits / ground_truth.size
+
+def benchmark(index, queries: np.ndarray, k: int, ground_truth: np.ndarray) -> dict:
+    # Single-query latency, as seen by /chat
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(indices[0])
+
+    # Whole-batch throughput, as seen by /chat/batch
+    start = time.perf_counter()
+    index.search(queries, k)
+    batch_seconds = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        f"recall@{k}": round(recall_at_k(ground_truth, np.array(found)), 4),
+        "latency_ms_mean": round(float(latencies.mean()), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 4),
+        "batch_qps": round(len(queries) / batch_seconds, 1) if batch_seconds > 0 else None,
+    }
+
+def print_table(results: list, k: int):
+    columns = ["index_type", "description", f"recall@{k}", "latency_ms_p50", "latency_ms_p99",
+               "batch_qps", "build_seconds", "size_bytes"]
+    widths = [max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in results:
+        print("  ".join(str(r.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types against the exact Flat index")
+    parser.add_argument("--index-path", default="data/embeddings/docs.index", help="Flat index to read vectors from")
+    parser.add_argument("--synthetic", type=int, default=0, help="Benchmark N synthetic vectors instead")
+    parser.add_argument("--dimension", type=int, default=384, help="Dimension of synthetic vectors")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=INDEX_TYPES)
+    parser.add_argument("--metric", choices=METRICS, default="l2")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=5, help="Neighbours per query")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--pq-m", type=int, default=None)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dimension)
+    else:
+        vectors = load_vectors(args.index_path)
+    print(f"Benchmarking {len(vectors)} vectors of dimension {vectors.shape[1]} with {args.queries} queries")
+
+    queries = prepare_vectors(make_queries(vectors, args.queries), args.metric)
+    k = min(args.k, len(vectors))
+
+    exact = faiss.IndexFlatIP(vectors.shape[1]) if args.metric == "cosine" else faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(prepare_vectors(vectors, args.metric))
+    _, ground_truth = exact.search(queries, k)
+
+    results = []
+    for index_type in args.types:
+        start = time.perf_counter()
+        index, description = build_index(vectors, index_type=index_type, nlist=args.nlist,
+                                         pq_m=args.pq_m, hnsw_m=args.hnsw_m, metric=args.metric)
+        build_seconds = time.perf_counter() - start
+
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", args.nprobe), ("efSearch", args.ef_search)):
+            try:
+                params.set_index_parameter(index, name, value)
+            except RuntimeError:
+                pass
+
+        result = {
+            "index_type": index_type,
+            "description": description,
+            "build_seconds": round(build_seconds, 3),
+            "size_bytes": index_size_bytes(index),
+        }
+        result.update(benchmark(index, queries, k, ground_truth))
+        results.append(result)
+
+    print()
+    print_table(results, k)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"num_vectors": len(vectors), "k": k, "metric": args.metric, "results": results}, f, indent=2)
+        print(f"\n✅ Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Measure per-worker memory and aggregate throughput as API workers scale
+
+For every serving mode and worker count, starts scripts/serve.py, loads it
+with /chat requests for --duration seconds and reads each process's memory
+from /proc/<pid>/smaps_rollup (Linux only):
+
+- rss_mb: resident memory per worker, counting shared pages in full
+- private_mb: memory only that worker holds; the cost of one more worker
+- pss_total_mb: proportional set size of all server processes, shared pages
+  split between their users; the server's real footprint
+
+Modes:
+  copy     every worker reads its own index and model (like uvicorn --workers)
+  mmap     every worker loads the app, but maps the index read-only
+  preload  the parent loads the app with a mapped index and forks the workers
+
+--offline serves a synthetic index with the hash encoder from a temp dir;
+otherwise the index under data/embeddings is served with ENCODER_BACKEND.
+The load generator runs in this process, so leave it a core: with many
+workers on few cores, throughput measures the machine, not the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPTS_DIR)
+from load_test import LoadTest, build_offline_index, load_queries, percentiles
+
+MODES = {
+    "copy": ["--no-preload", "--no-mmap"],
+    "mmap": ["--no-preload"],
+    "preload": [],
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def child_pids(pid: int) -> list:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # The command name may contain spaces; the parent PID follows its closing parenthesis
+                if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return sorted(pids)
+
+def memory_mb(pid: int) -> dict:
+    """Rss, Pss and private memory of a process in MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss": values.get("Rss", 0.0),
+        "pss": values.get("Pss", 0.0),
+        "private": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0),
+    }
+
+async def wait_until_ready(url: str, workers: int, server: subprocess.Popen, timeout: float):
+    """Wait until the server answers and all of its workers exist"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=url, timeout=5) as client:
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with status {server.returncode}")
+            try:
+                response = await client.get("/status")
+                if response.status_code == 200 and response.json().get("index_version") \
+                        and len(child_pids(server.pid)) >= workers:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server not ready after {timeout}s")
+
+async def drive(url: str, queries: list, args, workers: int) -> tuple:
+    limits = httpx.Limits(max_connections=args.concurrency * workers)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        # Unmeasured requests first, so every worker has loaded its model and touched its index
+        warmup = LoadTest(client, queries, num_requests=args.warmup * workers, concurrency=args.concurrency * workers,
+                          unique=True, seed=args.seed + 1)
+        await warmup.run()
+        test = LoadTest(client, queries, concurrency=args.concurrency * workers, duration=args.duration,
+                        unique=True, seed=args.seed)
+        elapsed = await test.run()
+    return test.samples, elapsed
+
+def run_case(mode: str, workers: int, directory: str, env: dict, queries: list, args) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, os.path.join(SCRIPTS_DIR, "serve.py"), "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"] + MODES[mode]
+    with open(os.path.join(directory, f"serve_{mode}_{workers}.log"), "w") as log:
+        server = subprocess.Popen(command, cwd=directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        asyncio.run(wait_until_ready(url, workers, server, args.startup_timeout))
+        samples, elapsed = asyncio.run(drive(url, queries, args, workers))
+
+        worker_memory = [memory_mb(pid) for pid in child_pids(server.pid)]
+        parent_memory = memory_mb(server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    ok = [s for s in samples if not s["error"]]
+    latency = percentiles([s["latency_ms"] for s in ok])
+    return {
+        "mode": mode,
+        "workers": workers,
+        "qps": round(len(ok) / elapsed, 1) if elapsed > 0 else None,
+        "errors": len(samples) - len(ok),
+        "p50_ms": latency.get("p50"),
+        "p99_ms": latency.get("p99"),
+        "rss_mb": round(sum(m["rss"] for m in worker_memory) / len(worker_memory), 1),
+        "private_mb": round(sum(m["private"] for m in worker_memory) / len(worker_memory), 1),
+        "pss_total_mb": round(sum(m["pss"] for m in worker_memory) + parent_memory["pss"], 1),
+    }
+
+def print_table(results: list):
+    columns = ["mode", "workers", "qps", "p50_ms", "p99_ms", "errors", "rss_mb", "private_mb", "pss_total_mb"]
+    widths = [max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in results:
+        print("  ".join(str(r.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API memory and throughput from 1 to N workers")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load per case")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent requests per worker")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per worker")
+    parser.add_argument("--queries", default=None, help="File with one query per line")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--offline", action="store_true", help="Serve a synthetic index with the hash encoder")
+    parser.add_argument("--num-chunks", type=int, default=100000, help="Synthetic index size with --offline")
+    parser.add_argument("--index-type", default="flat", help="Synthetic index type with --offline")
+    parser.add_argument("--store-path", default="data/embeddings/chunks.store")
+    parser.add_argument("--metadata-path", default="data/embeddings/chunks_metadata.json")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    env = dict(os.environ, INDEX_WATCH_INTERVAL="0", PYTHONPATH=os.path.join(SCRIPTS_DIR, ".."))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.offline:
+            chunks = build_offline_index(tmp_dir, args.num_chunks, args.index_type, "l2", args.seed)
+            queries = load_queries(args, chunks)
+            directory = tmp_dir
+            env["ENCODER_BACKEND"] = "hash"
+        else:
+            queries = load_queries(args)
+            directory = os.getcwd()
+
+        for mode in args.modes:
+            for workers in args.workers:
+                print(f"Running {mode} with {workers} workers...", flush=True)
+                try:
+                    results.append(run_case(mode, workers, directory, env, queries, args))
+                except Exception as e:
+                    print(f"⚠️ {mode} with {workers} workers failed: {e}")
+
+    if not results:
+        return
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+        print(f"\n✅ Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
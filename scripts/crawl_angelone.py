@@ -1,112 +1,210 @@
-import requests
-from bs4 import BeautifulSoup
+"""
+Crawl the Angel One support articles
+
+Articles are fetched concurrently over one pooled, keep-alive HTTP client,
+with a per-host token-bucket rate limit. Raw HTML is kept per URL under
+data/raw_html/pages, and fetch state (ETag, Last-Modified, last verified
+run) is saved in data/raw_html/crawl_state.json as the crawl progresses:
+
+- an interrupted crawl resumes where it stopped;
+- a recrawl sends conditional requests, so unchanged pages are skipped.
+
+The extracted text of every page is written to data/raw_html/angelone_docs.json;
+scripts/extract_html.py ingests the raw pages for indexing.
+"""
+import argparse
+import asyncio
+import hashlib
 import json
 import os
 import time
-import urllib3
-import ssl
-import certifi
+import httpx
 import xmltodict
-from urllib.parse import urljoin
-
-# Disable SSL warnings
-urllib3.disable_warnings()
+from bs4 import BeautifulSoup
+from urllib.parse import urljoin, urlparse
+from extract_html import extract_text_from_html, page_file
 
 SITEMAP_URL = "https://www.angelone.in/sitemap.xml"
 SUPPORT_BASE_URL = "https://www.angelone.in/support"
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36'
 }
+OUTPUT_DIR = "data/raw_html"
+MAX_RETRIES = 3
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """Allow `rate` requests per second on average, with bursts of up to `burst`"""
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class CrawlState:
+    def __init__(self, output_dir: str = OUTPUT_DIR):
+        """
+        On-disk fetch state for every known URL, plus the raw HTML of each page
+
+        A run counts as unfinished until finish_run() is called; starting
+        again resumes it instead of beginning a new one.
+        """
+        self.path = os.path.join(output_dir, "crawl_state.json")
+        self.pages_dir = os.path.join(output_dir, "pages")
+        os.makedirs(self.pages_dir, exist_ok=True)
+
+        self.data = {"run": None, "urls": {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable crawl state: {e}")
+        self._dirty = 0
+
+    def start_run(self):
+        run = self.data.get("run")
+        if run and not run.get("finished"):
+            print(f"Resuming crawl started at {time.ctime(run['started_at'])}")
+        else:
+            self.data["run"] = {"started_at": time.time(), "finished": False}
+        return self.data["run"]["started_at"]
+
+    def finish_run(self):
+        self.data["run"]["finished"] = True
+        self.save()
+
+    def entry(self, url: str) -> dict:
+        return self.data["urls"].get(url, {})
+
+    def verified_in_run(self, url: str) -> bool:
+        return self.entry(url).get("verified_at", 0) >= self.data["run"]["started_at"]
+
+    def page_path(self, url: str) -> str:
+        return page_file(self.pages_dir, url)
+
+    def record(self, url: str, status: int, response: httpx.Response = None, content: bytes = None):
+        entry = dict(self.entry(url))
+        entry["status"] = status
+        if status in (200, 304):
+            entry["verified_at"] = time.time()
+        if content is not None:
+            tmp_path = self.page_path(url) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, self.page_path(url))
+            entry["etag"] = response.headers.get("etag")
+            entry["last_modified"] = response.headers.get("last-modified")
+            entry["sha256"] = hashlib.sha256(content).hexdigest()
+        self.data["urls"][url] = entry
+
+        # Save periodically so an interrupted crawl loses little work
+        self._dirty += 1
+        if self._dirty >= 25:
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self._dirty = 0
+
+async def fetch(client: httpx.AsyncClient, limiters: dict, url: str, rate: float, burst: int, headers: dict = None):
+    """GET a URL through its host's rate limiter, retrying throttling, server and transport errors"""
+    host = urlparse(url).netloc
+    limiter = limiters.setdefault(host, TokenBucket(rate, burst))
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire()
+        try:
+            response = await client.get(url, headers=headers)
+        except httpx.TransportError as e:
+            if attempt == MAX_RETRIES:
+                raise
+            print(f"Retrying {url} after error: {e}")
+            await asyncio.sleep(2 ** attempt)
+            continue
+
+        if response.status_code in (429, 500, 502, 503, 504) and attempt < MAX_RETRIES:
+            retry_after = response.headers.get("retry-after", "")
+            await asyncio.sleep(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
+            continue
+        return response
+
+def parse_sitemap(content: bytes):
+    """Return (nested sitemap URLs, support article URLs) from a sitemap document"""
+    sitemap = xmltodict.parse(content)
+    sitemaps, articles = [], []
+
+    if 'sitemapindex' in sitemap:
+        entries = sitemap['sitemapindex'].get('sitemap') or []
+        # Handle both single and multiple sitemaps
+        if isinstance(entries, dict):
+            entries = [entries]
+        sitemaps = [entry['loc'] for entry in entries]
+    elif 'urlset' in sitemap:
+        entries = sitemap['urlset'].get('url') or []
+        # Handle both single and multiple URLs
+        if isinstance(entries, dict):
+            entries = [entries]
+        articles = [entry['loc'] for entry in entries if '/support/article/' in entry['loc']]
 
-def get_article_links_from_sitemap():
+    return sitemaps, articles
+
+async def get_article_links_from_sitemap(client, limiters, args):
     print("Fetching sitemap...")
     try:
-        session = requests.Session()
-        resp = session.get(SITEMAP_URL, headers=HEADERS, verify=False)
-        
+        resp = await fetch(client, limiters, args.sitemap_url, args.rate, args.burst)
         if resp.status_code != 200:
             print(f"Failed to fetch sitemap. Status code: {resp.status_code}")
-            return crawl_support_pages()
+            return await crawl_support_pages(client, limiters, args)
 
-        # Try parsing as XML using xmltodict
-        try:
-            sitemap = xmltodict.parse(resp.content)
-            urls = []
-            
-            # Debug the sitemap structure
-            print("Sitemap structure:", json.dumps(sitemap, indent=2))
-            
-            # Handle nested sitemaps
-            if 'sitemapindex' in sitemap:
-                print("Found sitemapindex")
-                sitemaps = sitemap['sitemapindex']['sitemap']
-                # Handle both single and multiple sitemaps
-                if isinstance(sitemaps, dict):
-                    sitemaps = [sitemaps]
-                    
-                for sitemap_entry in sitemaps:
-                    try:
-                        sub_resp = session.get(sitemap_entry['loc'], headers=HEADERS, verify=False)
-                        sub_sitemap = xmltodict.parse(sub_resp.content)
-                        if 'urlset' in sub_sitemap:
-                            urls_in_set = sub_sitemap['urlset']['url']
-                            # Handle both single and multiple URLs
-                            if isinstance(urls_in_set, dict):
-                                urls_in_set = [urls_in_set]
-                            
-                            for url in urls_in_set:
-                                if '/support/article/' in url['loc']:
-                                    urls.append(url['loc'])
-                    except Exception as e:
-                        print(f"Error processing sub-sitemap: {e}")
-                        continue
-                        
-            # Handle direct URL list
-            elif 'urlset' in sitemap:
-                print("Found urlset")
-                urls_in_set = sitemap['urlset']['url']
-                # Handle both single and multiple URLs
-                if isinstance(urls_in_set, dict):
-                    urls_in_set = [urls_in_set]
-                    
-                for url in urls_in_set:
-                    if '/support/article/' in url['loc']:
-                        urls.append(url['loc'])
-                        
-            if urls:
-                print(f"Found {len(urls)} article links in sitemap.")
-                return urls
-                
-        except Exception as e:
-            print(f"XML parsing failed: {e}, trying HTML parsing...")
-            import traceback
-            print("Full error:", traceback.format_exc())
+        sitemaps, urls = parse_sitemap(resp.content)
+
+        # Nested sitemaps are fetched concurrently
+        async def fetch_sub_sitemap(sitemap_url):
+            try:
+                sub_resp = await fetch(client, limiters, sitemap_url, args.rate, args.burst)
+                return parse_sitemap(sub_resp.content)[1]
+            except Exception as e:
+                print(f"Error processing sub-sitemap {sitemap_url}: {e}")
+                return []
+
+        for sub_urls in await asyncio.gather(*(fetch_sub_sitemap(url) for url in sitemaps)):
+            urls.extend(sub_urls)
+
+        if urls:
+            urls = list(dict.fromkeys(urls))
+            print(f"Found {len(urls)} article links in sitemap.")
+            return urls
     except Exception as e:
         print(f"Sitemap fetch failed: {e}")
-        import traceback
-        print("Full error:", traceback.format_exc())
 
-    return crawl_support_pages()
+    return await crawl_support_pages(client, limiters, args)
 
-def crawl_support_pages():
+async def crawl_support_pages(client, limiters, args):
     """Fallback method to directly crawl the support pages"""
     print("Falling back to direct support page crawling...")
     urls = []
     try:
-        resp = requests.get(
-            SUPPORT_BASE_URL, 
-            headers=HEADERS,
-            verify=False
-        )
-        
+        resp = await fetch(client, limiters, args.support_url, args.rate, args.burst)
         if resp.status_code != 200:
             print(f"Failed to fetch support page. Status code: {resp.status_code}")
             print("Response content:", resp.text[:500])  # Print first 500 chars of response
             return []
-            
+
         soup = BeautifulSoup(resp.text, 'html.parser')
-        
-        # Try different selectors to find links
         for link in soup.find_all(['a', 'link'], href=True):
             href = link['href']
             if isinstance(href, str) and '/support/article/' in href:
@@ -115,87 +213,118 @@ def crawl_support_pages():
                 elif href.startswith('//'):
                     full_url = f"https:{href}"
                 else:
-                    full_url = urljoin(SUPPORT_BASE_URL, href)
+                    full_url = urljoin(args.support_url, href)
                 urls.append(full_url)
-                
-        urls = list(set(urls))  # Remove duplicates
+
+        urls = list(dict.fromkeys(urls))  # Remove duplicates
         print(f"Found {len(urls)} article links from direct crawling.")
-        
-        if not urls:
-            print("No links found in HTML. Page content sample:", soup.text[:500])
-        
     except Exception as e:
         print(f"Error crawling support pages: {e}")
-        import traceback
-        print("Full error:", traceback.format_exc())
-    
+
     return urls
 
-def extract_text_from_page(url):
+async def crawl_article(client, limiters, state: CrawlState, url: str, args, counts: dict):
+    """Fetch one article, conditionally if it was fetched before"""
+    if state.verified_in_run(url):
+        counts["resumed"] += 1
+        return
+
+    entry = state.entry(url)
+    headers = {}
+    if os.path.exists(state.page_path(url)):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
     try:
-        print(f"Scraping: {url}")
-        r = requests.get(url, headers=HEADERS, verify=False)
-        if r.status_code != 200:
-            print(f"Failed to fetch {url}. Status code: {r.status_code}")
-            return None
-            
-        soup = BeautifulSoup(r.text, 'html.parser')
-        
-        # Try to find the main content area
-        content_selectors = [
-            "main",
-            "article",
-            ".article-content",
-            "#content",
-            ".content"
-        ]
-        
-        content = None
-        for selector in content_selectors:
-            if selector.startswith('.'):
-                element = soup.find(class_=selector[1:])
-            elif selector.startswith('#'):
-                element = soup.find(id=selector[1:])
-            else:
-                element = soup.find(selector)
-                
-            if element:
-                content = element
-                break
-        
-        if not content:
-            content = soup.body if soup.body else soup
-
-        # Remove unwanted elements
-        for unwanted in content.find_all(['script', 'style', 'nav', 'header', 'footer']):
-            unwanted.decompose()
-
-        text = content.get_text(separator="\n").strip()
-        return {"url": url, "content": text}
+        response = await fetch(client, limiters, url, args.rate, args.burst, headers=headers)
     except Exception as e:
         print(f"Error fetching {url}: {e}")
-        return None
+        counts["failed"] += 1
+        return
+
+    if response.status_code == 304:
+        state.record(url, 304)
+        counts["unchanged"] += 1
+    elif response.status_code == 200:
+        print(f"Scraped: {url}")
+        state.record(url, 200, response, response.content)
+        counts["fetched"] += 1
+    else:
+        print(f"Failed to fetch {url}. Status code: {response.status_code}")
+        state.record(url, response.status_code)
+        counts["failed"] += 1
+
+def write_docs(state: CrawlState, urls, output_path: str) -> int:
+    """Write the extracted text of every stored page, one page at a time"""
+    count = 0
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for url in urls:
+            path = state.page_path(url)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as page:
+                doc = {"url": url, "content": extract_text_from_html(page.read())}
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(doc, indent=2, ensure_ascii=False))
+            count += 1
+        f.write("\n]")
+    os.replace(tmp_path, output_path)
+    return count
+
+async def crawl(args):
+    state = CrawlState(args.output_dir)
+    state.start_run()
+    limiters = {}
+    counts = {"fetched": 0, "unchanged": 0, "resumed": 0, "failed": 0}
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(headers=HEADERS, verify=False, limits=limits, timeout=args.timeout,
+                                 follow_redirects=True) as client:
+        links = await get_article_links_from_sitemap(client, limiters, args)
+        if not links:
+            print("No links found. Please check the website structure or network connection.")
+            return
+
+        queue = asyncio.Queue()
+        for link in links:
+            queue.put_nowait(link)
+
+        async def worker():
+            while True:
+                try:
+                    url = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await crawl_article(client, limiters, state, url, args, counts)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        finally:
+            state.save()
+
+    state.finish_run()
+    saved = write_docs(state, links, os.path.join(args.output_dir, "angelone_docs.json"))
+    print(f"\n✅ Scraped and saved {saved} pages "
+          f"({counts['fetched']} fetched, {counts['unchanged']} unchanged, "
+          f"{counts['resumed']} already done, {counts['failed']} failed).")
 
 def main():
-    os.makedirs("data/raw_html", exist_ok=True)
-    links = get_article_links_from_sitemap()
-    
-    if not links:
-        print("No links found. Please check the website structure or network connection.")
-        return
-        
-    docs = []
-    
-    for link in links:
-        doc = extract_text_from_page(link)
-        if doc:
-            docs.append(doc)
-        time.sleep(1)  # Increased delay to be more polite
-
-    with open("data/raw_html/angelone_docs.json", "w", encoding="utf-8") as f:
-        json.dump(docs, f, indent=2, ensure_ascii=False)
-
-    print(f"\n✅ Scraped and saved {len(docs)} pages.")
+    parser = argparse.ArgumentParser(description="Crawl the Angel One support articles")
+    parser.add_argument("--sitemap-url", default=SITEMAP_URL)
+    parser.add_argument("--support-url", default=SUPPORT_BASE_URL)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests")
+    parser.add_argument("--rate", type=float, default=2.0, help="Requests per second per host")
+    parser.add_argument("--burst", type=int, default=4, help="Burst size per host")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Request timeout in seconds")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    asyncio.run(crawl(args))
 
 if __name__ == "__main__":
     main()
@@ -1,35 +1,618 @@
+import argparse
+import hashlib
 import json
+import math
+import multiprocessing
 import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
+from process_data import CHUNKS_PATH, iter_json_array
 
-def create_embeddings():
-    """Create and save embeddings using FAISS"""
-    # Load processed chunks
-    with open("data/processed/chunks.json", "r", encoding="utf-8") as f:
-        chunks = json.load(f)
-    
-    # Initialize the embedding model
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    
-    # Create embeddings
-    texts = [chunk["text"] for chunk in chunks]
-    embeddings = model.encode(texts, show_progress_bar=True)
-    
-    # Create FAISS index
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings).astype('float32'))
-    
-    # Save the index and metadata
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.chunk_store import ChunkStore, ChunkStoreWriter
+from src.chatbot.index_manager import write_index_version
+from src.chatbot.encoder import ENCODER_BACKENDS, load_encoder
+from src.chatbot.filters import (DEFAULT_PARTITION_FIELDS, MAX_PARTITION_VALUES, PARTITIONS_DIR, field_values,
+                                 remove_partitions, write_partition_manifest)
+from src.chatbot.profiling import RunProfiler, StageProfile, add_profiling_arguments, file_size, profile_call
+from src.chatbot.shards import SHARDS_DIR, SHARDS_FILE, shard_of, write_shard_manifest
+
+INDEX_TYPES = ["flat", "ivf_flat", "ivf_pq", "hnsw", "sq8", "sq_fp16"]
+# l2: raw vectors, L2 distance; cosine: L2-normalized vectors, inner product
+METRICS = ["l2", "cosine"]
+# Vectors copied and added to an index at a time
+ADD_BLOCK_SIZE = 65536
+
+# Embeddings are checkpointed here, in chunk order, and reused by later builds of the same chunks
+EMBEDDINGS_PATH = "data/embeddings/embeddings.npy"
+PROGRESS_PATH = "data/embeddings/embeddings.progress.json"
+# Chunks encoded per task and per checkpoint
+CHECKPOINT_SIZE = 4096
+STORE_PATH = "data/embeddings/chunks.store"
+METADATA_PATH = "data/embeddings/chunks_metadata.json"
+# Every encoder process loads its own copy of the model, so more of them cost memory, not just CPUs
+DEFAULT_WORKERS = 2
+
+def faiss_metric(metric: str) -> int:
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}'. Choose one of: {', '.join(METRICS)}")
+    return faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+
+def prepare_vectors(embeddings: np.ndarray, metric: str = "l2") -> np.ndarray:
+    """Contiguous float32 copy of the embeddings, L2-normalized for the cosine metric"""
+    embeddings = np.array(embeddings, dtype='float32', order='C')
+    if metric == "cosine":
+        faiss.normalize_L2(embeddings)
+    return embeddings
+
+def default_nlist(num_vectors: int) -> int:
+    """Pick an IVF list count that keeps ~39+ training points per centroid"""
+    nlist = int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // 39))
+
+def default_pq_m(dimension: int) -> int:
+    """Largest sub-quantizer count <= dimension / 8 that divides the dimension"""
+    for m in range(max(1, dimension // 8), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def index_description(index_type: str, dimension: int, num_vectors: int, nlist: int = None, pq_m: int = None, hnsw_m: int = 32) -> str:
+    """Translate an index type name into a FAISS index_factory string"""
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf_flat":
+        return f"IVF{nlist or default_nlist(num_vectors)},Flat"
+    if index_type == "ivf_pq":
+        # PQ codebooks need at least 2^nbits training points
+        nbits = max(1, min(8, int(math.log2(max(2, num_vectors)))))
+        return f"IVF{nlist or default_nlist(num_vectors)},PQ{pq_m or default_pq_m(dimension)}x{nbits}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}"
+    if index_type == "sq8":
+        return "SQ8"
+    if index_type == "sq_fp16":
+        return "SQfp16"
+    raise ValueError(f"Unknown index type '{index_type}'. Choose one of: {', '.join(INDEX_TYPES)}")
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", nlist: int = None, pq_m: int = None,
+                hnsw_m: int = 32, train_size: int = 100000, seed: int = 42, ids: np.ndarray = None,
+                metric: str = "l2", rows: np.ndarray = None):
+    """
+    Build a FAISS index of the requested type over the embeddings
+
+    Index types that need training (IVF, PQ, SQ) are trained on a random
+    sample of at most `train_size` vectors before all vectors are added.
+    When `ids` are given, the index is wrapped in an IndexIDMap2 and the
+    vectors are labelled with them instead of their positions. With the
+    cosine metric, vectors are normalized and stored in an inner-product
+    index, so search scores are cosine similarities.
+
+    Args:
+        rows: Only index these rows of `embeddings`, e.g. one shard's; `ids`
+            then lists one ID per row
+    """
+    if not isinstance(embeddings, np.ndarray):
+        embeddings = np.asarray(embeddings, dtype='float32')
+    num_vectors, dimension = (len(rows) if rows is not None else embeddings.shape[0]), embeddings.shape[1]
+
+    def take(selection):
+        # Copies only the selected vectors, even from a memory-mapped matrix
+        return embeddings[rows[selection]] if rows is not None else embeddings[selection]
+
+    description = index_description(index_type, dimension, num_vectors, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    index = faiss.index_factory(dimension, description, faiss_metric(metric))
+
+    if not index.is_trained:
+        if num_vectors > train_size:
+            rng = np.random.default_rng(seed)
+            sample = prepare_vectors(take(rng.choice(num_vectors, train_size, replace=False)), metric)
+        else:
+            sample = prepare_vectors(take(slice(None)), metric)
+        print(f"Training {description} index on {len(sample)} vectors...")
+        index.train(sample)
+
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        ids = np.ascontiguousarray(ids, dtype='int64')
+    # Added in blocks, so a memory-mapped matrix is never copied whole
+    for start in range(0, num_vectors, ADD_BLOCK_SIZE):
+        block = prepare_vectors(take(slice(start, start + ADD_BLOCK_SIZE)), metric)
+        if ids is not None:
+            index.add_with_ids(block, ids[start:start + ADD_BLOCK_SIZE])
+        else:
+            index.add(block)
+    return index, description
+
+def write_sharded_index(embeddings: np.ndarray, num_shards: int, embeddings_dir: str = "data/embeddings",
+                        ids: np.ndarray = None, metric: str = "l2", **index_options) -> str:
+    """
+    Split the vectors into shards and write one index per shard plus a manifest
+
+    Vector i goes to shard ids[i] % num_shards. Every shard is an IndexIDMap2
+    labelled with the global IDs, so results from all shards can be merged
+    and looked up in the one chunk store. Trained index types are trained
+    per shard on that shard's vectors.
+    """
+    embeddings = np.asarray(embeddings, dtype='float32')
+    ids = np.arange(len(embeddings), dtype='int64') if ids is None else np.asarray(ids, dtype='int64')
+    os.makedirs(os.path.join(embeddings_dir, SHARDS_DIR), exist_ok=True)
+
+    assignment = shard_of(ids, num_shards)
+    files, counts, description = [], [], None
+    for shard in range(num_shards):
+        members = np.flatnonzero(assignment == shard)
+        index, description = build_index(embeddings, ids=ids[members], metric=metric, rows=members, **index_options)
+        name = os.path.join(SHARDS_DIR, f"shard_{shard:03d}.index")
+        path = os.path.join(embeddings_dir, name)
+        faiss.write_index(index, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        files.append(name)
+        counts.append(index.ntotal)
+        print(f"Wrote shard {shard} with {index.ntotal} vectors to {path}")
+
+    write_shard_manifest(embeddings_dir, files, counts, metric=metric, dimension=embeddings.shape[1],
+                         index_type=index_options.get("index_type", "flat"))
+    return description
+
+# Below this many vectors a partition is searched exactly; approximate structures only pay off on larger ones
+MIN_APPROXIMATE_PARTITION = 10000
+
+def write_partitions(embeddings: np.ndarray, chunks, fields: list, embeddings_dir: str = "data/embeddings",
+                     ids: np.ndarray = None, metric: str = "l2", index_type: str = "flat",
+                     max_values: int = MAX_PARTITION_VALUES, **index_options) -> int:
+    """
+    Write one sub-index per value of each metadata field, plus a manifest
+
+    A query filtered on such a field only searches the sub-indexes of the
+    requested values, so its cost follows the size of that scope. Vectors
+    keep their IDs in every sub-index. A deduplicated chunk goes into the
+    sub-index of each of its sources. A field with more than `max_values`
+    values is skipped; its filters are resolved to IDs instead.
+
+    Args:
+        chunks: Chunk metadata in embedding order, read once; text is not needed
+
+    Returns:
+        Number of sub-indexes written
+    """
+    embeddings = np.asarray(embeddings, dtype='float32')
+    ids = np.arange(len(embeddings), dtype='int64') if ids is None else np.asarray(ids, dtype='int64')
+    remove_partitions(embeddings_dir)
+    os.makedirs(os.path.join(embeddings_dir, PARTITIONS_DIR), exist_ok=True)
+
+    # Positions of each field value's chunks, as compact integer arrays
+    members = {field: {} for field in fields}
+    for position, chunk in enumerate(chunks):
+        for field in fields:
+            for value in field_values(chunk, field):
+                members[field].setdefault(value, array("q")).append(position)
+
+    manifest = {}
+    for field in fields:
+        if len(members[field]) > max_values:
+            print(f"⚠️ Not writing sub-indexes for chunk field {field!r}: {len(members[field])} values, "
+                  f"more than {max_values}")
+            continue
+        manifest[field] = []
+        for number, (value, positions) in enumerate(members[field].items()):
+            positions = np.frombuffer(positions, dtype='int64')
+            partition_type = index_type if len(positions) >= MIN_APPROXIMATE_PARTITION else "flat"
+            index, _ = build_index(embeddings, index_type=partition_type, ids=ids[positions], metric=metric,
+                                   rows=positions, **index_options)
+            name = os.path.join(PARTITIONS_DIR, f"{field}_{number:04d}.index")
+            faiss.write_index(index, os.path.join(embeddings_dir, name))
+            manifest[field].append({"value": value, "file": name, "num_vectors": index.ntotal})
+        print(f"Wrote {len(members[field])} sub-indexes for chunk field {field!r}")
+
+    if not manifest:
+        remove_partitions(embeddings_dir)
+        return 0
+    write_partition_manifest(embeddings_dir, manifest, metric=metric)
+    return sum(len(partitions) for partitions in manifest.values())
+
+class StreamingIndexBuilder:
+    def __init__(self, index_type: str = "flat", train_size: int = 100000, metric: str = "l2", **index_options):
+        """
+        Build an index from batches of embeddings as they arrive
+
+        Index types that need no training start adding right away. Trained
+        types buffer up to `train_size` vectors, train on them (sizing IVF
+        lists from that sample), then add the buffer and everything after it.
+        Vectors added with `ids` are labelled with them in an IndexIDMap2;
+        pass ids with every batch or with none.
+        """
+        self.index_type = index_type
+        self.train_size = train_size
+        self.metric = metric
+        self.index_options = index_options
+        self.index = None
+        self.description = None
+        self._buffer = []
+        self._buffered = 0
+
+    def _create(self, sample: np.ndarray, labelled: bool):
+        dimension = sample.shape[1]
+        self.description = index_description(self.index_type, dimension, len(sample), **self.index_options)
+        self.index = faiss.index_factory(dimension, self.description, faiss_metric(self.metric))
+        if not self.index.is_trained:
+            print(f"Training {self.description} index on {len(sample)} vectors...")
+            self.index.train(sample)
+        if labelled:
+            self.index = faiss.IndexIDMap2(self.index)
+
+    def _add(self, embeddings: np.ndarray, ids: np.ndarray):
+        if ids is not None:
+            self.index.add_with_ids(embeddings, ids)
+        else:
+            self.index.add(embeddings)
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray = None):
+        embeddings = prepare_vectors(embeddings, self.metric)
+        if ids is not None:
+            ids = np.ascontiguousarray(ids, dtype='int64')
+        if self.index is not None:
+            self._add(embeddings, ids)
+            return
+
+        if self.index_type in ("flat", "hnsw"):
+            self._create(embeddings, labelled=ids is not None)
+            self._add(embeddings, ids)
+            return
+
+        self._buffer.append((embeddings, ids))
+        self._buffered += len(embeddings)
+        if self._buffered >= self.train_size:
+            self._flush()
+
+    def _flush(self):
+        buffered = np.vstack([embeddings for embeddings, _ in self._buffer])
+        labelled = self._buffer[0][1] is not None
+        ids = np.concatenate([ids for _, ids in self._buffer]) if labelled else None
+        self._buffer, self._buffered = [], 0
+        self._create(buffered[:self.train_size], labelled)
+        self._add(buffered, ids)
+
+    def finish(self):
+        """Return the built (index, description); None if nothing was added"""
+        if self.index is None and self._buffer:
+            self._flush()
+        return self.index, self.description
+
+class TextView:
+    def __init__(self, store: ChunkStore):
+        """Chunk texts of a chunk store as a read-only sequence, decoded on access"""
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, i: int) -> str:
+        return self.store.text(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.store.text(i)
+
+def length_buckets(texts, size: int = CHECKPOINT_SIZE) -> list:
+    """
+    Positions of the texts from longest to shortest, cut into buckets of `size`
+
+    Encoder batches are padded to their longest text, so batches drawn from
+    one bucket waste little work on padding. Handing out the longest
+    buckets first also keeps the slowest tasks from finishing last.
+    """
+    order = np.argsort(np.fromiter((-len(text) for text in texts), dtype='int64', count=len(texts)), kind="stable")
+    return [order[start:start + size] for start in range(0, len(order), size)]
+
+def texts_fingerprint(texts, encoder_backend: str) -> str:
+    """Identifies the inputs of a checkpoint, so a resumed build never mixes in other chunks' vectors"""
+    digest = hashlib.sha256(encoder_backend.encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+_encode_worker = {}
+
+def _init_encode_worker(encoder_backend: str, threads: int):
+    _encode_worker["model"] = load_encoder(encoder_backend, threads=threads)
+
+def _encode_texts(texts: list, batch_size: int):
+    start = time.perf_counter()
+    vectors = _encode_worker["model"].encode(texts, batch_size=batch_size)
+    model_seconds = time.perf_counter() - start
+    return np.asarray(vectors, dtype='float32'), model_seconds
+
+def _encode_bucket(task):
+    """Encode one bucket; also returns the task's seconds, seconds inside the model and cProfile dump"""
+    number, texts, batch_size, profile_dir = task
+    (vectors, model_seconds), seconds, profile_path = profile_call(profile_dir, _encode_texts, texts, batch_size)
+    return number, vectors, seconds, model_seconds, profile_path
+
+def _imap_bounded(pool: ProcessPoolExecutor, func, tasks, max_in_flight: int):
+    """Yield func(task) for each task as it finishes, with at most max_in_flight tasks (and their inputs) queued"""
+    tasks = iter(tasks)
+    in_flight = set()
+    while True:
+        for task in tasks:
+            in_flight.add(pool.submit(func, task))
+            if len(in_flight) >= max_in_flight:
+                break
+        if not in_flight:
+            return
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def load_checkpoint(fingerprint: str, num_chunks: int, checkpoint_size: int):
+    """The checkpointed embeddings matrix and its finished bucket numbers, or (None, set()) to start over"""
+    if not (os.path.exists(PROGRESS_PATH) and os.path.exists(EMBEDDINGS_PATH)):
+        return None, set()
+    try:
+        with open(PROGRESS_PATH, "r") as f:
+            progress = json.load(f)
+        embeddings = np.load(EMBEDDINGS_PATH, mmap_mode="r+")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable embedding checkpoint: {e}")
+        return None, set()
+    if (progress.get("fingerprint") != fingerprint or progress.get("checkpoint_size") != checkpoint_size
+            or embeddings.shape[0] != num_chunks):
+        return None, set()
+    return embeddings, set(progress["done"])
+
+def save_checkpoint(embeddings: np.ndarray, fingerprint: str, checkpoint_size: int, done: set):
+    """Persist finished buckets: vectors first, then the progress that vouches for them"""
+    embeddings.flush()
+    tmp_path = f"{PROGRESS_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "checkpoint_size": checkpoint_size,
+                   "num_chunks": embeddings.shape[0], "dimension": embeddings.shape[1], "done": sorted(done)}, f)
+    os.replace(tmp_path, PROGRESS_PATH)
+
+def encode_chunks(texts, encoder_backend: str = "torch", workers: int = 1, threads: int = None,
+                  batch_size: int = 32, checkpoint_size: int = CHECKPOINT_SIZE, resume: bool = True,
+                  stage: StageProfile = None) -> np.ndarray:
+    """
+    Encode texts into an on-disk .npy matrix, in parallel and resumably
+
+    Length buckets are encoded by a pool of `workers` processes with
+    `threads` inference threads each. Every finished bucket is written to
+    its rows of the memory-mapped matrix and recorded in a progress file,
+    so an interrupted build only re-encodes the buckets in flight. Texts
+    are read per bucket, and only two buckets per worker are queued, so
+    no process holds more than a few buckets of texts and vectors,
+    whatever the corpus size.
+
+    Buckets count as worker time in `stage`, even when encoded in this
+    process; writing and checkpointing them counts as busy time.
+
+    Args:
+        texts: Sequence of chunk texts, such as a TextView of a chunk store
+
+    Returns:
+        The (len(texts), d) float32 matrix, memory-mapped read-only
+    """
+    stage = stage or StageProfile("encode")
+    buckets = length_buckets(texts, checkpoint_size)
+    fingerprint = texts_fingerprint(texts, encoder_backend)
+    embeddings, done = load_checkpoint(fingerprint, len(texts), checkpoint_size) if resume else (None, set())
+    if done:
+        print(f"Resuming from checkpoint: {sum(len(buckets[n]) for n in done)} of {len(texts)} chunks already encoded")
+    elif os.path.exists(PROGRESS_PATH):
+        # Must not vouch for the rows of the new matrix
+        os.remove(PROGRESS_PATH)
+
+    pending = [n for n in range(len(buckets)) if n not in done]
+    tasks = ((n, [texts[i] for i in buckets[n]], batch_size, stage.profile_dir) for n in pending)
+    pool = None
+    if not pending:
+        results = []
+    elif workers > 1:
+        # Spawned workers start without the parent's thread pools and load their own model
+        pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_encode_worker, initargs=(encoder_backend, threads))
+        results = _imap_bounded(pool, _encode_bucket, tasks, 2 * workers)
+    else:
+        _init_encode_worker(encoder_backend, threads)
+        results = map(_encode_bucket, tasks)
+
+    start_time = time.time()
+    encoded = 0
+    try:
+        for number, vectors, task_seconds, model_seconds, profile_path in results:
+            stage.add_worker_task(task_seconds, profile_path, model_seconds=model_seconds)
+            with stage.busy():
+                if embeddings is None:
+                    os.makedirs(os.path.dirname(EMBEDDINGS_PATH), exist_ok=True)
+                    embeddings = np.lib.format.open_memmap(EMBEDDINGS_PATH, mode="w+", dtype='float32',
+                                                           shape=(len(texts), vectors.shape[1]))
+                embeddings[buckets[number]] = vectors
+                done.add(number)
+                save_checkpoint(embeddings, fingerprint, checkpoint_size, done)
+            encoded += len(vectors)
+            stage.count(chunks=len(vectors))
+            print(f"Encoded {sum(len(buckets[n]) for n in done)}/{len(texts)} chunks "
+                  f"({encoded / max(time.time() - start_time, 1e-9):.0f} chunks/s)")
+    finally:
+        if pool is not None:
+            # Buckets not started yet are dropped; an interrupted build waits for at most one per worker
+            pool.shutdown(wait=True, cancel_futures=True)
+    _encode_worker.clear()
+
+    del embeddings
+    stage.add(bytes_written=file_size(EMBEDDINGS_PATH, PROGRESS_PATH))
+    return np.load(EMBEDDINGS_PATH, mmap_mode="r")
+
+def create_embeddings(index_type: str = "flat", nlist: int = None, pq_m: int = None, hnsw_m: int = 32, train_size: int = 100000,
+                      encoder_backend: str = "torch", metric: str = "l2", shards: int = 1,
+                      partition_by: list = DEFAULT_PARTITION_FIELDS, max_partition_values: int = MAX_PARTITION_VALUES,
+                      workers: int = 1, threads: int = None,
+                      batch_size: int = 32, checkpoint_size: int = CHECKPOINT_SIZE, resume: bool = True,
+                      debug_artifacts: bool = False, profiler: RunProfiler = None):
+    """
+    Create and save embeddings using FAISS
+
+    Chunks are streamed from chunks.json into a staging copy of the chunk
+    store; encoding, sub-indexes and the JSON metadata read them back from
+    it one at a time, so memory does not grow with the chunks' text. The
+    staging store replaces chunks.store once the index is written. The
+    JSON copy of the metadata, chunks_metadata.json, is only written with
+    debug_artifacts.
+    """
+    profiler = profiler or RunProfiler("create_embeddings.py")
     os.makedirs("data/embeddings", exist_ok=True)
-    faiss.write_index(index, "data/embeddings/docs.index")
-    
-    with open("data/embeddings/chunks_metadata.json", "w") as f:
-        json.dump(chunks, f, indent=2)
-    
-    print("✅ Created and saved embeddings")
+    staging_path = f"{STORE_PATH}.next"
+    try:
+        # Load processed chunks
+        with profiler.stage("load_chunks") as stage:
+            with ChunkStoreWriter(staging_path) as writer:
+                for chunk in iter_json_array(CHUNKS_PATH):
+                    writer.add(chunk)
+            chunks = ChunkStore(staging_path)
+            stage.count(chunks=len(chunks))
+            stage.add(bytes_read=file_size(CHUNKS_PATH), bytes_written=file_size(staging_path))
+        if not len(chunks):
+            print("⚠️ No chunks to embed.")
+            return
+
+        # Create embeddings, checkpointed to disk; the index is then built from the memory-mapped matrix
+        with profiler.stage("encode", busy=False) as stage:
+            embeddings = encode_chunks(TextView(chunks), encoder_backend, workers=workers, threads=threads,
+                                       batch_size=batch_size, checkpoint_size=checkpoint_size, resume=resume,
+                                       stage=stage)
+
+        index_options = dict(index_type=index_type, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m, train_size=train_size)
+        with profiler.stage("index") as stage:
+            if shards > 1:
+                # One index per shard, searched in parallel by shard processes
+                description = write_sharded_index(embeddings, shards, "data/embeddings", metric=metric, **index_options)
+                num_vectors = len(embeddings)
+                stage.add(bytes_written=file_size(os.path.join("data/embeddings", SHARDS_DIR)))
+            else:
+                # Create FAISS index
+                index, description = build_index(embeddings, metric=metric, **index_options)
+
+                # Save the index and metadata
+                faiss.write_index(index, "data/embeddings/docs.index.tmp")
+                os.replace("data/embeddings/docs.index.tmp", "data/embeddings/docs.index")
+                num_vectors = index.ntotal
+                del index
+                stage.add(bytes_written=file_size("data/embeddings/docs.index"))
+
+            # Sub-indexes for scoped queries; without them filters run as ID selectors over the whole index.
+            # A sharded index is not partitioned: the sub-indexes would hold every vector in the coordinator
+            if partition_by and shards > 1:
+                print(f"Not writing sub-indexes for {', '.join(partition_by)}: filtered queries are searched on the shards")
+                remove_partitions("data/embeddings")
+            elif partition_by:
+                metadata = (chunks.metadata(i) for i in range(len(chunks)))
+                write_partitions(embeddings, metadata, partition_by, "data/embeddings", metric=metric,
+                                 max_values=max_partition_values, **index_options)
+                stage.add(bytes_written=file_size(os.path.join("data/embeddings", PARTITIONS_DIR)))
+            else:
+                remove_partitions("data/embeddings")
+            stage.count(vectors=num_vectors)
+
+        with profiler.stage("serialize_metadata") as stage:
+            if debug_artifacts:
+                # Written one chunk at a time, laid out as json.dump(chunks, f, indent=2) would
+                tmp_path = f"{METADATA_PATH}.tmp"
+                with open(tmp_path, "w") as f:
+                    f.write("[")
+                    for i, chunk in enumerate(chunks):
+                        f.write(",\n  " if i else "\n  ")
+                        f.write(json.dumps(chunk, indent=2).replace("\n", "\n  "))
+                    f.write("\n]" if len(chunks) else "]")
+                os.replace(tmp_path, METADATA_PATH)
+            elif os.path.exists(METADATA_PATH):
+                # An older copy would no longer match the index
+                os.remove(METADATA_PATH)
+
+            # Compact memory-mapped copy of the metadata used by the Retriever
+            os.replace(staging_path, STORE_PATH)
+            stage.count(chunks=len(chunks))
+            stage.add(bytes_written=file_size(METADATA_PATH, STORE_PATH))
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    # docs.index takes precedence over the shard manifest, so an older unsharded index must go; only now,
+    # with the chunk store rewritten, so that nothing loads the new shards with the old metadata
+    if shards > 1 and os.path.exists("data/embeddings/docs.index"):
+        os.remove("data/embeddings/docs.index")
+
+    # Written last: a running API loads the new index once this changes
+    version = write_index_version(index_type=index_type, metric=metric, num_vectors=num_vectors, shards=shards)
+
+    print(f"✅ Created and saved embeddings ({description} index, {num_vectors} vectors, "
+          f"{shards} shard{'s' if shards > 1 else ''}, version {version})")
+    return version
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create embeddings and a FAISS index for the processed chunks")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=os.environ.get("INDEX_TYPE", "flat"),
+                        help="FAISS index type (default: flat, or $INDEX_TYPE)")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF list count (default: ~4*sqrt(n))")
+    parser.add_argument("--pq-m", type=int, default=None, help="PQ sub-quantizer count (default: dimension/8)")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW graph degree")
+    parser.add_argument("--train-size", type=int, default=100000, help="Maximum number of vectors used for training")
+    parser.add_argument("--metric", choices=METRICS, default=os.environ.get("INDEX_METRIC", "l2"),
+                        help="cosine stores normalized vectors in an inner-product index (default: l2, or $INDEX_METRIC)")
+    parser.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default=os.environ.get("ENCODER_BACKEND", "torch"),
+                        help="Embedding backend (default: torch, or $ENCODER_BACKEND)")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("INDEX_SHARDS", "1")),
+                        help=f"Split the index into this many shards listed in {SHARDS_FILE}, searched in parallel "
+                             "by shard processes (default: 1, or $INDEX_SHARDS)")
+    parser.add_argument("--partition-by", nargs="*", default=DEFAULT_PARTITION_FIELDS,
+                        help="Chunk fields to build per-value sub-indexes for, so filtered queries only search "
+                             "their scope, e.g. doc_type (default: none)")
+    parser.add_argument("--max-partition-values", type=int, default=MAX_PARTITION_VALUES,
+                        help="Skip --partition-by fields with more distinct values than this "
+                             f"(default: {MAX_PARTITION_VALUES})")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("ENCODE_WORKERS", "0")) or min(DEFAULT_WORKERS, os.cpu_count() or 1),
+                        help="Encoder processes; each loads its own copy of the model and runtime, a few hundred MB "
+                             f"of RSS with the torch backend (default: {DEFAULT_WORKERS}, or $ENCODE_WORKERS)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Inference threads per encoder process (default: CPUs / workers)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Chunks encoded per model call")
+    parser.add_argument("--checkpoint-size", type=int, default=CHECKPOINT_SIZE,
+                        help=f"Chunks per length bucket, the unit of work and of checkpointing (default: {CHECKPOINT_SIZE})")
+    parser.add_argument("--debug-artifacts", action="store_true",
+                        help=f"Also write the chunk metadata as JSON to {METADATA_PATH}")
+    parser.add_argument("--no-resume", action="store_true",
+                        help=f"Re-encode everything instead of reusing the checkpoint in {EMBEDDINGS_PATH}")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    args.threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    return args
 
 if __name__ == "__main__":
-    create_embeddings()
\ No newline at end of file
+    args = parse_args()
+    profiler = RunProfiler("create_embeddings.py", profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    version = create_embeddings(
+        index_type=args.index_type,
+        nlist=args.nlist,
+        pq_m=args.pq_m,
+        hnsw_m=args.hnsw_m,
+        train_size=args.train_size,
+        encoder_backend=args.encoder_backend,
+        metric=args.metric,
+        shards=args.shards,
+        partition_by=args.partition_by,
+        max_partition_values=args.max_partition_values,
+        workers=args.workers,
+        threads=args.threads,
+        batch_size=args.batch_size,
+        checkpoint_size=args.checkpoint_size,
+        resume=not args.no_resume,
+        debug_artifacts=args.debug_artifacts,
+        profiler=profiler,
+    )
+    profiler.print_summary()
+    print(f"✅ Saved the stage profile to {profiler.write(args.profile_report, index_version=version)}")
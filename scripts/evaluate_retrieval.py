@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Measure retrieval quality against cost over a grid of retrieval settings
+
+Each question in the golden set lists the sources that answer it and a
+verbatim answer snippet. A retrieved chunk is relevant when it comes from
+one of those sources and holds at least half of the snippet, so an answer
+cut by a chunk boundary still counts. For each chunking (size, overlap), the
+bundled raw documents are re-chunked and encoded once. An index of each
+requested type is built over the chunks and searched with every combination
+of mode, k, over-fetch factor and similarity threshold, through the same
+Retriever the API uses.
+
+Reported for each combination: recall@k (the share of questions with a
+relevant chunk among those returned), MRR (mean reciprocal rank of the first
+relevant chunk), the empty rate (questions left with no chunks at all, which
+the API answers with its "I don't know" response) and mean/p99 retrieval
+latency. Query embeddings are computed once and cached, so latency measures
+the search settings rather than the model.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import faiss
+from create_embeddings import INDEX_TYPES, METRICS, build_index
+from process_data import CHUNK_OVERLAP, CHUNK_SIZE, add_dedup_arguments, chunk_document, load_raw_docs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.cache import LRUCache, normalize_query
+from src.chatbot.chunk_store import write_chunk_store
+from src.chatbot.dedup import chunk_sources, deduplicate
+from src.chatbot.encoder import ENCODER_BACKENDS, load_encoder
+from src.chatbot.lexical import write_lexical_index
+from src.chatbot.retriever import OVERFETCH, RETRIEVAL_MODES, Retriever
+
+GOLDEN_PATH = "data/eval/golden.jsonl"
+
+def load_golden(path: str) -> list:
+    """Questions with their "sources", an optional verbatim "answer" and optional "filters", one JSON object per line"""
+    golden = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if not item.get("question") or not item.get("sources"):
+                raise ValueError(f"{path}:{line_number}: every question needs a \"question\" and \"sources\"")
+            golden.append(item)
+    return golden
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case, which PDF extraction and chunking don't preserve"""
+    return " ".join(text.split()).casefold()
+
+def answer_overlap(text: str, answer: str) -> int:
+    """Characters of `answer` held by `text`: all of them, or the part left on this side of a chunk boundary"""
+    if answer in text:
+        return len(answer)
+    for size in range(len(answer) - 1, 0, -1):
+        if text.endswith(answer[:size]) or text.startswith(answer[-size:]):
+            return size
+    return 0
+
+def is_relevant(chunk: dict, item: dict) -> bool:
+    if not set(chunk_sources(chunk)) & set(item["sources"]):
+        return False
+    if not item.get("answer"):
+        return True
+    answer = normalize_text(item["answer"])
+    return 2 * answer_overlap(normalize_text(chunk["text"]), answer) >= len(answer)
+
+def parse_chunking(value: str) -> tuple:
+    """"size:overlap" as given on the command line"""
+    try:
+        size, overlap = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected SIZE:OVERLAP, got {value!r}")
+    if size <= 0 or not 0 <= overlap < size:
+        raise argparse.ArgumentTypeError(f"need 0 <= overlap < size, got {value!r}")
+    return size, overlap
+
+def make_chunks(docs: list, chunk_size: int, overlap: int, dedup_threshold: float = None) -> list:
+    """Chunk the documents as process_data.py does, with the given size and overlap"""
+    chunks = [chunk for doc in docs for chunk in chunk_document(doc, chunk_size, overlap)]
+    if chunks and dedup_threshold is not None:
+        chunks, _ = deduplicate(chunks, dedup_threshold)
+    return chunks
+
+def evaluate(retriever: Retriever, golden: list, k: int, threshold: float) -> dict:
+    """Quality and latency of the retriever's current settings over the golden set"""
+    hits = 0
+    reciprocal_ranks = 0.0
+    empty = 0
+    latencies = []
+    for item in golden:
+        start = time.perf_counter()
+        chunks = retriever.get_relevant_chunks_batch([item["question"]], k=k, threshold=threshold,
+                                                     filters=item.get("filters"))[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        if not chunks:
+            empty += 1
+        rank = next((rank for rank, chunk in enumerate(chunks, 1) if is_relevant(chunk, item)), None)
+        if rank is not None:
+            hits += 1
+            reciprocal_ranks += 1.0 / rank
+
+    latencies = np.array(latencies)
+    return {
+        "recall_at_k": round(hits / len(golden), 4),
+        "mrr": round(reciprocal_ranks / len(golden), 4),
+        "empty_rate": round(empty / len(golden), 4),
+        "latency_ms_mean": round(float(latencies.mean()), 4),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 4),
+    }
+
+def print_table(results: list):
+    columns = ["chunk_size", "overlap", "num_chunks", "index_type", "mode", "k", "overfetch", "threshold",
+               "recall_at_k", "mrr", "empty_rate", "latency_ms_mean", "latency_ms_p99"]
+    widths = [max(len(c), *(len(str(r.get(c))) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    print("  ".join("-" * w for w in widths))
+    for r in results:
+        print("  ".join(str(r.get(c)).ljust(w) for c, w in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep retrieval settings and score them against a golden question set")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="Golden question set (JSONL)")
+    parser.add_argument("--chunking", type=parse_chunking, nargs="+",
+                        default=[(CHUNK_SIZE, CHUNK_OVERLAP), (500, 50), (2000, 200)],
+                        help=f"Chunk SIZE:OVERLAP pairs (default: {CHUNK_SIZE}:{CHUNK_OVERLAP} 500:50 2000:200)")
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=["flat", "hnsw"])
+    parser.add_argument("--modes", nargs="+", choices=RETRIEVAL_MODES, default=["dense"])
+    parser.add_argument("-k", type=int, nargs="+", default=[3, 5, 10], help="Chunks per query")
+    parser.add_argument("--overfetch", type=int, nargs="+", default=[1, OVERFETCH],
+                        help=f"Candidates fetched per requested chunk (default: 1 {OVERFETCH})")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.0, 0.2, 0.4],
+                        help="Minimum similarity of a returned chunk")
+    parser.add_argument("--metric", choices=METRICS, default="l2")
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default=os.environ.get("ENCODER_BACKEND", "torch"),
+                        help="Embedding backend (default: torch, or $ENCODER_BACKEND); hash runs without a model")
+    add_dedup_arguments(parser)
+    parser.add_argument("--output", default=None, help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    golden = load_golden(args.golden)
+    docs = load_raw_docs()
+    if not docs:
+        return
+    model = load_encoder(args.encoder_backend)
+
+    # Every retriever reads query embeddings from this cache, filled once up front
+    embedding_cache = LRUCache(max_size=len(golden), ttl=0)
+    start = time.perf_counter()
+    for item in golden:
+        vector = np.asarray(model.encode([item["question"]]), dtype='float32')[0]
+        vector.setflags(write=False)
+        embedding_cache.put(normalize_query(item["question"]), vector)
+    encode_ms = (time.perf_counter() - start) * 1000 / len(golden)
+    print(f"Evaluating {len(golden)} questions; encoding a question takes {encode_ms:.2f} ms "
+          f"with the {args.encoder_backend} encoder (not included below)")
+
+    results = []
+    for chunk_size, overlap in args.chunking:
+        chunks = make_chunks(docs, chunk_size, overlap, args.dedup_threshold if args.dedup else None)
+        print(f"Chunking {chunk_size}:{overlap}: encoding {len(chunks)} chunks...")
+        embeddings = np.asarray(model.encode([chunk["text"] for chunk in chunks]), dtype='float32')
+
+        with tempfile.TemporaryDirectory() as directory:
+            store_path = os.path.join(directory, "chunks.store")
+            lexical_path = os.path.join(directory, "lexical.bm25")
+            write_chunk_store(store_path, chunks)
+            write_lexical_index(lexical_path, chunks)
+
+            for index_type in args.types:
+                try:
+                    index, description = build_index(embeddings, index_type=index_type, metric=args.metric)
+                except RuntimeError as e:
+                    print(f"⚠️ Skipping {index_type} for {len(chunks)} chunks: {e}")
+                    continue
+                index_path = os.path.join(directory, f"{index_type}.index")
+                faiss.write_index(index, index_path)
+
+                for mode in args.modes:
+                    retriever = Retriever(
+                        index_path=index_path,
+                        metadata_path=os.path.join(directory, "chunks_metadata.json"),
+                        store_path=store_path,
+                        lexical_path=lexical_path,
+                        shards_path=os.path.join(directory, "shards.json"),
+                        partitions_path=os.path.join(directory, "partitions.json"),
+                        embedding_cache=embedding_cache,
+                        model=model,
+                        nprobe=args.nprobe,
+                        ef_search=args.ef_search,
+                        mode=mode,
+                    )
+                    # The first search pays one-off setup costs
+                    retriever.get_relevant_chunks_batch([golden[0]["question"]])
+
+                    for k in args.k:
+                        for overfetch in args.overfetch:
+                            retriever.overfetch = overfetch
+                            for threshold in args.thresholds:
+                                result = {
+                                    "chunk_size": chunk_size,
+                                    "overlap": overlap,
+                                    "num_chunks": len(chunks),
+                                    "index_type": index_type,
+                                    "description": description,
+                                    "mode": mode,
+                                    "k": k,
+                                    "overfetch": overfetch,
+                                    "threshold": threshold,
+                                }
+                                result.update(evaluate(retriever, golden, k, threshold))
+                                results.append(result)
+
+    if not results:
+        print("No settings could be evaluated.")
+        return
+
+    print()
+    print_table(results)
+    best = max(results, key=lambda r: (r["recall_at_k"], r["mrr"], -r["latency_ms_mean"]))
+    print(f"\nBest recall@k: {best['recall_at_k']} (MRR {best['mrr']}) with chunking {best['chunk_size']}:{best['overlap']}, "
+          f"{best['index_type']} {best['mode']} search, k={best['k']}, overfetch={best['overfetch']}, "
+          f"threshold={best['threshold']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "golden": args.golden,
+                "num_questions": len(golden),
+                "encoder_backend": args.encoder_backend,
+                "encode_ms_mean": round(encode_ms, 4),
+                "metric": args.metric,
+                "results": results,
+            }, f, indent=2)
+        print(f"\n✅ Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
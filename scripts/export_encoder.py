@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Export the embedding model for offline CPU inference
+
+Writes into --output-dir (default models/all-MiniLM-L6-v2):
+
+- the SentenceTransformer files, loaded by the "torch" backend
+- model.onnx, the transformer exported for ONNX Runtime ("onnx" backend)
+- model_int8.onnx, the same graph with dynamically int8-quantized weights ("onnx_int8")
+- encoder_config.json, the pooling and tokenizer settings the ONNX backends need
+
+Run once with network access; afterwards every backend loads from these
+files only. Compare the backends with scripts/benchmark_encoder.py.
+"""
+import argparse
+import json
+import os
+import sys
+import torch
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.encoder import MODEL_NAME, MODEL_DIR, CONFIG_FILE, ONNX_FILES
+
+def export_encoder(output_dir: str = MODEL_DIR, model_name: str = MODEL_NAME, opset: int = 14):
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Loading {model_name}...")
+    model = SentenceTransformer(model_name, device="cpu")
+    model.save(output_dir)
+
+    transformer = model[0].auto_model.eval()
+    tokenizer = model.tokenizer
+    pooling = model[1].get_pooling_mode_str()
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling mode {pooling!r}")
+
+    config = {
+        "model_name": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling,
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "pad_token": tokenizer.pad_token,
+        "pad_id": tokenizer.pad_token_id,
+    }
+    with open(os.path.join(output_dir, CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+
+    # Batch and sequence length stay dynamic in the exported graph
+    sample = tokenizer(["An example sentence", "Another one"], padding=True, return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    onnx_path = os.path.join(output_dir, ONNX_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]},
+            opset_version=opset,
+        )
+    print(f"✅ Exported ONNX graph to {onnx_path}")
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.join(output_dir, ONNX_FILES["onnx_int8"])
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"✅ Wrote int8-quantized graph to {int8_path}")
+
+    for name in ("onnx", "onnx_int8"):
+        size = os.path.getsize(os.path.join(output_dir, ONNX_FILES[name])) / 1e6
+        print(f"   {ONNX_FILES[name]}: {size:.1f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model to local torch and ONNX files")
+    parser.add_argument("--output-dir", default=MODEL_DIR)
+    parser.add_argument("--model-name", default=MODEL_NAME)
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+    export_encoder(args.output_dir, args.model_name, args.opset)
@@ -0,0 +1,244 @@
+"""
+Extract the text of the crawled support articles into a JSONL file
+
+Raw pages are read from the crawl output (crawl_state.json and pages/, see
+crawl_angelone.py), parsed with lxml and stripped of boilerplate across a
+process pool. Each article becomes one record with its URL as the source,
+so it can be chunked, encoded and indexed like a PDF. Pages are streamed
+from disk in bounded batches, so memory does not grow with the corpus.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Iterable, Iterator, List, Tuple
+import lxml.html
+from lxml import etree
+from process_data import iter_json_array, iter_json_field
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.profiling import RunProfiler, StageProfile, add_profiling_arguments, file_size, profile_call
+
+HTML_DIR = "data/raw_html"
+HTML_PAGES_PATH = "data/raw_text/angelone_pages.jsonl"
+
+# Pages are stored as fetched; like the crawler, read them as UTF-8 whatever they declare
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+# Content containers: main, article, .article-content, #content and .content, in that order of
+# preference (see _selector_rank); one XPath finds all candidates in a single pass over the tree
+CONTENT_XPATH = etree.XPath(
+    "//main | //article"
+    " | //*[contains(concat(' ', normalize-space(@class), ' '), ' article-content ')]"
+    " | //*[@id='content']"
+    " | //*[contains(concat(' ', normalize-space(@class), ' '), ' content ')]"
+)
+BOILERPLATE_TAGS = ["script", "style", "noscript", "template", "svg", "iframe", "form", "nav", "header", "footer", "aside"]
+BOILERPLATE_XPATH = etree.XPath(
+    ".//*[@role='navigation' or @role='banner' or @role='contentinfo' or @aria-hidden='true' or @hidden]"
+)
+# Elements that start and end a line of text
+BLOCK_TAGS = ["address", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "h1", "h2", "h3", "h4", "h5",
+              "h6", "hr", "li", "ol", "p", "pre", "section", "table", "td", "th", "tr", "ul"]
+
+def page_file(pages_dir: str, url: str) -> str:
+    """Path of the raw HTML of a URL, as stored by crawl_angelone.py"""
+    return os.path.join(pages_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html")
+
+def _selector_rank(element) -> int:
+    """Preference of the first content selector the element matches; lower is better"""
+    classes = f" {' '.join((element.get('class') or '').split())} "
+    if element.tag == "main":
+        return 0
+    if element.tag == "article":
+        return 1
+    if " article-content " in classes:
+        return 2
+    if element.get("id") == "content":
+        return 3
+    return 4
+
+def extract_article(html) -> Tuple[str, str]:
+    """
+    Parse a page and return its (title, main text)
+
+    The first content container found by the most specific selector is
+    kept; without one, the whole body is. Scripts, navigation, headers,
+    footers and hidden elements are dropped, and the text is returned one
+    block element per line.
+    """
+    if isinstance(html, str):
+        html = html.encode("utf-8")
+    if not html.strip():
+        return "", ""
+    try:
+        root = lxml.html.document_fromstring(html, parser=HTML_PARSER)
+    except (etree.ParserError, ValueError):
+        return "", ""
+
+    title = " ".join((root.findtext(".//title") or "").split())
+    candidates = CONTENT_XPATH(root)
+    if candidates:
+        # Document order breaks ties, like taking the first match of a selector
+        content = min(candidates, key=_selector_rank)
+    else:
+        content = root.body if root.find("body") is not None else root
+
+    etree.strip_elements(content, *BOILERPLATE_TAGS, with_tail=False)
+    for element in BOILERPLATE_XPATH(content):
+        element.drop_tree()
+    for element in content.iter(*BLOCK_TAGS):
+        element.text = "\n" + element.text if element.text else "\n"
+        element.tail = "\n" + element.tail if element.tail else "\n"
+
+    lines = (" ".join(line.split()) for line in content.text_content().splitlines())
+    text = "\n".join(line for line in lines if line)
+    if not title:
+        title = " ".join((root.findtext(".//h1") or "").split())
+    return title, text
+
+def extract_text_from_html(html) -> str:
+    return extract_article(html)[1]
+
+def extract_html_files(pages: List[Tuple[str, str]]) -> List[Dict]:
+    """Extract a batch of (url, path) pages into page records; runs in a worker process"""
+    records = []
+    for url, path in pages:
+        try:
+            with open(path, "rb") as f:
+                title, text = extract_article(f.read())
+        except OSError as e:
+            print(f"Error reading {path} ({url}): {e}")
+            continue
+        records.append({"source": url, "type": "html", "title": title, "text": text})
+    return records
+
+def iter_crawled_pages(html_dir: str = HTML_DIR) -> Iterator[Tuple[str, str]]:
+    """Yield (url, path) for every page the last crawl fetched or verified"""
+    state_path = os.path.join(html_dir, "crawl_state.json")
+    if not os.path.exists(state_path):
+        return
+    pages_dir = os.path.join(html_dir, "pages")
+    # Entries are read one at a time, however many URLs the crawl knows
+    for url, entry in iter_json_field(state_path, "urls"):
+        path = page_file(pages_dir, url)
+        # A page that is now gone or failing keeps its old file, but is no longer served
+        if entry.get("status") in (200, 304) and os.path.exists(path):
+            yield url, path
+
+def has_crawled_pages(html_dir: str = HTML_DIR) -> bool:
+    """Whether a crawl left pages to ingest in html_dir"""
+    if next(iter_crawled_pages(html_dir), None) is not None:
+        return True
+    docs_path = os.path.join(html_dir, "angelone_docs.json")
+    return os.path.exists(docs_path) and next(iter_json_array(docs_path), None) is not None
+
+def iter_html_pages(html_dir: str = HTML_DIR, workers: int = None, pages_per_task: int = 32,
+                    stage: StageProfile = None, pages: Iterable[Tuple[str, str]] = None) -> Iterator[Dict]:
+    """
+    Extract all crawled pages, yielding one record per page as batches finish
+
+    Batches of pages are parsed across a process pool, with a bounded number
+    of batches in flight. Without raw pages, the text already extracted into
+    angelone_docs.json by an older crawl is streamed instead.
+
+    Args:
+        stage: Optional StageProfile credited with the HTML bytes and pages,
+            and with the workers' parsing time
+        pages: (url, path) pairs to extract (default: every crawled page)
+    """
+    stage = stage or StageProfile("extract_html")
+    crawled = pages is None
+    pages = iter(iter_crawled_pages(html_dir) if crawled else pages)
+    first = next(pages, None)
+    if first is None:
+        docs_path = os.path.join(html_dir, "angelone_docs.json")
+        if crawled and os.path.exists(docs_path):
+            stage.add(bytes_read=file_size(docs_path))
+            for doc in iter_json_array(docs_path):
+                if doc.get("url") and doc.get("content"):
+                    stage.count(pages=1)
+                    yield {"source": doc["url"], "type": "html", "title": "", "text": doc["content"]}
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+
+    def tasks():
+        batch = [first]
+        for page in pages:
+            if len(batch) >= pages_per_task:
+                yield batch
+                batch = []
+            batch.append(page)
+        yield batch
+
+    # Spawned, not forked: prepare_data.py starts this pool while its encoder thread runs model thread pools
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = set()
+        task_iter = tasks()
+        while True:
+            # Keep a bounded number of batches queued in the pool
+            for batch in task_iter:
+                stage.add(bytes_read=file_size(*(path for _, path in batch)))
+                in_flight.add(pool.submit(profile_call, stage.profile_dir, extract_html_files, batch))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                with stage.busy():
+                    records, seconds, profile_path = future.result()
+                    stage.add_worker_task(seconds, profile_path)
+                    records = [record for record in records if record["text"]]
+                stage.count(pages=len(records))
+                yield from records
+
+def process_html_pages(html_dir: str = HTML_DIR, output_path: str = HTML_PAGES_PATH, workers: int = None,
+                       pages_per_task: int = 32, profiler: RunProfiler = None) -> int:
+    """
+    Extract all crawled pages into a JSONL file with one record per page
+
+    Returns:
+        Number of pages with extracted text
+    """
+    profiler = profiler or RunProfiler("extract_html.py")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    pages = 0
+    tmp_path = f"{output_path}.tmp"
+    with profiler.stage("extract_html", busy=False) as extract, \
+            profiler.stage("serialize_html", busy=False) as serialize:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in iter_html_pages(html_dir, workers=workers, pages_per_task=pages_per_task, stage=extract):
+                with serialize.busy():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                pages += 1
+        serialize.count(pages=pages)
+        serialize.add(bytes_written=file_size(tmp_path))
+
+    if not pages:
+        os.remove(tmp_path)
+        print(f"No crawled pages found in {html_dir}. Run scripts/crawl_angelone.py first.")
+        return 0
+    os.replace(tmp_path, output_path)
+    print(f"✅ Extracted text from {pages} HTML pages into {output_path}.")
+    return pages
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract the text of crawled HTML pages into a JSONL file")
+    parser.add_argument("--html-dir", default=HTML_DIR, help="Output directory of crawl_angelone.py")
+    parser.add_argument("--output", default=HTML_PAGES_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=32, help="Pages parsed per worker task")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    profiler = RunProfiler("extract_html.py", profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    process_html_pages(args.html_dir, args.output, workers=args.workers, pages_per_task=args.pages_per_task,
+                       profiler=profiler)
+    profiler.print_summary()
+    print(f"✅ Saved the stage profile to {profiler.write(args.profile_report)}")
@@ -1,63 +1,201 @@
+import argparse
 import os
 import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import fitz  # PyMuPDF
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.profiling import RunProfiler, StageProfile, add_profiling_arguments, file_size, profile_call
+
+PAGES_PATH = "data/raw_text/insurance_pages.jsonl"
+
 def extract_text_from_pdf(pdf_path):
     """Extract text from a PDF file"""
     print(f"Processing PDF: {pdf_path}")
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-        return text
+        with fitz.open(pdf_path) as doc:
+            return "".join(page.get_text() for page in doc)
     except Exception as e:
         print(f"Error extracting text from {pdf_path}: {e}")
         return ""
 
-def process_insurance_pdfs(pdf_dir="data/pdfs"):
-    """Process all insurance PDF files in the directory"""
-    # Create output directory if it doesn't exist
-    os.makedirs("data/raw_text", exist_ok=True)
-    
+def extract_page_range(pdf_path, start, end):
+    """Extract the text of pages [start, end) of a PDF; runs in a worker process"""
+    try:
+        with fitz.open(pdf_path) as doc:
+            return [(page_num, doc.load_page(page_num).get_text()) for page_num in range(start, end)]
+    except Exception as e:
+        print(f"Error extracting pages {start}-{end} of {pdf_path}: {e}")
+        return [(page_num, "") for page_num in range(start, end)]
+
+def page_count(pdf_path):
+    try:
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    except Exception as e:
+        print(f"Error opening {pdf_path}: {e}")
+        return 0
+
+class PageOrderer:
+    def __init__(self, pdf_file, num_pages):
+        """
+        Release one document's pages in page order as they arrive out of order
+
+        Only pages that arrived ahead of a missing earlier page are held back,
+        which keeps character offsets into the full document text exact.
+        """
+        self.pdf_file = pdf_file
+        self.num_pages = num_pages
+        self.pending = {}
+        self.next_page = 0
+        self.char_offset = 0
+
+    def add(self, pages):
+        """Accept extracted (page_num, text) pairs and return the page records now in order"""
+        for page_num, text in pages:
+            self.pending[page_num] = text
+        records = []
+        while self.next_page in self.pending:
+            text = self.pending.pop(self.next_page)
+            records.append({
+                "source": self.pdf_file,
+                "type": "pdf",
+                "page": self.next_page + 1,
+                "page_count": self.num_pages,
+                "char_start": self.char_offset,
+                "char_end": self.char_offset + len(text),
+                "text": text,
+            })
+            self.char_offset += len(text)
+            self.next_page += 1
+        return records
+
+def list_pdfs(pdf_dir="data/pdfs"):
+    """Return the PDF file names in the directory, creating it if missing"""
     # Check if PDF directory exists
     if not os.path.exists(pdf_dir):
         print(f"PDF directory {pdf_dir} not found. Creating it...")
         os.makedirs(pdf_dir, exist_ok=True)
         print(f"Please place insurance PDFs in the {pdf_dir} directory and run again.")
         return []
-    
+
     # Get all PDF files
-    pdf_files = [f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
-    
+    pdf_files = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf'))
+
     if not pdf_files:
         print(f"No PDF files found in {pdf_dir}. Please add some PDFs and run again.")
-        return []
-    
-    extracted_docs = []
-    
-    # Process each PDF
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_dir, pdf_file)
-        text = extract_text_from_pdf(pdf_path)
-        
-        if text:
-            doc = {
-                "source": pdf_file,
-                "content": text,
-                "type": "pdf"
-            }
-            extracted_docs.append(doc)
-    
-    # Save extracted text
-    if extracted_docs:
-        with open("data/raw_text/insurance_docs.json", "w", encoding="utf-8") as f:
-            json.dump(extracted_docs, f, indent=2, ensure_ascii=False)
-        
-        print(f"✅ Extracted text from {len(extracted_docs)} PDF documents.")
-    
-    return extracted_docs
+    return pdf_files
+
+def iter_pdf_pages(pdf_dir="data/pdfs", workers=None, pages_per_task=8, stage: StageProfile = None,
+                   pdf_files=None):
+    """
+    Extract all PDFs in the directory, yielding one record per page
+
+    Page ranges are extracted across a process pool and yielded as they
+    finish, so memory is bounded by the number of tasks in flight rather
+    than by the size of the corpus. Pages of one document are yielded in
+    order; pages of different documents may interleave.
+
+    Args:
+        stage: Optional StageProfile credited with the PDF bytes, pages and
+            documents, and with the workers' time inside PyMuPDF; only
+            handling finished page ranges counts as its busy time
+        pdf_files: Names of the PDFs in pdf_dir to extract (default: all)
+    """
+    stage = stage or StageProfile("extract")
+    pdf_files = list_pdfs(pdf_dir) if pdf_files is None else pdf_files
+    if not pdf_files:
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 2
+
+    def tasks():
+        # Split every document into page-range tasks, opening each PDF only when needed
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(pdf_dir, pdf_file)
+            num_pages = page_count(pdf_path)
+            stage.add(bytes_read=file_size(pdf_path))
+            print(f"Processing PDF: {pdf_path} ({num_pages} pages)", flush=True)
+            for start in range(0, num_pages, pages_per_task):
+                yield pdf_file, pdf_path, num_pages, start, min(start + pages_per_task, num_pages)
+
+    orderers = {}
+    # Spawned, not forked: prepare_data.py starts this pool while its encoder thread runs model thread pools
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = {}
+        task_iter = tasks()
+        while True:
+            # Keep a bounded number of page ranges queued in the pool
+            for pdf_file, pdf_path, num_pages, start, end in task_iter:
+                if pdf_file not in orderers:
+                    orderers[pdf_file] = PageOrderer(pdf_file, num_pages)
+                in_flight[pool.submit(profile_call, stage.profile_dir, extract_page_range, pdf_path, start, end)] = pdf_file
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                with stage.busy():
+                    orderer = orderers[in_flight.pop(future)]
+                    pages, seconds, profile_path = future.result()
+                    stage.add_worker_task(seconds, profile_path)
+                    records = orderer.add(pages)
+                stage.count(pages=len(records))
+                yield from records
+                if orderer.next_page >= orderer.num_pages:
+                    stage.count(documents=1)
+                    del orderers[orderer.pdf_file]
+
+def process_insurance_pdfs(pdf_dir="data/pdfs", output_path=PAGES_PATH, workers=None, pages_per_task=8,
+                           profiler: RunProfiler = None):
+    """
+    Extract all PDFs in the directory into a JSONL file with one record per page
+
+    Returns:
+        Number of documents with extracted text
+    """
+    profiler = profiler or RunProfiler("extract_pdf.py")
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    chars = {}
+    pages = 0
+    tmp_path = f"{output_path}.tmp"
+    # Extracting pages and writing them as JSON lines alternate; each is timed as its own stage
+    with profiler.stage("extract", busy=False) as extract, profiler.stage("serialize_pages", busy=False) as serialize:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in iter_pdf_pages(pdf_dir, workers=workers, pages_per_task=pages_per_task, stage=extract):
+                with serialize.busy():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                chars[record["source"]] = chars.get(record["source"], 0) + len(record["text"])
+                pages += 1
+        serialize.count(pages=pages)
+        serialize.add(bytes_written=file_size(tmp_path))
+
+    if not pages:
+        os.remove(tmp_path)
+        return 0
+    os.replace(tmp_path, output_path)
+
+    extracted = sum(1 for count in chars.values() if count > 0)
+    print(f"✅ Extracted text from {extracted} PDF documents ({pages} pages) into {output_path}.")
+    return extracted
 
 if __name__ == "__main__":
-    process_insurance_pdfs() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract PDF text page by page into a JSONL file")
+    parser.add_argument("--pdf-dir", default="data/pdfs")
+    parser.add_argument("--output", default=PAGES_PATH)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--pages-per-task", type=int, default=8, help="Pages extracted per worker task")
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    profiler = RunProfiler("extract_pdf.py", profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    process_insurance_pdfs(args.pdf_dir, args.output, workers=args.workers, pages_per_task=args.pages_per_task,
+                           profiler=profiler)
+    profiler.print_summary()
+    print(f"✅ Saved the stage profile to {profiler.write(args.profile_report)}")
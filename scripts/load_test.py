@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Load-test the chat API and report throughput, latency percentiles and per-stage timings
+
+Drives /chat, /chat/batch or /chat/stream with a fixed number of
+concurrent clients (closed loop) or at a fixed arrival rate (open loop,
+--rate). Latency in open-loop runs is measured from each request's
+scheduled arrival, so a backed-up server is not hidden by clients that
+wait for it. For /chat/stream, time to first byte is reported as well.
+
+Per-stage timings (queue, encode, search, generate, serialize) come from
+the Server-Timing header the API adds when sent "X-Request-Timing: 1".
+
+Targets:
+  --url http://localhost:8000   a running server
+  --offline                     the app in-process over a synthetic index and
+                                the hash encoder; no model download, deterministic
+
+Results are printed and written as JSON (--output) so runs can be diffed
+between commits.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import httpx
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from src.chatbot.chunk_store import open_chunk_store, write_chunk_store
+from src.chatbot.encoder import HashEncoder
+from src.chatbot.index_manager import write_index_version
+from src.chatbot.lexical import write_lexical_index
+from create_embeddings import INDEX_TYPES, METRICS, build_index, write_sharded_index
+
+ENDPOINTS = {"chat": "/chat", "batch": "/chat/batch", "stream": "/chat/stream"}
+STAGES = ["queue", "encode", "search", "generate", "serialize"]
+
+TOPIC_WORDS = (
+    "account margin order trade demat brokerage charges fund transfer withdrawal deposit kyc nominee "
+    "equity delivery intraday futures options expiry strike premium portfolio holdings pledge ipo "
+    "mutual sip redemption statement contract note tax report ledger settlement segment activation "
+    "password login otp app web limit stop loss bracket cover gtt alert watchlist chart dividend bonus"
+).split()
+
+def synthetic_corpus(num_chunks: int, seed: int = 42):
+    """Chunks over a Zipf-distributed vocabulary, so terms have realistic frequencies"""
+    rng = np.random.default_rng(seed)
+    vocabulary = TOPIC_WORDS + [f"term{i}" for i in range(5000)]
+    weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+    weights /= weights.sum()
+
+    chunks = []
+    for i in range(num_chunks):
+        words = rng.choice(len(vocabulary), int(rng.integers(60, 160)), p=weights)
+        chunks.append({
+            "text": " ".join(vocabulary[w] for w in words),
+            "source": f"synthetic_{i // 20}.pdf",
+            "page": i % 20 + 1,
+            "chunk_id": i,
+        })
+    return chunks
+
+def build_offline_index(directory: str, num_chunks: int, index_type: str, metric: str, seed: int = 42,
+                        shards: int = 1):
+    """Write docs.index (or shards), chunks.store, lexical.bm25 and version.json under directory/data/embeddings"""
+    embeddings_dir = os.path.join(directory, "data", "embeddings")
+    os.makedirs(embeddings_dir, exist_ok=True)
+
+    chunks = synthetic_corpus(num_chunks, seed)
+    embeddings = HashEncoder().encode([chunk["text"] for chunk in chunks], batch_size=256)
+    if shards > 1:
+        description = write_sharded_index(embeddings, shards, embeddings_dir, metric=metric, index_type=index_type,
+                                          seed=seed)
+    else:
+        index, description = build_index(embeddings, index_type, seed=seed, metric=metric)
+        import faiss
+        faiss.write_index(index, os.path.join(embeddings_dir, "docs.index"))
+    write_chunk_store(os.path.join(embeddings_dir, "chunks.store"), chunks)
+    write_lexical_index(os.path.join(embeddings_dir, "lexical.bm25"), chunks)
+    write_index_version(embeddings_dir, index_type=index_type, metric=metric, num_vectors=num_chunks,
+                        shards=shards)
+    print(f"Built synthetic {description} index over {num_chunks} chunks in {shards} shard(s)")
+    return chunks
+
+def queries_from_chunks(chunks, num_queries: int, seed: int = 0):
+    """Query-length snippets of random chunks"""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for i in rng.integers(0, len(chunks), num_queries):
+        words = chunks[int(i)]["text"].split()
+        start = int(rng.integers(0, max(1, len(words) - 8)))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+def load_queries(args, chunks=None):
+    if args.queries:
+        with open(args.queries, "r") as f:
+            return [line.strip() for line in f if line.strip()]
+    if chunks is None:
+        chunks = open_chunk_store(args.store_path, args.metadata_path)
+    return queries_from_chunks(chunks, args.num_queries, args.seed)
+
+def parse_events(body: str) -> list:
+    """(event, data) pairs of a Server-Sent Events body"""
+    events = []
+    for block in body.split("\n\n"):
+        lines = block.splitlines()
+        event = next((line[6:].strip() for line in lines if line.startswith("event:")), "message")
+        data = "\n".join(line[5:].strip() for line in lines if line.startswith("data:"))
+        if data:
+            events.append((event, json.loads(data)))
+    return events
+
+def parse_server_timing(header: str) -> dict:
+    """Stage durations in milliseconds from a Server-Timing header"""
+    stages = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and value:
+                stages[name] = float(value)
+    return stages
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, queries: list, endpoint: str = "chat", concurrency: int = 8,
+                 rate: float = 0.0, num_requests: int = 500, duration: float = None, batch_size: int = 16,
+                 unique: bool = False, seed: int = 0):
+        self.client = client
+        self.queries = queries
+        self.endpoint = endpoint
+        self.concurrency = concurrency
+        self.rate = rate
+        self.num_requests = num_requests
+        self.duration = duration
+        self.batch_size = batch_size
+        self.unique = unique
+        self.rng = np.random.default_rng(seed)
+        self.samples = []
+        self._sent = 0
+
+    def _next_payload(self):
+        """Payload of the next request, or None once the run is over"""
+        if self.duration is None and self._sent >= self.num_requests:
+            return None
+        if self.duration is not None and time.perf_counter() - self._start >= self.duration:
+            return None
+        n = self._sent
+        self._sent += 1
+        count = self.batch_size if self.endpoint == "batch" else 1
+        texts = []
+        for j in range(count):
+            text = self.queries[int(self.rng.integers(0, len(self.queries)))]
+            # A distinct text per query keeps the exact response cache from answering it
+            texts.append(f"{text} q{n * count + j}" if self.unique else text)
+        return {"texts": texts} if self.endpoint == "batch" else {"text": texts[0]}
+
+    async def _post_stream(self, payload: dict, scheduled_at: float, sample: dict) -> list:
+        """Read a streamed answer, noting when its first bytes arrived; returns the final responses"""
+        async with self.client.stream("POST", ENDPOINTS["stream"], json=payload,
+                                      headers={"X-Request-Timing": "1"}) as response:
+            sample["status"] = response.status_code
+            sample["stages"] = parse_server_timing(response.headers.get("server-timing", ""))
+            body = []
+            async for text in response.aiter_text():
+                if not body:
+                    sample["ttfb_ms"] = (time.perf_counter() - scheduled_at) * 1000
+                body.append(text)
+        if response.status_code != 200:
+            return []
+        events = parse_events("".join(body))
+        sample["error"] = any(event == "error" for event, _ in events)
+        return [data for event, data in events if event == "done"]
+
+    async def _send(self, payload: dict, scheduled_at: float):
+        sample = {"queries": len(payload.get("texts", [None])), "stages": {}, "cache": [], "error": False}
+        try:
+            if self.endpoint == "stream":
+                answers = await self._post_stream(payload, scheduled_at, sample)
+            else:
+                response = await self.client.post(
+                    ENDPOINTS[self.endpoint], json=payload, headers={"X-Request-Timing": "1"}
+                )
+                sample["status"] = response.status_code
+                sample["stages"] = parse_server_timing(response.headers.get("server-timing", ""))
+                body = response.json() if response.status_code == 200 else {}
+                answers = body.get("results", [body]) if body else []
+            sample["error"] = sample["error"] or sample["status"] != 200 or any(a.get("error") for a in answers)
+            sample["cache"] = [(a.get("debug_info") or {}).get("cache") for a in answers]
+        except Exception as e:
+            sample["status"] = None
+            sample["error"] = True
+            sample["exception"] = type(e).__name__
+        sample["latency_ms"] = (time.perf_counter() - scheduled_at) * 1000
+        self.samples.append(sample)
+
+    async def _closed_loop_client(self):
+        while True:
+            payload = self._next_payload()
+            if payload is None:
+                return
+            await self._send(payload, time.perf_counter())
+
+    async def _open_loop(self):
+        # Poisson arrivals; at most `concurrency` requests are in flight
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        next_arrival = time.perf_counter()
+
+        async def send_when_free(payload, scheduled_at):
+            async with slots:
+                await self._send(payload, scheduled_at)
+
+        while True:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            payload = self._next_payload()
+            if payload is None:
+                break
+            tasks.append(asyncio.create_task(send_when_free(payload, next_arrival)))
+            next_arrival += self.rng.exponential(1.0 / self.rate)
+        await asyncio.gather(*tasks)
+
+    async def run(self) -> float:
+        self._start = time.perf_counter()
+        if self.rate > 0:
+            await self._open_loop()
+        else:
+            await asyncio.gather(*(self._closed_loop_client() for _ in range(self.concurrency)))
+        return time.perf_counter() - self._start
+
+def percentiles(values) -> dict:
+    if not len(values):
+        return {}
+    values = np.asarray(values, dtype='float64')
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+def summarize(samples: list, elapsed: float) -> dict:
+    ok = [s for s in samples if not s["error"]]
+    tiers = [tier for s in ok for tier in s["cache"]]
+    num_queries = sum(s["queries"] for s in ok)
+    statuses = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_rate": round((len(samples) - len(ok)) / len(samples), 4) if samples else 0.0,
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+        "queries_per_s": round(num_queries / elapsed, 2) if elapsed > 0 else None,
+        "cache_hit_rate": round(sum(t is not None for t in tiers) / len(tiers), 4) if tiers else 0.0,
+        "cache_hits": {tier: tiers.count(tier) for tier in ("exact", "semantic")},
+        "latency_ms": percentiles([s["latency_ms"] for s in ok]),
+        "ttfb_ms": percentiles([s["ttfb_ms"] for s in ok if "ttfb_ms" in s]),
+        # Cached responses skip retrieval, so stages are summarized over the requests that ran them
+        "stages_ms": {
+            stage: percentiles([s["stages"][stage] for s in ok if stage in s["stages"]])
+            for stage in STAGES + ["total"]
+        },
+    }
+
+def print_report(report: dict):
+    summary = report["summary"]
+    print(f"\nRequests: {summary['requests']}  errors: {summary['errors']} ({summary['error_rate']:.2%})  "
+          f"elapsed: {summary['elapsed_s']}s")
+    print(f"Throughput: {summary['throughput_rps']} req/s, {summary['queries_per_s']} queries/s  "
+          f"cache hit rate: {summary['cache_hit_rate']:.2%}")
+
+    columns = ["stage", "mean", "p50", "p95", "p99", "max"]
+    rows = [{"stage": "latency", **summary["latency_ms"]}]
+    if summary["ttfb_ms"]:
+        rows.append({"stage": "ttfb", **summary["ttfb_ms"]})
+    rows += [{"stage": stage, **values} for stage, values in summary["stages_ms"].items() if values]
+    widths = [max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns]
+    print("\n" + "  ".join(c.ljust(w) for c, w in zip(columns, widths)) + "   (ms)")
+    print("  ".join("-" * w for w in widths))
+    for r in rows:
+        print("  ".join(str(r.get(c, "")).ljust(w) for c, w in zip(columns, widths)))
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+async def run_against_app(args, queries) -> tuple:
+    """Serve the app in-process; the working directory must hold the index to load"""
+    from src.api.main import app
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=args.timeout) as client:
+            return await run_load(client, args, queries)
+    finally:
+        await app.router.shutdown()
+
+async def run_load(client, args, queries) -> tuple:
+    if args.warmup:
+        warmup = LoadTest(client, queries, args.endpoint, args.concurrency, num_requests=args.warmup,
+                          batch_size=args.batch_size, seed=args.seed + 1)
+        await warmup.run()
+    test = LoadTest(client, queries, args.endpoint, args.concurrency, args.rate, args.requests, args.duration,
+                    args.batch_size, args.unique_queries, args.seed)
+    elapsed = await test.run()
+    return test.samples, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat API")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running API, e.g. http://localhost:8000")
+    target.add_argument("--offline", action="store_true",
+                        help="Run the app in-process over a synthetic index with the hash encoder")
+    parser.add_argument("--endpoint", choices=list(ENDPOINTS), default="chat")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients (max in flight with --rate)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open-loop arrival rate in requests/s; 0 for closed loop")
+    parser.add_argument("--requests", type=int, default=500, help="Requests to send")
+    parser.add_argument("--duration", type=float, default=None, help="Run for this many seconds instead of --requests")
+    parser.add_argument("--warmup", type=int, default=20, help="Requests sent before measuring")
+    parser.add_argument("--batch-size", type=int, default=16, help="Queries per /chat/batch request")
+    parser.add_argument("--queries", default=None, help="File with one query per line (default: snippets of the chunks)")
+    parser.add_argument("--num-queries", type=int, default=200, help="Distinct queries generated without --queries")
+    parser.add_argument("--unique-queries", action="store_true", help="Make every query text distinct to bypass the exact cache")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--store-path", default="data/embeddings/chunks.store")
+    parser.add_argument("--metadata-path", default="data/embeddings/chunks_metadata.json")
+    parser.add_argument("--num-chunks", type=int, default=10000, help="Synthetic index size with --offline")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="Synthetic index type with --offline")
+    parser.add_argument("--metric", choices=METRICS, default="l2", help="Synthetic index metric with --offline")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the synthetic index into shards served by local shard processes with --offline")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    # One log line per request would skew the client's own timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output",)}
+    config["commit"] = git_commit()
+    output = os.path.abspath(args.output) if args.output else None
+
+    if args.offline:
+        with tempfile.TemporaryDirectory() as directory:
+            chunks = build_offline_index(directory, args.num_chunks, args.index_type, args.metric, args.seed,
+                                         args.shards)
+            queries = load_queries(args, chunks)
+            # The app reads its index from relative paths and its settings at import
+            os.environ["ENCODER_BACKEND"] = "hash"
+            os.environ["INDEX_WATCH_INTERVAL"] = "0"
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                samples, elapsed = asyncio.run(run_against_app(args, queries))
+            finally:
+                os.chdir(cwd)
+    else:
+        queries = load_queries(args)
+
+        async def run_remote():
+            async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+                return await run_load(client, args, queries)
+        samples, elapsed = asyncio.run(run_remote())
+
+    report = {"config": config, "summary": summarize(samples, elapsed)}
+    print_report(report)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Saved results to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Angel One support site, for exercising crawl_angelone.py
+
+Serves a sitemap index, a nested sitemap and N fake support articles. Article
+responses carry an ETag and Last-Modified and answer conditional requests with
+304 Not Modified. Every request is logged with its status, so resumption and
+conditional recrawls can be checked by eye:
+
+    python scripts/mock_support_site.py --articles 200 --port 8765
+    python scripts/crawl_angelone.py --sitemap-url http://127.0.0.1:8765/sitemap.xml \\
+        --output-dir /tmp/crawl --rate 100 --burst 20
+"""
+import argparse
+import hashlib
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAST_MODIFIED = formatdate(0, usegmt=True)
+
+def article_html(article_id: int, version: int) -> bytes:
+    return f"""<html><head><title>Article {article_id}</title><style>p {{}}</style></head>
+<body><nav>Home | Support</nav><header>Angel One Support</header>
+<main><h1>How do I use feature {article_id}?</h1>
+<p>Feature {article_id} lets you manage your account. Revision {version}.</p>
+<p>Open the app, go to settings and choose feature {article_id}.</p></main>
+<footer>Copyright</footer><script>track();</script></body></html>""".encode("utf-8")
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "text/html", headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        base = f"http://{self.headers.get('Host')}"
+
+        if self.path == "/sitemap.xml":
+            body = f"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+<sitemap><loc>{base}/sitemap-support.xml</loc></sitemap>
+</sitemapindex>""".encode("utf-8")
+            return self._send(200, body, "application/xml")
+
+        if self.path == "/sitemap-support.xml":
+            urls = "".join(f"<url><loc>{base}/support/article/{i}</loc></url>" for i in range(server.articles))
+            body = f"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>""".encode("utf-8")
+            return self._send(200, body, "application/xml")
+
+        if self.path.startswith("/support/article/"):
+            try:
+                article_id = int(self.path.rsplit("/", 1)[1])
+            except ValueError:
+                return self._send(404)
+            if not 0 <= article_id < server.articles:
+                return self._send(404)
+
+            # Articles listed in --changed get a new revision on every request
+            version = server.requests if article_id in server.changed else 0
+            body = article_html(article_id, version)
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers={"ETag": etag})
+            return self._send(200, body, headers={"ETag": etag, "Last-Modified": LAST_MODIFIED})
+
+        self._send(404)
+
+    def log_request(self, code="-", size="-"):
+        self.server.requests += 1
+        super().log_request(code, size)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake support site for crawler testing")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--articles", type=int, default=50)
+    parser.add_argument("--changed", type=int, nargs="*", default=[], help="Article IDs that change on every request")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    server.articles = args.articles
+    server.changed = set(args.changed)
+    server.requests = 0
+    print(f"Serving {args.articles} fake articles at http://127.0.0.1:{args.port}/sitemap.xml")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,380 @@
 #!/usr/bin/env python3
+"""
+Run the complete document processing pipeline in one process
+
+Stages run concurrently and pass data through bounded in-memory queues:
+
+    extract (process pool) -> chunk -> embed in batches -> add to index
+
+PDFs are extracted first, then the support articles left by
+crawl_angelone.py, if any. Encoding starts as soon as the first document is
+chunked, while later documents are still being extracted, and the embedding
+model is loaded exactly once.
+Vectors are labelled with the stable chunk IDs of update_index.py and the
+sources' fingerprints are saved to its manifest, so --incremental picks up
+where a full build left off.
+The intermediate JSON files of the step-by-step scripts are only written
+when --debug-artifacts is given; otherwise older copies are deleted. Each
+stage's throughput, busy time and memory are saved to
+data/embeddings/ingest_profile.json.
+"""
+import argparse
+import json
 import os
-import subprocess
+import queue
 import sys
+import threading
 import time
+import numpy as np
+import faiss
+from extract_pdf import iter_pdf_pages, PAGES_PATH
+from extract_html import HTML_DIR, HTML_PAGES_PATH, has_crawled_pages, iter_html_pages
+from process_data import add_dedup_arguments, html_document, pdf_document, LEXICAL_PATH
+from create_embeddings import INDEX_TYPES, METRICS, StreamingIndexBuilder
+from update_index import chunk_source, chunk_vector_id, manifest_files, scan_sources, update_index, write_manifest
 
-def run_step(step_name, command):
-    """Run a step in the pipeline and check for success"""
-    print(f"\n{'='*80}\n{step_name}\n{'='*80}")
-    
-    try:
-        # Run the command and capture output
-        start_time = time.time()
-        result = subprocess.run(command, shell=True, check=True, text=True, capture_output=True)
-        elapsed_time = time.time() - start_time
-        
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-            
-        print(f"\n✅ {step_name} completed successfully in {elapsed_time:.1f} seconds.")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"\n❌ {step_name} failed with error code {e.returncode}.")
-        print("STDOUT:", e.stdout)
-        print("STDERR:", e.stderr)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.chunk_store import ChunkStore, ChunkStoreWriter
+from src.chatbot.dedup import DEFAULT_THRESHOLD, NearDuplicateFilter
+from src.chatbot.filters import remove_partitions
+from src.chatbot.lexical import write_lexical_index
+from src.chatbot.index_manager import write_index_version
+from src.chatbot.encoder import ENCODER_BACKENDS, load_encoder
+from src.chatbot.profiling import REPORT_PATH, RunProfiler, add_profiling_arguments, file_size
+
+INDEX_PATH = "data/embeddings/docs.index"
+STORE_PATH = "data/embeddings/chunks.store"
+# Chunks in the order they were indexed, before the store is sorted by vector ID
+STAGED_STORE_PATH = "data/embeddings/chunks.store.staged"
+CHUNKS_PATH = "data/processed/chunks.json"
+METADATA_PATH = "data/embeddings/chunks_metadata.json"
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class JsonArrayWriter:
+    def __init__(self, path):
+        """Write a JSON array one item at a time"""
+        self.f = open(path, "w", encoding="utf-8")
+        self.f.write("[")
+        self.count = 0
+
+    def write(self, item):
+        self.f.write(",\n" if self.count else "\n")
+        self.f.write(json.dumps(item, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        self.f.write("\n]")
+        self.f.close()
+
+class Pipeline:
+    def __init__(self, pdf_dir="data/pdfs", index_type="flat", batch_size=64, queue_size=8,
+                 workers=None, debug_artifacts=False, encoder_backend="torch", metric="l2",
+                 dedup_threshold=DEFAULT_THRESHOLD, profiler: RunProfiler = None, html_dir=HTML_DIR):
+        self.pdf_dir = pdf_dir
+        self.html_dir = html_dir
+        self.metric = metric
+        self.encoder_backend = encoder_backend
+        self.index_type = index_type
+        self.batch_size = batch_size
+        self.workers = workers
+        self.debug_artifacts = debug_artifacts
+        # Near-duplicate chunks are dropped before they are encoded
+        self.dedup = NearDuplicateFilter(dedup_threshold) if dedup_threshold is not None else None
+
+        # Bounded buffers between stages, so a fast stage can't run ahead of a slow one
+        self.chunks = queue.Queue(maxsize=batch_size * queue_size)
+        self.batches = queue.Queue(maxsize=queue_size)
+
+        self._stop = threading.Event()
+        self._error = None
+        self.stats = {"documents": 0, "pages": 0, "html_pages": 0, "chunks": 0, "batches": 0}
+        # Fingerprints of the PDFs and crawled pages, as update_index.py keeps them
+        self.sources = {}
+        # Stable vector ID of each chunk in the staged store, in order
+        self._ids = []
+        # Per-stage timings; stages run side by side, so each times only its own work
+        self.profiler = profiler or RunProfiler("prepare_data.py")
+        # Version of the index written by run()
+        self.version = None
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
         return False
 
-def main():
-    """Run the complete data processing pipeline for PDFs only"""
-    
-    print("\nRAG-Chatbot: PDF Processing Pipeline")
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+
+    def _chunk(self, doc, chunking) -> bool:
+        """Chunk one complete document and queue its chunks; returns False once the pipeline stops"""
+        with chunking.busy():
+            if not doc["content"]:
+                return True
+            self.stats["documents"] += 1
+            sha256 = self.sources.get(doc["source"], {}).get("sha256")
+            chunks = [chunk for chunk in chunk_source(doc, sha256) if not self.dedup or self.dedup.add(chunk)]
+        chunking.count(documents=1, chunks=len(chunks))
+        for chunk in chunks:
+            if not self._put(self.chunks, chunk):
+                return False
+        return True
+
+    def _extract_and_chunk(self):
+        """Stage 1: extract PDF pages and HTML articles across a process pool and chunk each document once complete"""
+        pages_file = open(PAGES_PATH, "w", encoding="utf-8") if self.debug_artifacts else None
+        html_file = open(HTML_PAGES_PATH, "w", encoding="utf-8") if self.debug_artifacts else None
+        pending = {}
+        try:
+            with self.profiler.stage("chunk", busy=False) as chunking:
+                with self.profiler.stage("extract", busy=False) as extract:
+                    for page in iter_pdf_pages(self.pdf_dir, workers=self.workers, stage=extract):
+                        if self._stop.is_set():
+                            return
+                        self.stats["pages"] += 1
+                        if pages_file:
+                            pages_file.write(json.dumps(page, ensure_ascii=False) + "\n")
+
+                        doc_pages = pending.setdefault(page["source"], [])
+                        doc_pages.append(page)
+                        if page["page"] < page["page_count"]:
+                            continue
+
+                        # Last page arrived; pages of one document come in order
+                        del pending[page["source"]]
+                        if not self._chunk(pdf_document(doc_pages), chunking):
+                            return
+
+                # Each crawled article is a complete document
+                with self.profiler.stage("extract_html", busy=False) as extract:
+                    for page in iter_html_pages(self.html_dir, workers=self.workers, stage=extract):
+                        if self._stop.is_set():
+                            return
+                        self.stats["html_pages"] += 1
+                        if html_file:
+                            html_file.write(json.dumps(page, ensure_ascii=False) + "\n")
+                        if not self._chunk(html_document(page), chunking):
+                            return
+        finally:
+            for f in (pages_file, html_file):
+                if f:
+                    f.close()
+            self._put(self.chunks, _DONE)
+
+    def _embed(self, model):
+        """Stage 2: encode chunks in batches"""
+        batch = []
+        with self.profiler.stage("encode", busy=False) as stage:
+            while True:
+                chunk = self._get(self.chunks)
+                if chunk is not _DONE:
+                    batch.append(chunk)
+                if batch and (len(batch) >= self.batch_size or chunk is _DONE):
+                    with stage.busy():
+                        texts = [c["text"] for c in batch]
+                        with stage.model():
+                            embeddings = model.encode(texts, batch_size=self.batch_size)
+                        embeddings = np.asarray(embeddings, dtype='float32')
+                    stage.count(chunks=len(batch))
+                    if not self._put(self.batches, (batch, embeddings)):
+                        return
+                    batch = []
+                if chunk is _DONE:
+                    self._put(self.batches, _DONE)
+                    return
+
+    def _sort_store(self):
+        """Rewrite the staged chunks into the store in vector ID order, adding the sources of merged duplicates"""
+        staged = ChunkStore(STAGED_STORE_PATH)
+        ids = np.array(self._ids, dtype='int64')
+        # Duplicates found after their representative was staged add sources to it
+        sources = self.dedup.sources if self.dedup else None
+        with ChunkStoreWriter(STORE_PATH) as writer:
+            for position in np.argsort(ids, kind="stable").tolist():
+                chunk = staged[position]
+                if sources and len(sources[position]) > 1:
+                    chunk["sources"] = sources[position]
+                writer.add(chunk, int(ids[position]))
+        del staged
+        os.remove(STAGED_STORE_PATH)
+
+    def run(self):
+        """Run all stages and write the index and chunk store; returns the number of chunks indexed"""
+        for directory in ("data/raw_text", "data/processed", "data/embeddings"):
+            os.makedirs(directory, exist_ok=True)
+
+        print("Loading embedding model...", flush=True)
+        with self.profiler.stage("load_model"):
+            model = load_encoder(self.encoder_backend)
+        with self.profiler.stage("fingerprint"):
+            self.sources = scan_sources(self.pdf_dir, self.html_dir, {})
+
+        # Vectors get the stable IDs update_index.py gives them, so it can pick up from this build
+        builder = StreamingIndexBuilder(self.index_type, metric=self.metric)
+        store = ChunkStoreWriter(STAGED_STORE_PATH)
+        debug_writers = [JsonArrayWriter(CHUNKS_PATH), JsonArrayWriter(METADATA_PATH)] if self.debug_artifacts else []
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(self._extract_and_chunk,), name="extract", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._embed, model), name="embed", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        # Stage 3 runs here: add each encoded batch to the index and chunk store
+        try:
+            with self.profiler.stage("index", busy=False) as stage:
+                while True:
+                    item = self._get(self.batches)
+                    if item is _DONE:
+                        break
+                    batch, embeddings = item
+                    with stage.busy():
+                        ids = [chunk_vector_id(c["source"], c["chunk_index"], c["text"]) for c in batch]
+                        builder.add(embeddings, ids)
+                        self._ids.extend(ids)
+                        for chunk in batch:
+                            store.add(chunk)
+                            for writer in debug_writers:
+                                writer.write(chunk)
+                    stage.count(chunks=len(batch))
+                    self.stats["chunks"] += len(batch)
+                    self.stats["batches"] += 1
+                    print(f"Indexed {self.stats['chunks']} chunks from {self.stats['documents']} documents", flush=True)
+        except BaseException:
+            self._stop.set()
+            store.abort()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            for writer in debug_writers:
+                writer.close()
+
+        if self._error is not None:
+            store.abort()
+            raise self._error
+
+        with self.profiler.stage("write") as stage:
+            index, description = builder.finish()
+            if index is None:
+                store.abort()
+                return 0
+
+            # Index first, then the chunk store and BM25 index, then the version a running API watches
+            faiss.write_index(index, f"{INDEX_PATH}.tmp")
+            os.replace(f"{INDEX_PATH}.tmp", INDEX_PATH)
+            # Sub-indexes of an earlier create_embeddings.py build no longer match; filters still work without them
+            remove_partitions(os.path.dirname(INDEX_PATH))
+            store.close()
+            if self.dedup:
+                print(self.dedup.report())
+            self._sort_store()
+            chunks = ChunkStore(STORE_PATH)
+            write_lexical_index(LEXICAL_PATH, chunks, ids=chunks.ids)
+            if not self.debug_artifacts:
+                # Left by an earlier run or by the step-by-step scripts; they no longer match the index
+                for path in (PAGES_PATH, HTML_PAGES_PATH, CHUNKS_PATH, METADATA_PATH):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.version = write_index_version(index_type=self.index_type, metric=self.metric,
+                                              num_vectors=index.ntotal,
+                                              deduplicated=self.dedup.stats()["duplicates"] if self.dedup else 0)
+            write_manifest(self.index_type, self.metric, manifest_files(self.sources))
+            stage.count(vectors=index.ntotal)
+            stage.add(bytes_written=file_size(INDEX_PATH, STORE_PATH, LEXICAL_PATH))
+        print(f"✅ Built {description} index with {index.ntotal} vectors (version {self.version})")
+        return index.ntotal
+
+def main(incremental=False, index_type="flat", batch_size=64, workers=None, debug_artifacts=False,
+         encoder_backend="torch", metric=None, dedup_threshold=DEFAULT_THRESHOLD, profile_dir=None,
+         trace_memory=False, profile_report=None, html_dir=HTML_DIR):
+    """Run the complete data processing pipeline for PDFs and crawled HTML articles"""
+
+    print("\nRAG-Chatbot: Document Processing Pipeline")
     print(f"Working directory: {os.getcwd()}\n")
-    
+
     # Make sure data directories exist
-    os.makedirs("data/raw_text", exist_ok=True)
-    os.makedirs("data/processed", exist_ok=True)
-    os.makedirs("data/embeddings", exist_ok=True)
     os.makedirs("data/pdfs", exist_ok=True)
-    
+
     # Verify PDF directory and give instructions
-    if not any(f.lower().endswith('.pdf') for f in os.listdir("data/pdfs")):
+    has_pdfs = any(f.lower().endswith('.pdf') for f in os.listdir("data/pdfs"))
+    if not has_pdfs and not has_crawled_pages(html_dir):
         print("\n⚠️ No PDF files found in data/pdfs directory!")
-        print("Please place your PDF files in the data/pdfs directory.")
-        print("Exiting. Please add PDF files and run again.")
+        print("Please place your PDF files in the data/pdfs directory, or crawl the support articles with "
+              "scripts/crawl_angelone.py.")
+        print("Exiting. Please add documents and run again.")
         return
-    
-    # Run each step in sequence
-    steps = [
-        ("PDF extraction", "python scripts/extract_pdf.py"),
-        ("Data processing", "python scripts/process_data.py"),
-        ("Embedding creation", "python scripts/create_embeddings.py")
-    ]
-    
-    for step_name, command in steps:
-        success = run_step(step_name, command)
-        if not success:
-            print(f"\n❌ Pipeline failed at step: {step_name}")
-            print("Aborting remaining steps.")
-            return
-    
-    print("\n🎉 All data processing steps completed successfully!")
+
+    start_time = time.time()
+    try:
+        if incremental:
+            # Only new or changed PDFs and articles are extracted and encoded
+            update_index(encoder_backend=encoder_backend, metric=metric, html_dir=html_dir, workers=workers,
+                         dedup_threshold=dedup_threshold)
+        else:
+            profiler = RunProfiler("prepare_data.py", profile_dir=profile_dir, trace_memory=trace_memory)
+            pipeline = Pipeline(index_type=index_type, batch_size=batch_size, workers=workers,
+                                debug_artifacts=debug_artifacts, encoder_backend=encoder_backend,
+                                metric=metric or "l2", dedup_threshold=dedup_threshold, profiler=profiler,
+                                html_dir=html_dir)
+            if not pipeline.run():
+                print("\n❌ No chunks were created. Please check the input documents.")
+                return
+            print()
+            profiler.print_summary()
+            # A full build replaces the stages recorded by earlier step-by-step runs
+            path = profiler.write(profile_report or REPORT_PATH, replace=True, index_version=pipeline.version,
+                                  stats=pipeline.stats)
+            print(f"✅ Saved the stage profile to {path}")
+    except Exception as e:
+        print(f"\n❌ Pipeline failed: {e}")
+        raise
+
+    print(f"\n🎉 All data processing steps completed successfully in {time.time() - start_time:.1f} seconds!")
     print("\nNext steps:")
     print("1. Start the API server: uvicorn src.api.main:app --reload --port 8000")
     print("2. Start the UI: python ui/app.py")
     print("3. Open your browser at http://localhost:7860 to use the chatbot")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the document processing pipeline")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-index new, changed and deleted PDFs and crawled articles")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=os.environ.get("INDEX_TYPE", "flat"))
+    parser.add_argument("--batch-size", type=int, default=64, help="Chunks encoded per model call")
+    parser.add_argument("--workers", type=int, default=None, help="PDF and HTML extraction processes (default: CPU count)")
+    parser.add_argument("--html-dir", default=HTML_DIR,
+                        help="Output directory of crawl_angelone.py whose pages are indexed too")
+    parser.add_argument("--debug-artifacts", action="store_true",
+                        help="Also write the intermediate pages/chunks/metadata JSON files")
+    parser.add_argument("--metric", choices=METRICS, default=os.environ.get("INDEX_METRIC"),
+                        help="cosine stores normalized vectors in an inner-product index "
+                             "(default: $INDEX_METRIC, else l2; --incremental keeps the existing index's)")
+    parser.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default=os.environ.get("ENCODER_BACKEND", "torch"),
+                        help="Embedding backend (default: torch, or $ENCODER_BACKEND)")
+    add_dedup_arguments(parser)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    main(incremental=args.incremental, index_type=args.index_type, batch_size=args.batch_size,
+         workers=args.workers, debug_artifacts=args.debug_artifacts, encoder_backend=args.encoder_backend,
+         metric=args.metric, dedup_threshold=args.dedup_threshold if args.dedup else None,
+         profile_dir=args.profile_dir, trace_memory=args.trace_memory, profile_report=args.profile_report,
+         html_dir=args.html_dir)
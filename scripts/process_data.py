@@ -1,28 +1,176 @@
+import argparse
+import bisect
 import json
 import os
-from typing import List, Dict
+import sys
+from typing import Dict, Iterator, List
 
-def load_raw_docs() -> List[Dict]:
-    """Load the raw text extracted from PDFs"""
-    docs = []
-    
-    # Load PDF docs if they exist
-    pdf_docs_path = "data/raw_text/insurance_docs.json"
-    if os.path.exists(pdf_docs_path):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.dedup import DEFAULT_THRESHOLD, deduplicate
+from src.chatbot.lexical import write_lexical_index
+from src.chatbot.profiling import RunProfiler, add_profiling_arguments, file_size
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+LEXICAL_PATH = "data/embeddings/lexical.bm25"
+PDF_PAGES_PATH = "data/raw_text/insurance_pages.jsonl"
+PDF_DOCS_PATH = "data/raw_text/insurance_docs.json"
+HTML_PAGES_PATH = "data/raw_text/angelone_pages.jsonl"
+CHUNKS_PATH = "data/processed/chunks.json"
+
+class JsonStream:
+    def __init__(self, f, path: str, read_size: int = 1 << 20):
+        """Decode the values of a JSON file one at a time, reading it in blocks"""
+        self.f = f
+        self.path = path
+        self.read_size = read_size
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.position, self.eof = "", 0, False
+
+    def peek(self, skip: str = " \t\r\n,") -> str:
+        """Next character after any of `skip`, reading on at the end of the buffer; "" at the end of the file"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in skip:
+                self.position += 1
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position] if self.position < len(self.buffer) else ""
+            self.buffer, self.position = self.f.read(self.read_size), 0
+            self.eof = not self.buffer
+
+    def expect(self, char: str, skip: str = " \t\r\n,"):
+        if self.peek(skip) != char:
+            raise ValueError(f"{self.path}: expected {char!r}")
+        self.position += 1
+
+    def decode(self):
+        """Decode the next value, which may continue past the buffer"""
+        self.peek()
+        while True:
+            try:
+                value, self.position = self.decoder.raw_decode(self.buffer, self.position)
+                return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                block = self.f.read(self.read_size)
+                self.buffer, self.position, self.eof = self.buffer[self.position:] + block, 0, not block
+
+def iter_json_array(path: str, read_size: int = 1 << 20) -> Iterator:
+    """Yield the items of a JSON array file one at a time, reading it in blocks"""
+    with open(path, "r", encoding="utf-8") as f:
+        stream = JsonStream(f, path, read_size)
+        if stream.peek() != "[":
+            raise ValueError(f"{path} does not hold a JSON array")
+        stream.expect("[")
+        while stream.peek() not in ("]", ""):
+            yield stream.decode()
+
+def iter_json_field(path: str, field: str, read_size: int = 1 << 20) -> Iterator:
+    """Yield the (key, value) pairs of one object-valued field of a JSON object file, one at a time"""
+    with open(path, "r", encoding="utf-8") as f:
+        stream = JsonStream(f, path, read_size)
+        stream.expect("{")
+        while stream.peek() not in ("}", ""):
+            key = stream.decode()
+            stream.expect(":", skip=" \t\r\n")
+            if key != field:
+                stream.decode()
+                continue
+            stream.expect("{", skip=" \t\r\n")
+            while stream.peek() not in ("}", ""):
+                name = stream.decode()
+                stream.expect(":", skip=" \t\r\n")
+                yield name, stream.decode()
+            return
+
+def load_pdf_pages(pages_path: str) -> List[Dict]:
+    """Reassemble documents from the per-page JSONL written by extract_pdf.py"""
+    docs = {}
+    with open(pages_path, "r", encoding="utf-8") as f:
+        for line in f:
+            page = json.loads(line)
+            doc = docs.setdefault(page["source"], {
+                "source": page["source"],
+                "type": page.get("type", "pdf"),
+                "pages": [],
+                "page_starts": [],
+            })
+            doc["pages"].append(page["text"])
+            doc["page_starts"].append(page["char_start"])
+
+    for doc in docs.values():
+        doc["content"] = "".join(doc.pop("pages"))
+    return [doc for doc in docs.values() if doc["content"]]
+
+def pdf_document(pages: List[Dict]) -> Dict:
+    """Join one PDF's page records from extract_pdf.py, in page order, into a raw document"""
+    return {
+        "source": pages[0]["source"],
+        "type": pages[0].get("type", "pdf"),
+        "content": "".join(page["text"] for page in pages),
+        "page_starts": [page["char_start"] for page in pages],
+    }
+
+def html_document(page: Dict) -> Dict:
+    """Raw document of one article record from extract_html.py"""
+    return {
+        "source": page["source"],
+        "type": page.get("type", "html"),
+        "title": page.get("title", ""),
+        "content": page["text"],
+    }
+
+def load_html_pages(pages_path: str) -> Iterator[Dict]:
+    """Stream the crawled articles written by extract_html.py, one document per line"""
+    with open(pages_path, "r", encoding="utf-8") as f:
+        for line in f:
+            page = json.loads(line)
+            if page["text"]:
+                yield html_document(page)
+
+def iter_raw_docs() -> Iterator[Dict]:
+    """Yield the raw text extracted from PDFs, then the crawled HTML articles"""
+    found = False
+
+    # Prefer the per-page output of extract_pdf.py
+    if os.path.exists(PDF_PAGES_PATH):
         try:
-            with open(pdf_docs_path, "r", encoding="utf-8") as f:
+            pdf_docs = load_pdf_pages(PDF_PAGES_PATH)
+            print(f"Loaded {len(pdf_docs)} PDF documents")
+            found = bool(pdf_docs)
+            yield from pdf_docs
+        except Exception as e:
+            print(f"Error loading PDF pages: {e}")
+    elif os.path.exists(PDF_DOCS_PATH):
+        try:
+            with open(PDF_DOCS_PATH, "r", encoding="utf-8") as f:
                 pdf_docs = json.load(f)
-                docs.extend(pdf_docs)
             print(f"Loaded {len(pdf_docs)} PDF documents")
+            found = bool(pdf_docs)
+            yield from pdf_docs
         except Exception as e:
             print(f"Error loading PDF documents: {e}")
-    
-    if not docs:
-        print("No documents found. Please run PDF extraction first.")
-        
-    return docs
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
+    # Articles are read one line at a time, however many were crawled
+    if os.path.exists(HTML_PAGES_PATH):
+        html_docs = 0
+        try:
+            for doc in load_html_pages(HTML_PAGES_PATH):
+                html_docs += 1
+                yield doc
+        except Exception as e:
+            print(f"Error loading HTML pages: {e}")
+        print(f"Loaded {html_docs} HTML documents")
+        found = found or html_docs > 0
+
+    if not found:
+        print("No documents found. Please run PDF or HTML extraction first.")
+
+def load_raw_docs() -> List[Dict]:
+    """Load the raw text extracted from PDFs and crawled HTML pages"""
+    return list(iter_raw_docs())
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Split text into overlapping chunks"""
     chunks = []
     start = 0
@@ -36,33 +184,93 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[st
 
     return chunks
 
-def process_documents():
-    """Process raw documents into chunks with metadata"""
+def chunk_document(doc: Dict, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    """Split one raw document into chunks with metadata"""
+    doc_type = doc.get("type", "pdf")
+    # Articles are cited by their URL
+    source = doc["source"] if doc_type == "html" else f"pdf:{doc['source']}"
+    content = doc["content"]
+    page_starts = doc.get("page_starts")
+    
+    processed_chunks = []
+    for i, chunk in enumerate(chunk_text(content, chunk_size, overlap)):
+        processed_chunk = {
+            "chunk_id": f"{i}_{source}",
+            "text": chunk,
+            "source": source,
+            "doc_type": doc_type,
+            "chunk_index": i
+        }
+        if doc.get("title"):
+            processed_chunk["title"] = doc["title"]
+        if page_starts:
+            # Page on which the chunk starts
+            processed_chunk["page"] = bisect.bisect_right(page_starts, i * (chunk_size - overlap))
+        processed_chunks.append(processed_chunk)
+    return processed_chunks
+
+def process_documents(dedup_threshold: float = DEFAULT_THRESHOLD, profiler: RunProfiler = None):
+    """
+    Process raw documents into chunks with metadata
+
+    Near-duplicate chunks, e.g. boilerplate shared by several PDFs, are
+    collapsed into one chunk listing all of their sources, unless
+    dedup_threshold is None.
+    """
+    profiler = profiler or RunProfiler("process_data.py")
     os.makedirs("data/processed", exist_ok=True)
-    docs = load_raw_docs()
     processed_chunks = []
+    num_docs = 0
+    # Documents are chunked as they are read, so only their chunks are held in memory
+    with profiler.stage("load", busy=False) as load, profiler.stage("chunk", busy=False) as chunking:
+        docs = iter_raw_docs()
+        while True:
+            with load.busy():
+                doc = next(docs, None)
+            if doc is None:
+                break
+            num_docs += 1
+            with chunking.busy():
+                processed_chunks.extend(chunk_document(doc))
+        load.count(documents=num_docs)
+        load.add(bytes_read=file_size(PDF_PAGES_PATH if os.path.exists(PDF_PAGES_PATH) else PDF_DOCS_PATH,
+                                      HTML_PAGES_PATH))
 
-    for doc in docs:
-        source = f"pdf:{doc['source']}"
-        content = doc["content"]
-            
-        chunks = chunk_text(content)
-        for i, chunk in enumerate(chunks):
-            processed_chunks.append({
-                "chunk_id": f"{i}_{source}",
-                "text": chunk,
-                "source": source,
-                "doc_type": "pdf",
-                "chunk_index": i
-            })
+        with chunking.busy():
+            if processed_chunks and dedup_threshold is not None:
+                processed_chunks, dedup = deduplicate(processed_chunks, dedup_threshold)
+                print(dedup.report())
+        chunking.count(documents=num_docs, chunks=len(processed_chunks))
 
     if processed_chunks:
-        with open("data/processed/chunks.json", "w", encoding="utf-8") as f:
-            json.dump(processed_chunks, f, indent=2, ensure_ascii=False)
+        with profiler.stage("serialize_chunks") as stage:
+            with open(CHUNKS_PATH, "w", encoding="utf-8") as f:
+                json.dump(processed_chunks, f, indent=2, ensure_ascii=False)
 
-        print(f"✅ Processed {len(processed_chunks)} chunks from {len(docs)} documents")
+            # BM25 index over the same chunks; IDs are positions, as in create_embeddings.py
+            os.makedirs(os.path.dirname(LEXICAL_PATH), exist_ok=True)
+            write_lexical_index(LEXICAL_PATH, processed_chunks)
+            stage.count(chunks=len(processed_chunks))
+            stage.add(bytes_written=file_size(CHUNKS_PATH, LEXICAL_PATH))
+
+        print(f"✅ Processed {len(processed_chunks)} chunks from {num_docs} documents")
     else:
         print("No chunks were created. Please check the input documents.")
 
+def add_dedup_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--dedup-threshold", type=float,
+                        default=float(os.environ.get("DEDUP_THRESHOLD", DEFAULT_THRESHOLD)),
+                        help="Estimated Jaccard similarity above which chunks count as one passage "
+                             f"(default: {DEFAULT_THRESHOLD}, or $DEDUP_THRESHOLD)")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false",
+                        help="Index every chunk, including near-duplicates")
+
 if __name__ == "__main__":
-    process_documents()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chunk the extracted documents into data/processed/chunks.json")
+    add_dedup_arguments(parser)
+    add_profiling_arguments(parser)
+    args = parser.parse_args()
+    profiler = RunProfiler("process_data.py", profile_dir=args.profile_dir, trace_memory=args.trace_memory)
+    process_documents(dedup_threshold=args.dedup_threshold if args.dedup else None, profiler=profiler)
+    profiler.print_summary()
+    print(f"✅ Saved the stage profile to {profiler.write(args.profile_report)}")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Serve the API from several worker processes sharing one copy of the index
+
+`uvicorn --workers N` starts N independent interpreters, each loading its
+own index, chunk metadata and model, so memory grows with every worker.
+This server instead:
+
+- memory-maps the FAISS index read-only (INDEX_MMAP=1), like the chunk
+  store and lexical index already are, so all workers share the page cache
+  copy of the files instead of holding private copies
+- with --preload (the default), loads the app once in the parent and forks
+  the workers from it, so the model weights and other in-memory structures
+  are shared copy-on-write as well
+
+Workers accept connections on one shared listening socket and are
+restarted if they die. Each worker still polls for new index versions and
+swaps them in on its own. Run from the repository root, like uvicorn:
+
+    python scripts/serve.py --workers 4 --port 8000
+
+Measure memory and throughput across worker counts with
+scripts/benchmark_workers.py.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+sys.path.insert(0, os.getcwd())
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(sock: socket.socket, app, log_level: str):
+    import uvicorn
+    if app is None:
+        from src.api.main import app
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = 1, preload: bool = True, mmap: bool = True,
+          log_level: str = "info"):
+    os.environ["INDEX_MMAP"] = "1" if mmap else "0"
+    sock = bind_socket(host, port)
+
+    app = None
+    if preload:
+        # Load the index, chunk store and model once; forked workers share the pages
+        from src.api.main import app
+        # Objects that exist now are never scanned by the collector again, so
+        # workers don't copy the pages holding them just to update GC state
+        gc.collect()
+        gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(sock, app, log_level)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children[pid] = time.monotonic()
+        print(f"Started worker {pid}", flush=True)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    print(f"Serving on {host}:{port} with {workers} workers "
+          f"(preload={'on' if preload else 'off'}, mmap={'on' if mmap else 'off'})", flush=True)
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started_at = children.pop(pid, None)
+        if started_at is None or stopping:
+            continue
+        print(f"⚠️ Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting", flush=True)
+        # Don't spin if workers die right after starting, e.g. on a bad config
+        if time.monotonic() - started_at < 1:
+            time.sleep(1)
+        spawn()
+
+    sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API from several workers sharing one index")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Load the app in every worker instead of once before forking")
+    parser.add_argument("--no-mmap", dest="mmap", action="store_false",
+                        help="Read the FAISS index into each worker's memory instead of mapping it")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.preload, args.mmap, args.log_level)
@@ -34,6 +34,12 @@ echo -e "${YELLOW}Installing dependencies...${NC}"
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# Export the embedding model; every encoder backend loads it from models/ without network access
+echo -e "${YELLOW}Exporting the embedding model...${NC}"
+if ! python scripts/export_encoder.py; then
+    echo -e "${RED}Model export failed. Run python scripts/export_encoder.py before processing data.${NC}"
+fi
+
 # Create data directories
 echo -e "${YELLOW}Creating data directories...${NC}"
 mkdir -p data/raw_html
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Incrementally update the FAISS index from the PDFs in data/pdfs and the
+articles crawled into data/raw_html
+
+Each source, a PDF by file name or a crawled article by URL, is
+fingerprinted by the SHA-256 of its file, and each chunk gets a stable
+64-bit ID derived from its source, position and text. Only new or changed
+sources are extracted and chunked, exactly as prepare_data.py does, and
+only chunks whose IDs are not already indexed are encoded. Vectors of
+changed and deleted sources are removed by ID from an IDMap2-wrapped index.
+prepare_data.py labels its vectors the same way, so a run right after a
+full build finds nothing to do. Chunks of any other type, or articles
+without the crawl they came from, stop the run instead of being dropped.
+
+Near-duplicate passages are collapsed as in a full build: the new chunks
+are deduplicated together with the indexed ones, which keep their place as
+representatives. Changed and deleted sources are struck from the "sources"
+of the passages they shared, and when a passage's own chunk goes, the other
+sources it stood in for are re-chunked so the passage stays indexed.
+
+The index and chunk store are the source of truth: every chunk records the
+hash of the file it came from, and the two are reconciled against each
+other at the start of every run. The manifest caches file sizes and mtimes
+so unchanged files are not re-hashed, and the hashes of sources that left
+no chunks of their own; it is written last. A run that crashes partway
+through therefore leaves state that the next run repairs.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, List
+import numpy as np
+import faiss
+from extract_pdf import iter_pdf_pages
+from extract_html import HTML_DIR, iter_crawled_pages, iter_html_pages
+from process_data import add_dedup_arguments, chunk_document, html_document, pdf_document, LEXICAL_PATH
+from create_embeddings import INDEX_TYPES, METRICS, build_index, faiss_metric, prepare_vectors
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.chatbot.chunk_store import ChunkStore, write_chunk_store
+from src.chatbot.dedup import DEFAULT_THRESHOLD, NearDuplicateFilter, chunk_sources
+from src.chatbot.filters import remove_partitions
+from src.chatbot.index_manager import write_index_version
+from src.chatbot.lexical import write_lexical_index
+from src.chatbot.encoder import ENCODER_BACKENDS, load_encoder
+
+EMBEDDINGS_DIR = "data/embeddings"
+INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "docs.index")
+STORE_PATH = os.path.join(EMBEDDINGS_DIR, "chunks.store")
+METADATA_PATH = os.path.join(EMBEDDINGS_DIR, "chunks_metadata.json")
+MANIFEST_PATH = os.path.join(EMBEDDINGS_DIR, "manifest.json")
+# Document types this script can re-extract; see check_sources()
+SOURCE_TYPES = ("pdf", "html")
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_fingerprint(path: str, cached: dict = None) -> dict:
+    """SHA-256, size and mtime of a file; the hash is taken from `cached` when its size and mtime match"""
+    stat = os.stat(path)
+    if cached and cached.get("size") == stat.st_size and cached.get("mtime_ns") == stat.st_mtime_ns:
+        sha256 = cached["sha256"]
+    else:
+        sha256 = file_sha256(path)
+    return {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def chunk_vector_id(source: str, chunk_index: int, text: str) -> int:
+    """Stable, non-negative 63-bit ID for a chunk"""
+    digest = hashlib.sha256(f"{source}\0{chunk_index}\0{text}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+def source_key(source: str) -> str:
+    """Manifest key of a chunk's source: the file name of a PDF, the URL of an article"""
+    return source[len("pdf:"):] if source.startswith("pdf:") else source
+
+def write_atomic_json(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def write_atomic_index(index, path: str):
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+def write_manifest(index_type: str, metric: str, files: dict):
+    write_atomic_json(MANIFEST_PATH, {
+        "index_type": index_type,
+        "metric": metric,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+    })
+
+def load_manifest() -> dict:
+    if not os.path.exists(MANIFEST_PATH):
+        return {"files": {}}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest: {e}")
+        return {"files": {}}
+
+def load_state():
+    """
+    Load the ID-mapped index and its chunks, reconciled with each other
+
+    Returns:
+        (index, chunks by ID, keys of the sources that must be re-indexed),
+        or (None, {}, set()) when there is no incremental index yet
+    """
+    if not os.path.exists(INDEX_PATH) or not os.path.exists(STORE_PATH):
+        return None, {}, set()
+
+    index = faiss.read_index(INDEX_PATH)
+    if not isinstance(index, faiss.IndexIDMap2):
+        print("Existing index has no stable IDs; doing a full incremental build.")
+        return None, {}, set()
+
+    try:
+        store = ChunkStore(STORE_PATH)
+    except ValueError as e:
+        print(f"{e}; doing a full incremental build.")
+        return None, {}, set()
+    chunks = {int(chunk_id): chunk for chunk_id, chunk in zip(store.ids, store)}
+
+    # A crash between renaming the index and the store can leave them out of step
+    index_ids = faiss.vector_to_array(index.id_map)
+    orphaned = np.setdiff1d(index_ids, store.ids)
+    if len(orphaned):
+        print(f"Removing {len(orphaned)} vectors with no stored chunk")
+        index = remove_vectors(index, orphaned)
+    dirty = set()
+    for chunk_id in np.setdiff1d(store.ids, index_ids):
+        dirty.add(source_key(chunks.pop(int(chunk_id))["source"]))
+
+    return index, chunks, dirty
+
+def remove_vectors(index, ids: np.ndarray):
+    """Remove vectors by ID, rebuilding the index for types that can't remove in place"""
+    ids = np.ascontiguousarray(ids, dtype='int64')
+    try:
+        index.remove_ids(ids)
+        return index
+    except RuntimeError:
+        pass
+
+    # e.g. HNSW: rebuild the graph from the stored vectors that remain
+    keep = np.setdiff1d(faiss.vector_to_array(index.id_map), ids)
+    vectors = np.vstack([index.reconstruct(int(i)) for i in keep]) if len(keep) else None
+    inner = faiss.clone_index(faiss.downcast_index(index.index))
+    inner.reset()
+    rebuilt = faiss.IndexIDMap2(inner)
+    if vectors is not None:
+        rebuilt.add_with_ids(vectors, keep)
+    return rebuilt
+
+def check_sources(html_dir: str):
+    """
+    Refuse to update an index holding chunks this script can't re-extract
+
+    Their vectors would otherwise be removed as if their sources had been
+    deleted: chunks of an unknown type, or articles when html_dir has no
+    crawl_state.json (e.g. they came from an older angelone_docs.json).
+    """
+    if not os.path.exists(STORE_PATH):
+        return
+    try:
+        store = ChunkStore(STORE_PATH)
+    except ValueError:
+        return
+    doc_types = Counter(store.metadata(i).get("doc_type", "pdf") for i in range(len(store)))
+    unknown = {doc_type: count for doc_type, count in doc_types.items() if doc_type not in SOURCE_TYPES}
+    if unknown:
+        raise ValueError(f"The index holds chunks update_index.py can't re-extract ({unknown}); "
+                         "run a full build with prepare_data.py instead")
+    if doc_types["html"] and not os.path.exists(os.path.join(html_dir, "crawl_state.json")):
+        raise ValueError(f"The index holds {doc_types['html']} article chunks but {html_dir} has no "
+                         "crawl_state.json; pass the crawl's --html-dir or run a full build with prepare_data.py")
+
+def scan_sources(pdf_dir: str, html_dir: str, cached: dict) -> Dict[str, dict]:
+    """
+    Fingerprint every PDF and crawled article, keyed by file name and URL
+
+    Returns:
+        {key: {"type", "path", "sha256", "size", "mtime_ns"}}; a file whose
+        size and mtime match its entry in `cached` is not re-hashed
+    """
+    paths = {}
+    if os.path.isdir(pdf_dir):
+        paths.update((name, ("pdf", os.path.join(pdf_dir, name)))
+                     for name in sorted(os.listdir(pdf_dir)) if name.lower().endswith(".pdf"))
+    paths.update((url, ("html", path)) for url, path in iter_crawled_pages(html_dir))
+    return {key: {"type": doc_type, "path": path, **file_fingerprint(path, cached.get(key))}
+            for key, (doc_type, path) in paths.items()}
+
+def manifest_files(sources: Dict[str, dict]) -> dict:
+    """The manifest entries of scanned sources"""
+    return {key: {"sha256": fp["sha256"], "size": fp["size"], "mtime_ns": fp["mtime_ns"]}
+            for key, fp in sources.items()}
+
+def chunk_source(doc: Dict, sha256: str) -> List[Dict]:
+    """Chunk one raw document like process_data.py, recording the hash of its file"""
+    chunks = chunk_document(doc)
+    for chunk in chunks:
+        chunk["source_sha256"] = sha256
+    return chunks
+
+def extract_chunks(sources: Dict[str, dict], keys: List[str], pdf_dir: str, html_dir: str,
+                     workers: int = None) -> Dict[str, Dict[int, Dict]]:
+    """Extract and chunk the given sources; {key: {vector ID: chunk}}, empty for a source with no text"""
+    fresh_chunks = {key: {} for key in keys}
+    for doc in iter_source_docs(sources, keys, pdf_dir, html_dir, workers=workers):
+        key = doc["source"]
+        fresh_chunks[key] = {chunk_vector_id(c["source"], c["chunk_index"], c["text"]): c
+                             for c in chunk_source(doc, sources[key]["sha256"])}
+    return fresh_chunks
+
+def strip_sources(chunk: Dict, keys: set) -> bool:
+    """Remove the given sources from a merged chunk's "sources", except its own; True if any were removed"""
+    if "sources" not in chunk:
+        return False
+    own = chunk["source"]
+    remaining = [source for source in chunk["sources"] if source == own or source_key(source) not in keys]
+    if len(remaining) == len(chunk["sources"]):
+        return False
+    if len(remaining) > 1:
+        chunk["sources"] = remaining
+    else:
+        del chunk["sources"]
+    return True
+
+def deduplicate_chunks(chunks: Dict[int, Dict], new_chunks: Dict[int, Dict], threshold: float):
+    """
+    Drop the new chunks that repeat an indexed passage or each other
+
+    Indexed chunks go first, so they stay the representatives of their
+    passages and the new chunks' sources are added to them. Indexed chunks
+    that turn out to be duplicates, e.g. after lowering the threshold, are
+    dropped too.
+
+    Returns:
+        (kept indexed chunks, kept new chunks), both by vector ID
+    """
+    dedup = NearDuplicateFilter(threshold)
+    kept = [(chunk_id, chunk) for chunk_id, chunk in [*chunks.items(), *new_chunks.items()] if dedup.add(chunk)]
+    print(dedup.report())
+    kept = dict(zip((chunk_id for chunk_id, _ in kept), dedup.annotate(chunk for _, chunk in kept)))
+    return ({chunk_id: chunk for chunk_id, chunk in kept.items() if chunk_id in chunks},
+            {chunk_id: chunk for chunk_id, chunk in kept.items() if chunk_id in new_chunks})
+
+def iter_source_docs(sources: Dict[str, dict], keys: List[str], pdf_dir: str, html_dir: str,
+                     workers: int = None) -> Iterator[Dict]:
+    """Extract the given sources like prepare_data.py, as raw documents of the shape iter_raw_docs() yields"""
+    pdf_files = [key for key in keys if sources[key]["type"] == "pdf"]
+    if pdf_files:
+        pending = {}
+        for page in iter_pdf_pages(pdf_dir, workers=workers, pdf_files=pdf_files):
+            doc_pages = pending.setdefault(page["source"], [])
+            doc_pages.append(page)
+            if page["page"] == page["page_count"]:
+                yield pdf_document(pending.pop(page["source"]))
+    pages = [(key, sources[key]["path"]) for key in keys if sources[key]["type"] == "html"]
+    if pages:
+        for page in iter_html_pages(html_dir, workers=workers, pages=pages):
+            yield html_document(page)
+
+def update_index(pdf_dir: str = "data/pdfs", index_type: str = None, rebuild: bool = False,
+                 encoder_backend: str = "torch", metric: str = None, html_dir: str = HTML_DIR,
+                 workers: int = None, check: bool = False, dedup_threshold: float = DEFAULT_THRESHOLD) -> bool:
+    """
+    Bring the index in line with the PDFs and crawled articles
+
+    Args:
+        dedup_threshold: Similarity at which new chunks count as an indexed
+            passage, as in process_data.py; None indexes every chunk
+        check: Only report the vectors that would be added and removed;
+            nothing is encoded or written
+
+    Returns:
+        True if the index was already up to date
+    """
+    start_time = time.time()
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    check_sources(html_dir)
+
+    manifest = load_manifest()
+    index_type = index_type or manifest.get("index_type", "flat")
+    metric = metric or manifest.get("metric", "l2")
+    if rebuild or index_type != manifest.get("index_type", index_type):
+        print(f"Rebuilding from scratch with a {index_type} index")
+        index, chunks, dirty = None, {}, set()
+    else:
+        index, chunks, dirty = load_state()
+        if index is not None and index.metric_type != faiss_metric(metric):
+            print(f"Rebuilding from scratch with the {metric} metric")
+            index, chunks, dirty = None, {}, set()
+
+    # What the index currently holds, per source
+    indexed_hashes = {}
+    indexed_ids = {}
+    for chunk_id, chunk in chunks.items():
+        key = source_key(chunk["source"])
+        indexed_hashes[key] = chunk.get("source_sha256")
+        indexed_ids.setdefault(key, set()).add(chunk_id)
+    # Sources without chunks of their own, e.g. a scanned PDF with no text, are only known to the manifest
+    files = manifest.get("files", {})
+    known_hashes = {key: fp.get("sha256") for key, fp in files.items()} if index is not None else {}
+    known_hashes.update(indexed_hashes)
+    # ...or, if all their passages were merged into other sources' chunks, to those chunks' "sources"
+    listed = {source_key(source) for chunk in chunks.values() for source in chunk.get("sources", ())}
+
+    sources = scan_sources(pdf_dir, html_dir, {key: fp for key, fp in files.items()
+                                               if fp.get("sha256") == known_hashes.get(key)})
+
+    changed = [key for key, fp in sources.items() if fp["sha256"] != known_hashes.get(key) or key in dirty]
+    deleted = sorted(key for key in known_hashes.keys() | listed if key not in sources)
+    print(f"{len(sources)} sources: {len(changed)} new or changed, {len(deleted)} deleted")
+
+    to_remove = set()
+    new_chunks = {}
+    for key in deleted:
+        to_remove |= indexed_ids.get(key, set())
+    fresh_chunks = extract_chunks(sources, changed, pdf_dir, html_dir, workers=workers)
+    for key, fresh in fresh_chunks.items():
+        old_ids = indexed_ids.get(key, set())
+        to_remove |= old_ids - fresh.keys()
+        for chunk_id, chunk in fresh.items():
+            if chunk_id in old_ids:
+                # Same text at the same position: keep the vector and the sources merged into it,
+                # refresh the fingerprint
+                if "sources" in chunks[chunk_id]:
+                    chunk["sources"] = chunks[chunk_id]["sources"]
+                chunks[chunk_id] = chunk
+            else:
+                new_chunks[chunk_id] = chunk
+
+    # Other sources' copies of a removed passage were dropped as its duplicates, so chunk them again
+    orphaned = {source_key(source) for chunk_id in to_remove for source in chunk_sources(chunks[chunk_id])}
+    orphaned = sorted(key for key in orphaned if key in sources and key not in fresh_chunks)
+    if orphaned:
+        print(f"Re-chunking {len(orphaned)} sources that shared removed passages")
+        for fresh in extract_chunks(sources, orphaned, pdf_dir, html_dir, workers=workers).values():
+            new_chunks.update((chunk_id, chunk) for chunk_id, chunk in fresh.items() if chunk_id not in chunks)
+
+    for chunk_id in to_remove:
+        del chunks[chunk_id]
+    # Changed sources come back below if their new chunks still repeat the passage
+    affected = set(changed) | set(deleted)
+    for chunk in chunks.values():
+        strip_sources(chunk, affected)
+
+    if dedup_threshold is not None and new_chunks:
+        kept, new_chunks = deduplicate_chunks(chunks, new_chunks, dedup_threshold)
+        to_remove |= chunks.keys() - kept.keys()
+        chunks = kept
+
+    up_to_date = not (to_remove or new_chunks or changed or deleted)
+    if check:
+        print(f"Index is {'up to date' if up_to_date else 'out of date'}: "
+              f"+{len(new_chunks)} / -{len(to_remove)} vectors")
+        return up_to_date
+
+    if index is not None and to_remove:
+        print(f"Removing {len(to_remove)} vectors")
+        index = remove_vectors(index, np.array(sorted(to_remove), dtype='int64'))
+
+    if new_chunks:
+        print(f"Encoding {len(new_chunks)} new chunks")
+        model = load_encoder(encoder_backend)
+        ids = np.array(list(new_chunks.keys()), dtype='int64')
+        embeddings = prepare_vectors(
+            model.encode([c["text"] for c in new_chunks.values()], show_progress_bar=True), metric
+        )
+        if index is None:
+            index, _ = build_index(embeddings, index_type=index_type, ids=ids, metric=metric)
+        else:
+            index.add_with_ids(embeddings, ids)
+        chunks.update(new_chunks)
+
+    if index is None:
+        print("No chunks to index.")
+        return up_to_date
+
+    if up_to_date:
+        print(f"✅ Index is up to date: +0 / -0 vectors, {index.ntotal} total")
+    else:
+        # Index first, then chunk store, then the manifest; see the module docstring
+        ordered_ids = sorted(chunks)
+        write_atomic_index(index, INDEX_PATH)
+        # Sub-indexes of an earlier create_embeddings.py build no longer match; filters still work without them
+        remove_partitions(EMBEDDINGS_DIR)
+        write_chunk_store(STORE_PATH, [chunks[i] for i in ordered_ids], ids=ordered_ids)
+        if os.path.exists(METADATA_PATH):
+            # The JSON copy of an earlier build would no longer match the index
+            os.remove(METADATA_PATH)
+        # BM25 statistics are corpus-wide, so the lexical index is rebuilt; no encoding involved
+        write_lexical_index(LEXICAL_PATH, [chunks[i] for i in ordered_ids], ids=ordered_ids)
+        version = write_index_version(EMBEDDINGS_DIR, index_type=index_type, metric=metric, num_vectors=index.ntotal)
+        print(f"✅ Index updated: +{len(new_chunks)} / -{len(to_remove)} vectors, "
+              f"{index.ntotal} total, in {time.time() - start_time:.1f} seconds (version {version})")
+
+    write_manifest(index_type, metric, manifest_files(sources))
+    return up_to_date
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the FAISS index from data/pdfs and the crawled articles")
+    parser.add_argument("--pdf-dir", default="data/pdfs")
+    parser.add_argument("--html-dir", default=HTML_DIR, help="Output directory of crawl_angelone.py")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None,
+                        help="Index type for a new index (default: the manifest's, else flat)")
+    parser.add_argument("--rebuild", action="store_true", help="Ignore existing state and re-index everything")
+    parser.add_argument("--metric", choices=METRICS, default=None,
+                        help="Distance metric; changing it rebuilds the index (default: the manifest's, else l2)")
+    parser.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default=os.environ.get("ENCODER_BACKEND", "torch"),
+                        help="Embedding backend (default: torch, or $ENCODER_BACKEND)")
+    parser.add_argument("--workers", type=int, default=None, help="PDF and HTML extraction processes (default: CPU count)")
+    parser.add_argument("--check", action="store_true",
+                        help="Only report the vectors an update would add and remove; exit with status 1 if any")
+    add_dedup_arguments(parser)
+    args = parser.parse_args()
+    up_to_date = update_index(pdf_dir=args.pdf_dir, index_type=args.index_type, rebuild=args.rebuild,
+                              encoder_backend=args.encoder_backend, metric=args.metric, html_dir=args.html_dir,
+                              workers=args.workers, check=args.check,
+                              dedup_threshold=args.dedup_threshold if args.dedup else None)
+    if args.check and not up_to_date:
+        sys.exit(1)
@@ -0,0 +1,253 @@
+import asyncio
+import collections
+import json
+import math
+import time
+from contextvars import ContextVar
+from typing import Callable, Iterable, Optional
+
+# Header carrying a client's time budget for one request, in seconds
+TIMEOUT_HEADER = b"x-request-timeout"
+
+# time.monotonic() by which the request being handled must be answered
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: int = 1):
+        """
+        A request the server turns away instead of answering late
+
+        Args:
+            status_code: 429 when the queue is full, 503 when the request can't
+                be answered within its deadline
+            detail: Reason sent to the client
+            retry_after: Seconds the client should wait before retrying
+        """
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+def time_left() -> Optional[float]:
+    """Seconds until the current request's deadline; None outside of an admitted request"""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int = 64, max_queue: int = 256):
+        """
+        Bound the requests being worked on and the requests waiting for a turn
+
+        At most `max_in_flight` requests run at once and at most `max_queue`
+        wait for a slot, in arrival order. Everything beyond is rejected at
+        once, as is a request whose deadline would pass before its turn
+        comes, judging by how long recent requests took.
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self._waiters = collections.deque()
+        # Moving average of the seconds a request holds its slot
+        self.service_time = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def expected_wait(self, position: int = None) -> float:
+        """Seconds until a slot frees up for the request at `position` in the queue (default: a new one)"""
+        position = self.waiting if position is None else position
+        if self.active < self.max_in_flight and position == 0:
+            return 0.0
+        return self.service_time * (position + 1) / self.max_in_flight
+
+    def retry_after(self) -> int:
+        """Whole seconds for the current queue to drain, at least one"""
+        return max(1, math.ceil(self.expected_wait()))
+
+    async def acquire(self, deadline: float = None):
+        """
+        Wait for a slot
+
+        Raises:
+            Overloaded: The queue is full, or the deadline passes before a slot is free
+        """
+        if self.active < self.max_in_flight and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded(429, "Too many requests in the queue", self.retry_after())
+        timeout = None if deadline is None else deadline - time.monotonic()
+        if timeout is not None and self.expected_wait() > timeout:
+            raise Overloaded(503, "The request would not be answered within its deadline", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # Shielded, so a slot handed over at the last moment is not lost with the waiter
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Given a slot as the wait ended; pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded(503, "Deadline passed while waiting in the queue", self.retry_after()) from None
+            raise
+
+    def release(self, held: float = None):
+        """
+        Free a slot, handing it to the longest waiting request
+
+        Args:
+            held: Seconds the slot was held, to update the service time estimate
+        """
+        if held is not None:
+            self.service_time = held if self.service_time == 0 else 0.9 * self.service_time + 0.1 * held
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot changes hands without becoming free
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.active,
+            "queued": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "service_time_ms": round(self.service_time * 1000, 3),
+        }
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str], timeout: float = 30.0,
+                 max_timeout: float = 120.0, on_event: Callable = None):
+        """
+        ASGI middleware applying admission control and deadlines to some paths
+
+        Each request gets a deadline from its X-Request-Timeout header (seconds,
+        capped at `max_timeout`) or `timeout`, available to the handler through
+        time_left(); a header that is not a positive number is answered with
+        400. Requests over capacity are answered at once with 429 or
+        503 and a Retry-After header. A request whose client disconnects is
+        cancelled, whether it is still queued or already running, so queued
+        retrieval work is dropped before it reaches the model; its scope is
+        marked with "client_disconnected".
+
+        Args:
+            app: The wrapped ASGI app
+            controller: Shared AdmissionController
+            paths: Paths whose POST requests admission control applies to
+            on_event: Called as on_event(reason) for "queue_full", "deadline"
+                and "disconnected" requests, e.g. to count them
+        """
+        self.app = app
+        self.controller = controller
+        self.paths = set(paths)
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.on_event = on_event
+
+    def _timeout(self, scope) -> float:
+        """
+        Seconds the request may take
+
+        Raises:
+            ValueError: The X-Request-Timeout header is not a positive number
+        """
+        for name, value in scope["headers"]:
+            if name == TIMEOUT_HEADER:
+                try:
+                    timeout = float(value)
+                except ValueError:
+                    timeout = math.nan
+                # Also rejects NaN
+                if not timeout > 0:
+                    raise ValueError(f"X-Request-Timeout must be a positive number of seconds, "
+                                     f"got {value.decode('latin-1')!r}")
+                return min(timeout, self.max_timeout)
+        return self.timeout
+
+    def _event(self, reason: str):
+        if self.on_event:
+            self.on_event(reason)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            deadline = time.monotonic() + self._timeout(scope)
+        except ValueError as e:
+            await self._respond(send, 400, str(e))
+            return
+        token = current_deadline.set(deadline)
+        # All messages from the client go through one reader, so a disconnect is seen while the app works
+        messages = asyncio.Queue()
+
+        async def read_messages():
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+
+        async def handle():
+            try:
+                await self.controller.acquire(deadline)
+            except Overloaded as e:
+                self._event("queue_full" if e.status_code == 429 else "deadline")
+                await self._reject(send, e)
+                return
+            started = time.monotonic()
+            try:
+                await self.app(scope, messages.get, send)
+            finally:
+                self.controller.release(time.monotonic() - started)
+
+        try:
+            # Both tasks start from this context and so see the deadline
+            reader = asyncio.create_task(read_messages())
+            handler = asyncio.create_task(handle())
+        finally:
+            current_deadline.reset(token)
+        try:
+            await asyncio.wait({reader, handler}, return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done():
+                # The client is gone; nobody will read the answer
+                handler.cancel()
+                scope["client_disconnected"] = True
+                self._event("disconnected")
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if not reader.done():
+                    raise
+        finally:
+            reader.cancel()
+            handler.cancel()
+
+    @staticmethod
+    async def _respond(send, status_code: int, detail: str, headers=()):
+        """Answer with a JSON error body, shaped like FastAPI's HTTPException responses"""
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("ascii")),
+                *headers,
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @classmethod
+    async def _reject(cls, send, error: Overloaded):
+        await cls._respond(send, error.status_code, error.detail,
+                           [(b"retry-after", str(error.retry_after).encode("ascii"))])
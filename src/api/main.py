@@ -1,19 +1,95 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Any, Dict, List
+import asyncio
+import json
 import os
 import sys
 import logging
-from ..chatbot.retriever import Retriever
+from ..chatbot.retriever import OVERFETCH, Retriever
 from ..chatbot.generator import Generator
+from ..chatbot.batcher import QueryBatcher
+from ..chatbot.cache import QueryCache
+from ..chatbot.index_manager import IndexManager
+from ..chatbot.dedup import chunk_sources
+from ..chatbot.filters import normalize_filters
+from .admission import AdmissionController, AdmissionMiddleware, Overloaded, current_deadline, time_left
+from .metrics import CONTENT_TYPE, Registry
+from .timing import TimingMiddleware, record, stage, timed, timed_iter
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# DEBUG adds per-query and per-chunk logs, which are too costly to keep on under load
+logging.getLogger().setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 
-# Initialize app with CORS
+# Initialize app; CORS is added after the other middleware below
 app = FastAPI(title="PDF Knowledge Base API")
 
+# Prometheus metrics served at /metrics
+metrics = Registry()
+REQUEST_SECONDS = metrics.histogram("rag_request_duration_seconds", "Time to handle a request", ["path"])
+STAGE_SECONDS = metrics.histogram(
+    "rag_stage_duration_seconds", "Time per request spent in a stage (queue, encode, search, generate, serialize)", ["stage"]
+)
+REQUESTS = metrics.counter("rag_requests_total", "Requests handled", ["path", "status"])
+QUERIES = metrics.counter("rag_queries_total", "Queries received by the chat endpoints", ["endpoint"])
+CACHE_HITS = metrics.counter("rag_cache_hits_total", "Queries answered from a response cache", ["tier"])
+EMPTY_RESULTS = metrics.counter("rag_empty_results_total", "Queries for which no chunk passed the threshold")
+SHARDS_MISSING = metrics.counter(
+    "rag_shards_missing_total", "Queries answered without a shard that did not respond in time", ["shard"]
+)
+ERRORS = metrics.counter("rag_errors_total", "Queries that failed with an error", ["endpoint"])
+INDEX_VECTORS = metrics.gauge("rag_index_vectors", "Vectors in the active index")
+INDEX_CHUNKS = metrics.gauge("rag_index_chunks", "Chunks in the active chunk store")
+INDEX_INFO = metrics.gauge("rag_index_info", "Active index version (always 1)", ["version"])
+INDEX_LOADED = metrics.gauge("rag_index_loaded_timestamp_seconds", "When the active index was loaded")
+CACHE_ENTRIES = metrics.gauge("rag_cache_entries", "Entries held per cache tier", ["tier"])
+SHED = metrics.counter(
+    "rag_requests_shed_total", "Chat requests rejected or dropped (queue_full, deadline, disconnected)", ["reason"]
+)
+IN_FLIGHT = metrics.gauge("rag_requests_in_flight", "Chat requests being worked on")
+QUEUED = metrics.gauge("rag_requests_queued", "Chat requests waiting for admission")
+
+_route_paths = None
+
+def observe_request(scope, status, timer):
+    """Record the duration and stages of a finished request"""
+    global _route_paths
+    if _route_paths is None:
+        _route_paths = {route.path for route in app.routes}
+    # Unknown paths share one label so scanners can't blow up the series count
+    path = scope["path"] if scope["path"] in _route_paths else "other"
+    REQUEST_SECONDS.observe(timer.elapsed(), path=path)
+    # 499: the client went away before the response (nginx's convention)
+    REQUESTS.inc(path=path, status=status or (499 if scope.get("client_disconnected") else 500))
+    for name, seconds in timer.stages.items():
+        if name != "total":
+            STAGE_SECONDS.observe(seconds, stage=name)
+
+# Bounded work and waiting for the chat endpoints: beyond MAX_IN_FLIGHT running and MAX_QUEUED waiting
+# requests, clients get a fast 429/503 with Retry-After instead of a slow answer
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get("MAX_IN_FLIGHT", "64")),
+    max_queue=int(os.environ.get("MAX_QUEUED", "256")),
+)
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    paths=["/chat", "/chat/stream", "/chat/batch"],
+    # Default deadline for requests without an X-Request-Timeout header, and the cap on the header
+    timeout=float(os.environ.get("REQUEST_TIMEOUT_SECONDS", "30")),
+    max_timeout=float(os.environ.get("REQUEST_TIMEOUT_MAX_SECONDS", "120")),
+    on_event=lambda reason: SHED.inc(reason=reason),
+)
+
+# Per-stage timings for metrics, and a Server-Timing header on request or when TIMING_HEADERS is set;
+# added after admission control so it is outside it and also times rejected requests
+app.add_middleware(TimingMiddleware, on_complete=observe_request)
+
+# Outermost, so that 400/429/503 answers from the admission middleware also carry CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # In production, replace with specific origins
@@ -22,25 +98,113 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Tiered query cache, cleared automatically when the index file changes
+query_cache = QueryCache(
+    index_path="data/embeddings/docs.index",
+    embedding_size=int(os.environ.get("CACHE_EMBEDDING_SIZE", "4096")),
+    response_size=int(os.environ.get("CACHE_RESPONSE_SIZE", "1024")),
+    semantic_size=int(os.environ.get("CACHE_SEMANTIC_SIZE", "1024")),
+    ttl=float(os.environ.get("CACHE_TTL_SECONDS", "3600")),
+    semantic_threshold=float(os.environ.get("CACHE_SEMANTIC_THRESHOLD", "0.95")),
+)
+
+def load_retriever(previous: Retriever = None) -> Retriever:
+    """Load the index on disk, reusing the embedding model of the previous retriever"""
+    return Retriever(
+        embedding_cache=query_cache.embeddings,
+        nprobe=int(os.environ["SEARCH_NPROBE"]) if os.environ.get("SEARCH_NPROBE") else None,
+        ef_search=int(os.environ["SEARCH_EF"]) if os.environ.get("SEARCH_EF") else None,
+        overfetch=int(os.environ.get("SEARCH_OVERFETCH", str(OVERFETCH))),
+        model=previous.model if previous else None,
+        encoder_backend=os.environ.get("ENCODER_BACKEND", "torch"),
+        encoder_threads=int(os.environ["ENCODER_THREADS"]) if os.environ.get("ENCODER_THREADS") else None,
+        mode=os.environ.get("RETRIEVAL_MODE", "dense"),
+        mmap_index=os.environ.get("INDEX_MMAP", "0") not in ("", "0", "false"),
+        # "host:port" of remote shard servers; without them a sharded index runs its shards locally
+        shard_addresses=os.environ["SHARD_ADDRESSES"].split(",") if os.environ.get("SHARD_ADDRESSES") else None,
+        shard_timeout=float(os.environ.get("SHARD_TIMEOUT_MS", "1000")) / 1000,
+    )
+
+def swap_retriever(new_retriever: Retriever):
+    """Route new queries to a freshly loaded index version"""
+    batcher.retriever = new_retriever
+    # Responses from the old index are stale; query embeddings are still valid
+    query_cache.responses.clear()
+    query_cache.semantic.clear()
+
+# Loads new index versions in the background and swaps them in atomically
+index_manager = IndexManager(load_retriever, on_swap=swap_retriever)
+
+# Seconds between checks for a new index version; 0 disables watching
+INDEX_WATCH_INTERVAL = float(os.environ.get("INDEX_WATCH_INTERVAL", "10"))
+
+# Micro-batching of concurrent queries in front of the retriever
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+batcher = QueryBatcher(
+    None,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    cache=query_cache,
+)
+
 # Initialize chatbot components
 try:
-    retriever = Retriever()
     generator = Generator()
-    logger.info("Chatbot components initialized successfully.")
 except Exception as e:
     logger.error(f"Error initializing chatbot components: {e}")
-    logger.error("Make sure you have run the data processing and embedding scripts.")
-    retriever = None
     generator = None
 
+if index_manager.load():
+    logger.info("Chatbot components initialized successfully.")
+else:
+    logger.error(f"Error loading index: {index_manager.last_error}")
+    logger.error("Make sure you have run the data processing and embedding scripts; a new index is picked up without a restart.")
+
+index_watcher = None
+
+@app.on_event("startup")
+async def start_background_tasks():
+    global index_watcher
+    await batcher.start()
+    if INDEX_WATCH_INTERVAL > 0:
+        index_watcher = asyncio.create_task(index_manager.watch(INDEX_WATCH_INTERVAL))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    if index_watcher:
+        index_watcher.cancel()
+    await batcher.stop()
+
+# Minimum similarity of a retrieved chunk: 1/(1+L2 distance) for l2 indexes, cosine for cosine indexes
+SEARCH_THRESHOLD = float(os.environ.get("SEARCH_THRESHOLD", "0.2"))
+# Chunks retrieved per query; scripts/evaluate_retrieval.py measures the trade-off with the threshold
+SEARCH_K = int(os.environ.get("SEARCH_K", "5"))
+
+# Upper bound on the number of queries accepted by /chat/batch
+CHAT_BATCH_MAX_QUERIES = int(os.environ.get("CHAT_BATCH_MAX_QUERIES", "2000"))
+
+NO_ANSWER_RESPONSE = "I don't know the answer to that question based on my available information. Try rephrasing your question or asking about topics in the PDFs."
+
 class Query(BaseModel):
     text: str
+    # Only search chunks whose metadata matches: {field: value or list of values}
+    filters: Dict[str, Any] = None
+
+class BatchQuery(BaseModel):
+    texts: List[str]
+    # Applied to every query of the batch
+    filters: Dict[str, Any] = None
 
 class ChatResponse(BaseModel):
     response: str
     sources: list = []
     error: str = None
     debug_info: dict = None
+    index_version: str = None
+
+class BatchChatResponse(BaseModel):
+    results: List[ChatResponse]
 
 @app.get("/")
 async def read_root():
@@ -49,59 +213,347 @@ async def read_root():
         "message": "PDF Knowledge Base API is running. Send POST requests to /chat endpoint."
     }
 
+def summarize_retrieval(text: str, context_chunks: list, missing_shards=()) -> dict:
+    """Sources and debug info of the retrieved chunks, known before any text is generated"""
+    # Add debug info
+    debug_info = {
+        "num_chunks_retrieved": len(context_chunks),
+        "similarity_scores": [chunk.get("similarity", 0) for chunk in context_chunks[:3]] if context_chunks else [],
+        "sources": [chunk["source"] for chunk in context_chunks[:3]] if context_chunks else [],
+        "retrieval": context_chunks[0].get("retrieval") if context_chunks else None,
+    }
+    if missing_shards:
+        # Partial results: the chunks come from the shards that answered in time
+        debug_info["shards_missing"] = list(missing_shards)
+        for shard in missing_shards:
+            SHARDS_MISSING.inc(shard=shard)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Debug info: {debug_info}")
+    
+    # If no relevant chunks found
+    if not context_chunks:
+        EMPTY_RESULTS.inc()
+        logger.warning(f"No relevant chunks found for query: '{text}'")
+    
+    # Extract sources from chunks
+    sources = []
+    for chunk in context_chunks:
+        # A deduplicated passage cites every document it appears in
+        for source in chunk_sources(chunk):
+            if source not in sources:
+                sources.append(source)
+    
+    return {"sources": sources, "debug_info": debug_info}
+
+def generate_pieces(text: str, context_chunks: list):
+    """Answer text for the retrieved chunks, piece by piece as the generator produces it"""
+    if not context_chunks:
+        return iter([NO_ANSWER_RESPONSE])
+    return generator.generate_response_stream(text, context_chunks)
+
+def build_chat_response(text: str, context_chunks: list, missing_shards=()) -> ChatResponse:
+    """Build the API response for one query from its retrieved chunks"""
+    summary = summarize_retrieval(text, context_chunks, missing_shards)
+    
+    # Generate response
+    if not context_chunks:
+        response = NO_ANSWER_RESPONSE
+    else:
+        response = generator.generate_response(text, context_chunks)
+        logger.debug(f"Returning response with {len(summary['sources'])} sources")
+    
+    return ChatResponse(response=response, **summary)
+
+def cached_chat_response(value: dict, tier: str) -> ChatResponse:
+    """Rebuild a cached response, marking which cache tier served it"""
+    debug_info = dict(value.get("debug_info") or {})
+    debug_info["cache"] = tier
+    return ChatResponse(**{**value, "debug_info": debug_info})
+
+def record_retrieval(results: list):
+    """Add the retrieval stages of the results to the request's timings"""
+    # Results retrieved together share their stages; the slowest one bounds the request
+    for name in ("queue", "encode", "search"):
+        record(name, max((result.timings or {}).get(name, 0.0) for result in results))
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, error: Overloaded):
+    return JSONResponse({"detail": error.detail}, status_code=error.status_code,
+                        headers={"Retry-After": str(error.retry_after)})
+
+def deadline_exceeded(stage: str) -> Overloaded:
+    """Rejection for a request whose deadline passed before `stage`"""
+    SHED.inc(reason="deadline")
+    return Overloaded(503, f"Request deadline passed before {stage}", admission.retry_after())
+
+def check_deadline(stage: str):
+    """Give up on the current request if its deadline has passed"""
+    left = time_left()
+    if left is not None and left <= 0:
+        raise deadline_exceeded(stage)
+
+def parse_filters(filters: dict):
+    """Validate request filters and return their normalized form"""
+    for field, values in (filters or {}).items():
+        values = values if isinstance(values, list) else [values]
+        if not values or not all(isinstance(value, (str, int, float, bool)) for value in values):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Filter {field!r} must be a value or a non-empty list of strings, numbers or booleans"
+            )
+    return normalize_filters(filters)
+
+def cache_response(text: str, result, value: dict, k: int = SEARCH_K, threshold: float = SEARCH_THRESHOLD, filters=None):
+    """Store a freshly built response in the exact and semantic caches"""
+    # A result from an index that was swapped out meanwhile, or from only some shards, must not be cached
+    if result.index_version == index_manager.version and not result.missing_shards:
+        query_cache.responses.put(QueryCache.response_key(text, k, threshold, filters), value)
+        # Lexically routed queries were never encoded; filtered answers don't fit unfiltered near-duplicates
+        if result.vector is not None and not filters:
+            query_cache.semantic.put(result.vector, value)
+
+def answer_from_semantic_cache(text: str, result, k: int = SEARCH_K, threshold: float = SEARCH_THRESHOLD) -> ChatResponse:
+    """Serve a near-duplicate's cached response, promoting it to the exact cache"""
+    CACHE_HITS.inc(tier="semantic")
+    if result.index_version == index_manager.version:
+        query_cache.responses.put(QueryCache.response_key(text, k, threshold), result.cached_response)
+    return cached_chat_response(result.cached_response, "semantic")
+
+def answer_query(text: str, result, k: int = SEARCH_K, threshold: float = SEARCH_THRESHOLD, filters=None) -> ChatResponse:
+    """Build the response for a retrieval result and populate the response caches"""
+    if result.cached_response is not None:
+        return answer_from_semantic_cache(text, result, k, threshold)
+    
+    with stage("generate"):
+        response = build_chat_response(text, result.chunks, result.missing_shards)
+    response.index_version = result.index_version
+    cache_response(text, result, response.dict(), k, threshold, filters)
+    return response
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_response(response: ChatResponse):
+    """Stream an already complete response with the same events as a generated one"""
+    yield sse_event("sources", {"sources": response.sources, "debug_info": response.debug_info,
+                                "index_version": response.index_version})
+    yield sse_event("delta", {"text": response.response})
+    yield sse_event("done", response.dict())
+
+async def stream_answer(text: str, result, filters=None):
+    """Send sources as soon as retrieval is done, then the answer as it is generated"""
+    try:
+        summary = summarize_retrieval(text, result.chunks, result.missing_shards)
+        yield sse_event("sources", {**summary, "index_version": result.index_version})
+        
+        pieces = []
+        for piece in timed_iter("generate", generate_pieces(text, result.chunks)):
+            pieces.append(piece)
+            yield sse_event("delta", {"text": piece})
+            left = time_left()
+            if left is not None and left <= 0:
+                SHED.inc(reason="deadline")
+                yield sse_event("error", {"error": "Request deadline passed while generating the answer"})
+                return
+        
+        response = ChatResponse(response="".join(pieces), index_version=result.index_version, **summary)
+        value = response.dict()
+        cache_response(text, result, value, filters=filters)
+        yield sse_event("done", value)
+    except Exception as e:
+        logger.error(f"Error streaming chat response: {e}", exc_info=True)
+        ERRORS.inc(endpoint="stream")
+        yield sse_event("error", {"error": str(e)})
+
 @app.post("/chat")
+@timed
 async def chat(query: Query):
     if not query.text or query.text.strip() == "":
         raise HTTPException(status_code=400, detail="Query text cannot be empty")
     
-    if not retriever or not generator:
+    if not index_manager.retriever or not generator:
         raise HTTPException(
             status_code=503,
             detail="Chatbot components not initialized. Please check server logs."
         )
     
+    filters = parse_filters(query.filters)
     try:
-        logger.info(f"Received query: '{query.text}'")
-        
-        # Get relevant context
-        context_chunks = retriever.get_relevant_chunks(query.text, threshold=0.2)
+        logger.debug(f"Received query: '{query.text}'")
+        QUERIES.inc(endpoint="chat")
         
-        # Add debug info
-        debug_info = {
-            "num_chunks_retrieved": len(context_chunks),
-            "similarity_scores": [chunk.get("similarity", 0) for chunk in context_chunks[:3]] if context_chunks else [],
-            "sources": [chunk["source"] for chunk in context_chunks[:3]] if context_chunks else []
-        }
-        logger.info(f"Debug info: {debug_info}")
+        query_cache.validate()
+        cached = query_cache.responses.get(QueryCache.response_key(query.text, SEARCH_K, SEARCH_THRESHOLD, filters))
+        if cached is not None:
+            CACHE_HITS.inc(tier="exact")
+            return cached_chat_response(cached, "exact")
         
-        # If no relevant chunks found
-        if not context_chunks:
-            logger.warning(f"No relevant chunks found for query: '{query.text}'")
-            return ChatResponse(
-                response="I don't know the answer to that question based on my available information. Try rephrasing your question or asking about topics in the PDFs.",
-                sources=[],
-                debug_info=debug_info
-            )
-        
-        # Generate response
-        response = generator.generate_response(query.text, context_chunks)
-        
-        # Extract sources from chunks
-        sources = []
-        for chunk in context_chunks:
-            if chunk["source"] not in sources:
-                sources.append(chunk["source"])
+        # Get relevant context
+        result = await batcher.submit(query.text, k=SEARCH_K, threshold=SEARCH_THRESHOLD, filters=filters,
+                                      deadline=current_deadline.get())
+        record_retrieval([result])
         
-        logger.info(f"Returning response with {len(sources)} sources")
-        return ChatResponse(
-            response=response,
-            sources=sources,
-            debug_info=debug_info
-        )
+        check_deadline("generation")
+        return answer_query(query.text, result, filters=filters)
+    except TimeoutError:
+        raise deadline_exceeded("retrieval")
+    except Overloaded:
+        raise
     except Exception as e:
         logger.error(f"Error processing chat request: {e}", exc_info=True)
+        ERRORS.inc(endpoint="chat")
         return ChatResponse(
             response="I'm sorry, but I encountered an error while processing your request.",
             error=str(e),
             debug_info={"error": str(e)}
-        )
\ No newline at end of file
+        )
+
+@app.post("/chat/stream")
+@timed
+async def chat_stream(query: Query):
+    """
+    Answer a query as Server-Sent Events
+
+    Events: "sources" (sources and debug info, as soon as retrieval is done),
+    "delta" (a piece of the answer text, repeated), then "done" with the
+    complete /chat response, or "error".
+    """
+    if not query.text or query.text.strip() == "":
+        raise HTTPException(status_code=400, detail="Query text cannot be empty")
+    
+    if not index_manager.retriever or not generator:
+        raise HTTPException(
+            status_code=503,
+            detail="Chatbot components not initialized. Please check server logs."
+        )
+    
+    filters = parse_filters(query.filters)
+    logger.debug(f"Received streaming query: '{query.text}'")
+    QUERIES.inc(endpoint="stream")
+    # Proxies must pass events on as they come instead of buffering the response
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    
+    query_cache.validate()
+    cached = query_cache.responses.get(QueryCache.response_key(query.text, SEARCH_K, SEARCH_THRESHOLD, filters))
+    if cached is not None:
+        CACHE_HITS.inc(tier="exact")
+        events = stream_response(cached_chat_response(cached, "exact"))
+        return StreamingResponse(events, media_type="text/event-stream", headers=headers)
+    
+    try:
+        result = await batcher.submit(query.text, k=SEARCH_K, threshold=SEARCH_THRESHOLD, filters=filters,
+                                      deadline=current_deadline.get())
+        record_retrieval([result])
+    except TimeoutError:
+        raise deadline_exceeded("retrieval")
+    except Exception as e:
+        logger.error(f"Error processing streaming chat request: {e}", exc_info=True)
+        ERRORS.inc(endpoint="stream")
+        events = iter([sse_event("error", {"error": str(e)})])
+        return StreamingResponse(events, media_type="text/event-stream", headers=headers)
+    
+    if result.cached_response is not None:
+        events = stream_response(answer_from_semantic_cache(query.text, result))
+    else:
+        events = stream_answer(query.text, result, filters)
+    return StreamingResponse(events, media_type="text/event-stream", headers=headers)
+
+@app.post("/chat/batch")
+@timed
+async def chat_batch(batch: BatchQuery):
+    if not batch.texts:
+        raise HTTPException(status_code=400, detail="Batch must contain at least one query")
+    
+    if len(batch.texts) > CHAT_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch contains {len(batch.texts)} queries; the limit is {CHAT_BATCH_MAX_QUERIES}"
+        )
+    
+    for i, text in enumerate(batch.texts):
+        if not text or text.strip() == "":
+            raise HTTPException(status_code=400, detail=f"Query text at index {i} cannot be empty")
+    
+    if not index_manager.retriever or not generator:
+        raise HTTPException(
+            status_code=503,
+            detail="Chatbot components not initialized. Please check server logs."
+        )
+    
+    filters = parse_filters(batch.filters)
+    try:
+        logger.debug(f"Received batch of {len(batch.texts)} queries")
+        QUERIES.inc(len(batch.texts), endpoint="batch")
+        
+        query_cache.validate()
+        results = [None] * len(batch.texts)
+        uncached = []
+        for i, text in enumerate(batch.texts):
+            cached = query_cache.responses.get(QueryCache.response_key(text, SEARCH_K, SEARCH_THRESHOLD, filters))
+            if cached is not None:
+                CACHE_HITS.inc(tier="exact")
+                results[i] = cached_chat_response(cached, "exact")
+            else:
+                uncached.append(i)
+        
+        if uncached:
+            # One encode call and one matrix search for the remaining queries
+            retrieved = await batcher.submit_many([batch.texts[i] for i in uncached], k=SEARCH_K, threshold=SEARCH_THRESHOLD,
+                                                  filters=filters, deadline=current_deadline.get())
+            record_retrieval(retrieved)
+            check_deadline("generation")
+            for i, result in zip(uncached, retrieved):
+                results[i] = answer_query(batch.texts[i], result, filters=filters)
+        
+        return BatchChatResponse(results=results)
+    except TimeoutError:
+        raise deadline_exceeded("retrieval")
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Error processing batch chat request: {e}", exc_info=True)
+        ERRORS.inc(len(batch.texts), endpoint="batch")
+        raise HTTPException(status_code=500, detail=f"Error processing batch: {e}")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return query_cache.stats()
+
+@app.get("/filters")
+async def filter_values(field: str = "source"):
+    """Values of a chunk metadata field that /chat filters can use, with their chunk counts"""
+    if not index_manager.retriever:
+        raise HTTPException(status_code=503, detail="No index loaded")
+    values = await asyncio.get_running_loop().run_in_executor(None, index_manager.retriever.filter.values, field)
+    return {"field": field, "values": values}
+
+@metrics.collector
+def collect_index_metrics():
+    retriever = index_manager.retriever
+    INDEX_VECTORS.set(retriever.index.ntotal if retriever else 0)
+    INDEX_CHUNKS.set(len(retriever.chunks) if retriever else 0)
+    INDEX_INFO.clear()
+    if index_manager.version:
+        INDEX_INFO.set(1, version=index_manager.version)
+    INDEX_LOADED.set(index_manager.loaded_at or 0)
+    for tier, stats in query_cache.stats().items():
+        CACHE_ENTRIES.set(stats["size"], tier=tier)
+    IN_FLIGHT.set(admission.active)
+    QUEUED.set(admission.waiting)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Serving metrics in the Prometheus text format"""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+@app.get("/status")
+async def status():
+    """Report the active index version, the state of background reloads and admission control"""
+    return {**index_manager.status(), "admission": admission.stats()}
+
+@app.post("/index/reload")
+async def reload_index():
+    """Load the index on disk now if its version differs from the active one"""
+    reloaded = await index_manager.reload()
+    return {"reloaded": reloaded, **index_manager.status()}
@@ -0,0 +1,130 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional
+from starlette.datastructures import MutableHeaders
+
+# Order of the stages in the Server-Timing header
+STAGES = ["queue", "encode", "search", "generate", "serialize", "total"]
+
+class StageTimer:
+    def __init__(self):
+        """Seconds spent per stage while handling one request"""
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.handler_done_at = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def handler_done(self):
+        """Mark the end of the endpoint; what follows until the response starts is serialization"""
+        self.handler_done_at = time.perf_counter()
+
+    def response_started(self):
+        now = time.perf_counter()
+        if self.handler_done_at is not None:
+            self.stages["serialize"] = now - self.handler_done_at
+        self.stages["total"] = now - self.started_at
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def header(self) -> str:
+        """Stages as a Server-Timing header value, in milliseconds"""
+        names = [s for s in STAGES if s in self.stages] + [s for s in self.stages if s not in STAGES]
+        return ", ".join(f"{name};dur={self.stages[name] * 1000:.3f}" for name in names)
+
+# Timer of the request being handled, if it is being timed
+current_timer: ContextVar[Optional[StageTimer]] = ContextVar("current_timer", default=None)
+
+def record(stage: str, seconds: float):
+    """Add time to a stage of the current request; no-op when timings are off"""
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add(stage, seconds)
+
+@contextmanager
+def stage(name: str):
+    """Time a block as a stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def timed_iter(name: str, iterable):
+    """Iterate, timing only the work of producing each item as a stage of the current request"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            record(name, time.perf_counter() - start)
+        yield item
+
+def timed(endpoint):
+    """Mark where an async endpoint returns, so serialization of its result can be timed"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            timer = current_timer.get()
+            if timer is not None:
+                timer.handler_done()
+    return wrapper
+
+class TimingMiddleware:
+    def __init__(self, app, always: bool = None, on_complete: Callable = None):
+        """
+        ASGI middleware timing the stages of each request
+
+        A Server-Timing header with the stage durations is added to every
+        response when `always` is set (default: the TIMING_HEADERS environment
+        variable), otherwise only to requests sending "X-Request-Timing: 1".
+
+        Args:
+            app: The wrapped ASGI app
+            always: Add the header to every response
+            on_complete: Called as on_complete(scope, status, timer) once the
+                response has been sent, e.g. to record metrics; status is None
+                if the app failed before responding
+        """
+        self.app = app
+        self.always = always if always is not None else os.environ.get("TIMING_HEADERS", "0") not in ("", "0", "false")
+        self.on_complete = on_complete
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        add_header = self.always or (b"x-request-timing", b"1") in scope["headers"]
+        if not add_header and self.on_complete is None:
+            await self.app(scope, receive, send)
+            return
+
+        timer = StageTimer()
+        token = current_timer.set(timer)
+        status = None
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timer.response_started()
+                if add_header:
+                    MutableHeaders(scope=message).append("Server-Timing", timer.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timer.reset(token)
+            if self.on_complete:
+                self.on_complete(scope, status, timer)
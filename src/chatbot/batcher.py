@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, NamedTuple, Optional, Tuple
+from .filters import normalize_filters
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class RetrievalResult(NamedTuple):
+    chunks: List[Dict]
+    # None for queries answered by the lexical index without encoding
+    vector: Optional[np.ndarray]
+    # Set when the semantic cache already holds a response for a near-duplicate query
+    cached_response: Optional[Dict] = None
+    # Version of the index that served the query
+    index_version: Optional[str] = None
+    # Seconds spent per stage (queue, encode, search); batch-wide stages are shared by its queries
+    timings: Optional[Dict[str, float]] = None
+    # Shards of a sharded index that did not answer in time; the chunks come from the others
+    missing_shards: Tuple[int, ...] = ()
+
+class QueryBatcher:
+    def __init__(self, retriever, max_batch_size: int = 32, max_wait_ms: float = 5.0, cache=None):
+        """
+        Collect concurrent queries into micro-batches for the retriever
+
+        Queries that arrive within `max_wait_ms` of the first queued query (or
+        until `max_batch_size` is reached) are encoded and searched together in
+        a worker thread, so the event loop never runs the model itself.
+
+        Args:
+            retriever: A Retriever exposing route, search_lexical, encode_queries and search_encoded;
+                may be replaced at any time to swap in a new index version
+            max_batch_size: Maximum number of queries per batch
+            max_wait_ms: How long to wait for more queries after the first one
+            cache: Optional QueryCache whose semantic tier is checked before searching
+        """
+        self.retriever = retriever
+        self.cache = cache
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        # A single worker keeps model calls serialized; batching provides the parallelism
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-batcher")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the background batching loop on the running event loop"""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Query batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    async def stop(self):
+        """Stop the batching loop and fail any queries still waiting"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        while not self._queue.empty():
+            future = self._queue.get_nowait()[4]
+            if not future.done():
+                future.set_exception(RuntimeError("Query batcher stopped"))
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, query: str, k: int = 5, threshold: float = 0.2, filters: Dict = None,
+                     deadline: float = None) -> RetrievalResult:
+        """
+        Queue a query and wait for its relevant chunks
+
+        Args:
+            query: The user question
+            k: Number of chunks to retrieve
+            threshold: Similarity threshold (0-1) for relevance filtering
+            filters: Metadata filters; queries with the same filters share a search call
+            deadline: time.monotonic() after which the result is of no use; a query
+                still queued then is dropped without being computed
+
+        Returns:
+            RetrievalResult with the relevant chunks and the query embedding
+
+        Raises:
+            TimeoutError: The deadline passed first
+        """
+        if self._task is None:
+            raise RuntimeError("Query batcher is not running")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, k, threshold, normalize_filters(filters), future, time.perf_counter(), deadline))
+        if deadline is None:
+            return await future
+        # Cancels the future on timeout, which takes the query out of its batch if it hasn't started
+        return await asyncio.wait_for(future, deadline - time.monotonic())
+
+    async def submit_many(self, queries: List[str], k: int = 5, threshold: float = 0.2,
+                          filters: Dict = None, deadline: float = None) -> List[RetrievalResult]:
+        """
+        Run a caller-assembled batch of queries as a single batch
+
+        The batch bypasses the collection window but shares the worker
+        thread, so model calls stay serialized with regular submissions.
+
+        Args:
+            queries: The user questions
+            k: Number of chunks to retrieve per query
+            threshold: Similarity threshold (0-1) for relevance filtering
+            filters: Metadata filters applied to every query
+            deadline: time.monotonic() after which the results are of no use
+
+        Returns:
+            One RetrievalResult per query, in input order
+
+        Raises:
+            TimeoutError: The deadline passed before the batch was searched
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._retrieve,
+            list(queries),
+            k,
+            threshold,
+            time.perf_counter(),
+            normalize_filters(filters),
+            deadline,
+        )
+
+    def _retrieve(self, queries: List[str], k: int, threshold: float,
+                  submitted_at: float = None, filters=None, deadline: float = None,
+                  wanted=None) -> List[RetrievalResult]:
+        """
+        Answer lexical routes, encode the rest, answer near-duplicates from the semantic cache and search
+
+        Args:
+            wanted: Optional callable taking a query's position; queries it rejects just
+                before the search are left out of it, and their result is None
+
+        Raises:
+            TimeoutError: `deadline`, the latest of the batch's, passed before a stage started
+        """
+        # The whole batch runs against one retriever even if it is swapped meanwhile
+        retriever = self.retriever
+        if retriever is None:
+            raise RuntimeError("No index loaded")
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError("Deadline passed before encoding")
+
+        start = time.perf_counter()
+        timings = {"encode": 0.0, "search": 0.0}
+        # Time spent waiting for the worker thread
+        if submitted_at is not None:
+            timings["queue"] = start - submitted_at
+        results = [None] * len(queries)
+        routed = retriever.route(queries)
+        lexical = [i for i, use_lexical in enumerate(routed) if use_lexical]
+        if lexical:
+            # Confident keyword matches never reach the model
+            found = retriever.search_lexical([queries[i] for i in lexical], k=k, filters=filters)
+            for i, chunks in zip(lexical, found):
+                results[i] = RetrievalResult(chunks, None, index_version=retriever.version, timings=timings)
+        timings["search"] += time.perf_counter() - start
+
+        to_encode = [i for i, use_lexical in enumerate(routed) if not use_lexical]
+        if not to_encode:
+            return results
+        start = time.perf_counter()
+        vectors = retriever.encode_queries([queries[i] for i in to_encode])
+        timings["encode"] += time.perf_counter() - start
+
+        # (query position, row of its vector) of the queries that still need a search
+        to_search = []
+        for row, (i, vector) in enumerate(zip(to_encode, vectors)):
+            # A near-duplicate's response may come from outside this query's filters
+            cached = self.cache.semantic.get(vector) if self.cache and not filters else None
+            if cached is not None:
+                results[i] = RetrievalResult([], vector, cached, retriever.version, timings)
+            else:
+                to_search.append((i, row))
+        if wanted is not None:
+            # Callers may have given up while the batch was encoded
+            to_search = [(i, row) for i, row in to_search if wanted(i)]
+
+        if to_search:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("Deadline passed before searching")
+            start = time.perf_counter()
+            found = retriever.search_encoded(
+                [queries[i] for i, _ in to_search],
+                vectors[[row for _, row in to_search]],
+                k=k,
+                threshold=threshold,
+                filters=filters,
+            )
+            timings["search"] += time.perf_counter() - start
+            missing = tuple(retriever.missing_shards())
+            for (i, row), chunks in zip(to_search, found):
+                results[i] = RetrievalResult(chunks, vectors[row], index_version=retriever.version, timings=timings,
+                                             missing_shards=missing)
+
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                # Take whatever is already queued without waiting
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._process(batch)
+
+    @staticmethod
+    def _pending(items):
+        """
+        Items still worth computing
+
+        Requests whose caller already gave up, or whose deadline has passed, are dropped;
+        the latter are failed with a TimeoutError.
+        """
+        now = time.monotonic()
+        for _, future, _, deadline in items:
+            if deadline is not None and now > deadline and not future.done():
+                future.set_exception(TimeoutError("Deadline passed while queued"))
+        return [item for item in items if not item[1].done()]
+
+    async def _process(self, batch):
+        loop = asyncio.get_running_loop()
+
+        # Queries with different parameters can't share a search call
+        groups = {}
+        for query, k, threshold, filters, future, enqueued_at, deadline in batch:
+            groups.setdefault((k, threshold, filters), []).append((query, future, enqueued_at, deadline))
+
+        for (k, threshold, filters), items in groups.items():
+            # Checked per group: earlier groups of the batch may have taken long enough for these to expire
+            items = self._pending(items)
+            if not items:
+                continue
+
+            def wanted(i, items=items):
+                # Called from the worker thread; only reads the future's state
+                future, deadline = items[i][1], items[i][3]
+                return not future.done() and (deadline is None or time.monotonic() <= deadline)
+
+            queries = [query for query, _, _, _ in items]
+            deadlines = [deadline for _, _, _, deadline in items]
+            dispatched_at = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor,
+                    self._retrieve,
+                    queries,
+                    k,
+                    threshold,
+                    dispatched_at,
+                    filters,
+                    # Worth finishing while any query of the group still waits for it
+                    None if None in deadlines else max(deadlines),
+                    wanted,
+                )
+            except TimeoutError as e:
+                for _, future, _, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            except Exception as e:
+                logger.error(f"Error processing batch of {len(queries)} queries: {e}", exc_info=True)
+                for _, future, _, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for item, result in zip(items, results):
+                _, future, enqueued_at, _ = item
+                if result is None:
+                    # Left out of the search: its caller gave up, or it fails here with a TimeoutError
+                    self._pending([item])
+                    continue
+                if not future.done():
+                    # Queued until the batch was dispatched, then waiting for the worker thread
+                    queue = dispatched_at - enqueued_at + result.timings["queue"]
+                    future.set_result(result._replace(timings={**result.timings, "queue": queue}))
@@ -0,0 +1,231 @@
+import faiss
+import numpy as np
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_query(text: str) -> str:
+    """Normalize query text for use as a cache key"""
+    return " ".join(text.lower().split())
+
+class LRUCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        """
+        Thread-safe LRU cache with a per-entry time-to-live
+
+        Args:
+            max_size: Maximum number of entries; 0 disables the cache
+            ttl: Seconds an entry stays valid after insertion; 0 means no expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class SemanticCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0, threshold: float = 0.95, candidates: int = 4):
+        """
+        Serve stored values for queries whose embedding is close to a cached one
+
+        Cached embeddings are L2-normalized and kept in a small in-memory
+        inner-product FAISS index, so the score of a hit is its cosine similarity.
+
+        Args:
+            max_size: Maximum number of entries; 0 disables the cache
+            ttl: Seconds an entry stays valid after insertion; 0 means no expiry
+            threshold: Minimum cosine similarity for a hit
+            candidates: Number of nearest entries checked per lookup
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.candidates = max(1, candidates)
+        self._index = None
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype='float32').reshape(1, -1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, entry_id: int):
+        del self._entries[entry_id]
+        self._index.remove_ids(np.array([entry_id], dtype='int64'))
+        self.evictions += 1
+
+    def get(self, vector: np.ndarray) -> Optional[Any]:
+        with self._lock:
+            if self._index is None or not self._entries:
+                self.misses += 1
+                return None
+
+            scores, ids = self._index.search(self._normalize(vector), min(self.candidates, len(self._entries)))
+            now = time.monotonic()
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < self.threshold:
+                    break
+                value, expires_at = self._entries[entry_id]
+                if expires_at and expires_at < now:
+                    self._remove(entry_id)
+                    continue
+                self._entries.move_to_end(entry_id)
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            return None
+
+    def put(self, vector: np.ndarray, value):
+        if self.max_size <= 0:
+            return
+        vector = self._normalize(vector)
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = (value, expires_at)
+
+            while len(self._entries) > self.max_size:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class QueryCache:
+    def __init__(
+        self,
+        index_path: str = "data/embeddings/docs.index",
+        embedding_size: int = 4096,
+        response_size: int = 1024,
+        semantic_size: int = 1024,
+        ttl: float = 3600.0,
+        semantic_threshold: float = 0.95,
+    ):
+        """
+        Tiered query cache in front of the retriever and generator
+
+        - embeddings: query embeddings keyed by normalized text
+        - responses: exact-match responses keyed by normalized text and search parameters
+        - semantic: responses for near-duplicate queries, matched by embedding
+
+        All tiers are cleared when the file at `index_path` changes.
+        """
+        self.index_path = index_path
+        self.embeddings = LRUCache(max_size=embedding_size, ttl=ttl)
+        self.responses = LRUCache(max_size=response_size, ttl=ttl)
+        self.semantic = SemanticCache(max_size=semantic_size, ttl=ttl, threshold=semantic_threshold)
+        self._index_signature = self._read_index_signature()
+        self._lock = threading.Lock()
+
+    def _read_index_signature(self):
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def validate(self):
+        """Clear every tier if the index file changed since the last check"""
+        signature = self._read_index_signature()
+        if signature == self._index_signature:
+            return
+        with self._lock:
+            if signature == self._index_signature:
+                return
+            logger.info(f"Index file {self.index_path} changed, invalidating query caches")
+            self.clear()
+            self._index_signature = signature
+
+    def clear(self):
+        self.embeddings.clear()
+        self.responses.clear()
+        self.semantic.clear()
+
+    @staticmethod
+    def response_key(text: str, k: int, threshold: float, filters=None):
+        """Key of a response; filters must be normalized (see filters.normalize_filters)"""
+        return (normalize_query(text), k, threshold, filters)
+
+    def stats(self) -> Dict:
+        return {
+            "embeddings": self.embeddings.stats(),
+            "responses": self.responses.stats(),
+            "semantic": self.semantic.stats(),
+        }
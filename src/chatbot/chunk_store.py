@@ -0,0 +1,253 @@
+import json
+import mmap
+import os
+import struct
+import logging
+import numpy as np
+from array import array
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# File layout:
+#   header  MAGIC, then count, ids, table and blob offsets as little-endian uint64
+#   blob    per-chunk UTF-8 metadata JSON (everything except "text") and text
+#   ids     sorted int64 vector IDs, one per chunk (the FAISS label of the chunk)
+#   table   one fixed-width RECORD_DTYPE entry per chunk, in ID order
+MAGIC = b"RAGCS002"
+HEADER = struct.Struct("<8sQQQQ")
+RECORD_DTYPE = np.dtype([
+    ("meta_offset", "<u8"),
+    ("meta_length", "<u4"),
+    ("text_offset", "<u8"),
+    ("text_length", "<u4"),
+])
+
+class ChunkStoreWriter:
+    def __init__(self, path: str):
+        """
+        Stream chunks into a chunk store without holding them in memory
+
+        Chunk metadata and text go straight to the blob; only the fixed-width
+        offsets are kept until close(), which appends the ID and offset tables
+        and renames the file into place. Chunks must be added in ID order.
+        """
+        self.path = path
+        self._tmp_path = f"{path}.tmp"
+        self._f = open(self._tmp_path, "wb")
+        self._f.write(b"\0" * HEADER.size)
+        self._position = HEADER.size
+        self._ids = array("q")
+        self._offsets = array("Q")
+        self._lengths = array("Q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, chunk: Dict, chunk_id: int = None):
+        if chunk_id is None:
+            chunk_id = len(self._ids)
+        if self._ids and chunk_id <= self._ids[-1]:
+            raise ValueError("Chunks must be added in increasing id order")
+
+        meta = json.dumps(
+            {key: value for key, value in chunk.items() if key != "text"},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
+        text = chunk.get("text", "").encode("utf-8")
+
+        self._ids.append(chunk_id)
+        self._offsets.extend((self._position, self._position + len(meta)))
+        self._lengths.extend((len(meta), len(text)))
+        self._f.write(meta)
+        self._f.write(text)
+        self._position += len(meta) + len(text)
+
+    def close(self) -> int:
+        count = len(self._ids)
+        records = np.zeros(count, dtype=RECORD_DTYPE)
+        offsets = np.frombuffer(self._offsets, dtype='uint64').reshape(count, 2)
+        lengths = np.frombuffer(self._lengths, dtype='uint64').reshape(count, 2)
+        records["meta_offset"], records["text_offset"] = offsets[:, 0], offsets[:, 1]
+        records["meta_length"], records["text_length"] = lengths[:, 0], lengths[:, 1]
+
+        # Keep the tables 8-byte aligned after the variable-length blob
+        padding = -self._position % 8
+        self._f.write(b"\0" * padding)
+        ids_offset = self._position + padding
+        table_offset = ids_offset + count * 8
+
+        self._f.write(np.frombuffer(self._ids, dtype='int64').tobytes())
+        self._f.write(records.tobytes())
+        self._f.seek(0)
+        self._f.write(HEADER.pack(MAGIC, count, ids_offset, table_offset, HEADER.size))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+        os.replace(self._tmp_path, self.path)
+        return count
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+def write_chunk_store(path: str, chunks: Iterable[Dict], ids: Iterable[int] = None) -> int:
+    """
+    Write chunks to a memory-mappable chunk store
+
+    The file is written to a temporary path and renamed into place, so
+    readers never see a partially written store.
+
+    Args:
+        path: Destination file
+        chunks: Chunk dictionaries
+        ids: Vector ID of each chunk in the FAISS index; defaults to the
+            chunk's position, which matches an index built without IDs
+
+    Returns:
+        Number of chunks written
+    """
+    if ids is not None:
+        chunks = list(chunks)
+        ids = [int(chunk_id) for chunk_id in ids]
+        if len(ids) != len(chunks):
+            raise ValueError(f"Got {len(ids)} ids for {len(chunks)} chunks")
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        chunks = [chunks[i] for i in order]
+        ids = [ids[i] for i in order]
+
+    with ChunkStoreWriter(path) as writer:
+        for i, chunk in enumerate(chunks):
+            writer.add(chunk, ids[i] if ids is not None else None)
+    return len(writer)
+
+class ChunkStore:
+    def __init__(self, path: str):
+        """
+        Read-only, memory-mapped chunk store
+
+        Opening the store only maps the file and views the offset table;
+        chunk metadata and text are decoded on access, one chunk at a time.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, ids_offset, table_offset, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a chunk store in the current format; rebuild it")
+
+        self.ids = np.frombuffer(self._mmap, dtype='int64', count=count, offset=ids_offset)
+        self._records = np.frombuffer(self._mmap, dtype=RECORD_DTYPE, count=count, offset=table_offset)
+        # IDs 0..n-1 are plain positions, which needs no search
+        self._positional = count == 0 or (self.ids[0] == 0 and self.ids[-1] == count - 1)
+        logger.info(f"Opened chunk store {path} with {count} chunks")
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, i: int) -> Dict:
+        """Decode one chunk into a new dict"""
+        if i < 0 or i >= len(self._records):
+            raise IndexError(f"Chunk {i} out of range")
+        meta_offset, meta_length, text_offset, text_length = self._records[i].tolist()
+        chunk = json.loads(self._mmap[meta_offset:meta_offset + meta_length])
+        chunk["text"] = self._mmap[text_offset:text_offset + text_length].decode("utf-8")
+        return chunk
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def metadata(self, i: int) -> Dict:
+        """Decode one chunk's metadata without its text"""
+        meta_offset, meta_length, _, _ = self._records[i].tolist()
+        return json.loads(self._mmap[meta_offset:meta_offset + meta_length])
+
+    def text(self, i: int) -> str:
+        """Decode one chunk's text without its metadata"""
+        _, _, text_offset, text_length = self._records[i].tolist()
+        return self._mmap[text_offset:text_offset + text_length].decode("utf-8")
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """Map FAISS labels to chunk positions; unknown labels (and -1 padding) map to -1"""
+        ids = np.asarray(ids, dtype='int64')
+        if self._positional:
+            return np.where((ids >= 0) & (ids < len(self)), ids, -1)
+        positions = np.searchsorted(self.ids, ids)
+        clipped = np.minimum(positions, len(self) - 1)
+        return np.where((positions < len(self)) & (self.ids[clipped] == ids), clipped, -1)
+
+    def get(self, i: int, **fields) -> Mapping:
+        """Decode one chunk, add extra fields and return it as an immutable mapping"""
+        chunk = self[i]
+        chunk.update(fields)
+        return MappingProxyType(chunk)
+
+class JsonChunkStore:
+    def __init__(self, path: str):
+        """In-memory chunk store over a chunks_metadata.json file, with the ChunkStore interface"""
+        self.path = path
+        with open(path, "r") as f:
+            self._chunks = json.load(f)
+        self.ids = np.arange(len(self._chunks), dtype='int64')
+        logger.info(f"Loaded {len(self._chunks)} chunks from {path}")
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def __getitem__(self, i: int) -> Dict:
+        return dict(self._chunks[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def metadata(self, i: int) -> Dict:
+        return {key: value for key, value in self._chunks[i].items() if key != "text"}
+
+    def text(self, i: int) -> str:
+        return self._chunks[i]["text"]
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        ids = np.asarray(ids, dtype='int64')
+        return np.where((ids >= 0) & (ids < len(self)), ids, -1)
+
+    def get(self, i: int, **fields) -> Mapping:
+        return MappingProxyType({**self._chunks[i], **fields})
+
+def open_chunk_store(store_path: str, metadata_path: str = None):
+    """Open the memory-mapped store if it exists, otherwise fall back to the JSON metadata"""
+    if store_path and os.path.exists(store_path):
+        return ChunkStore(store_path)
+    if metadata_path and os.path.exists(metadata_path):
+        return JsonChunkStore(metadata_path)
+    raise FileNotFoundError(f"Neither {store_path} nor {metadata_path} exists")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert chunks_metadata.json into a memory-mapped chunk store")
+    parser.add_argument("metadata_path", nargs="?", default="data/embeddings/chunks_metadata.json")
+    parser.add_argument("store_path", nargs="?", default="data/embeddings/chunks.store")
+    args = parser.parse_args()
+
+    with open(args.metadata_path, "r") as f:
+        count = write_chunk_store(args.store_path, json.load(f))
+    print(f"✅ Wrote {count} chunks to {args.store_path}")
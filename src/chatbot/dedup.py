@@ -0,0 +1,155 @@
+import re
+import zlib
+import logging
+import numpy as np
+from typing import Dict, Iterable, Iterator, List
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity of word shingles above which two chunks are one passage
+DEFAULT_THRESHOLD = 0.9
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def chunk_sources(chunk: Dict) -> List[str]:
+    """Every source a chunk's passage appears in; only deduplicated chunks have more than one"""
+    return chunk.get("sources") or [chunk["source"]]
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """32-bit hashes of the distinct word `size`-grams of a text, ignoring case and punctuation"""
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) <= size:
+        shingles = [" ".join(tokens)] if tokens else []
+    else:
+        shingles = [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype='uint64',
+                                 count=len(shingles)))
+
+def lsh_bands(threshold: float, num_perm: int, recall: float = 0.95):
+    """
+    Split a signature into (bands, rows) for LSH
+
+    Two chunks become candidates when all rows of at least one band match,
+    which happens with probability 1 - (1 - s^rows)^bands at similarity s.
+    Picks the most rows per band (fewest false candidates) that still catch
+    a pair at the threshold with probability `recall`.
+    """
+    for rows in range(num_perm, 0, -1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            return bands, rows
+    return num_perm, 1
+
+class NearDuplicateFilter:
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM,
+                 shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        """
+        Streaming near-duplicate detection with MinHash and LSH banding
+
+        Chunks are added one at a time. The first chunk of a passage becomes
+        its representative; later chunks whose estimated Jaccard similarity
+        to a representative reaches `threshold` are dropped and their sources
+        are recorded on it. A chunk that already lists "sources", e.g. one
+        read back from an index, brings all of them along. Only
+        representatives go into the LSH buckets, so each chunk is compared
+        with the few representatives it shares a band with rather than with
+        every chunk so far.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Universal hashing (a * x + b) mod p; a, x < 2^32 so products fit in uint64
+        self._a = rng.integers(1, int(_MAX_HASH), num_perm, dtype='uint64')
+        self._b = rng.integers(0, int(_MAX_HASH), num_perm, dtype='uint64')
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        # Distinct sources per representative, in the order they were seen
+        self.sources: List[List[str]] = []
+        self.seen = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _MAX_HASH, dtype='uint64')
+        values = (np.outer(hashes, self._a) + self._b) % _PRIME & _MAX_HASH
+        return values.min(axis=0)
+
+    def add(self, chunk: Dict) -> bool:
+        """Register a chunk; True if it is a new representative, False if it duplicates one"""
+        self.seen += 1
+        signature = self.signature(chunk["text"])
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            # The fraction of equal MinHash values estimates the Jaccard similarity
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+
+        sources = chunk_sources(chunk)
+        if best is not None:
+            for source in sources:
+                if source not in self.sources[best]:
+                    self.sources[best].append(source)
+            return False
+
+        representative = len(self._signatures)
+        self._signatures.append(signature)
+        self.sources.append(list(sources))
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(representative)
+        return True
+
+    def annotate(self, representatives: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Add the "sources" of every passage found in several documents
+
+        Args:
+            representatives: The chunks add() kept, in the order they were added
+        """
+        for chunk, sources in zip(representatives, self.sources):
+            yield {**chunk, "sources": sources} if len(sources) > 1 else chunk
+
+    @property
+    def merged(self) -> int:
+        """Representatives standing in for chunks from more than one source"""
+        return sum(1 for sources in self.sources if len(sources) > 1)
+
+    def stats(self) -> Dict:
+        unique = len(self._signatures)
+        return {
+            "chunks": self.seen,
+            "unique": unique,
+            "duplicates": self.seen - unique,
+            "multi_source": self.merged,
+            "reduction": round((self.seen - unique) / self.seen, 4) if self.seen else 0.0,
+        }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (f"Deduplication removed {stats['duplicates']} of {stats['chunks']} chunks "
+                f"({stats['reduction']:.1%}); the index holds {stats['unique']} vectors, "
+                f"{stats['multi_source']} of them shared by several documents")
+
+def deduplicate(chunks: List[Dict], threshold: float = DEFAULT_THRESHOLD, **options):
+    """
+    Keep one chunk per near-duplicate passage
+
+    Returns:
+        (representative chunks with their "sources", NearDuplicateFilter holding the statistics)
+    """
+    dedup = NearDuplicateFilter(threshold, **options)
+    kept = [chunk for chunk in chunks if dedup.add(chunk)]
+    return list(dedup.annotate(kept)), dedup
@@ -0,0 +1,196 @@
+import functools
+import hashlib
+import json
+import os
+import re
+import weakref
+import logging
+import numpy as np
+from typing import List, Union
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Written by scripts/export_encoder.py
+MODEL_DIR = "models/all-MiniLM-L6-v2"
+CONFIG_FILE = "encoder_config.json"
+
+# "hash" is a deterministic stand-in for offline benchmarks and CI; its embeddings carry no meaning
+ENCODER_BACKENDS = ["torch", "onnx", "onnx_int8", "hash"]
+ONNX_FILES = {"onnx": "model.onnx", "onnx_int8": "model_int8.onnx"}
+
+class HashEncoder:
+    def __init__(self, dimension: int = 384):
+        """
+        Model-free sentence encoder for load tests and CI
+
+        Each token maps to a fixed pseudo-random vector seeded by its hash, and
+        a sentence is the normalized sum of its token vectors. Texts sharing
+        words land close together, which is enough to exercise the index and
+        caches end to end without downloading a model.
+        """
+        self.dimension = dimension
+        self._token_vectors = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype('float32')
+            self._token_vectors[token] = vector
+        return vector
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        """Encode sentences into a (n, d) float32 matrix; a single string gives a (d,) vector"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = np.zeros((len(sentences), self.dimension), dtype='float32')
+        for i, sentence in enumerate(sentences):
+            for token in re.findall(r"\w+", sentence.lower()):
+                embeddings[i] += self._token_vector(token)
+        embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+
+        return embeddings[0] if single else embeddings
+
+def _recreate_session(encoder_ref):
+    encoder = encoder_ref()
+    if encoder is not None:
+        encoder._create_session()
+
+class OnnxEncoder:
+    def __init__(self, model_dir: str = MODEL_DIR, model_file: str = "model.onnx", threads: int = None):
+        """
+        Sentence encoder running an exported transformer graph on ONNX Runtime
+
+        Produces the same embeddings as the SentenceTransformer it was exported
+        from: token embeddings are pooled and optionally normalized exactly as
+        described in the encoder config written by export_encoder.py.
+
+        Args:
+            model_dir: Directory with the ONNX graph, tokenizer.json and encoder config
+            model_file: ONNX graph to load, e.g. the int8-quantized one
+            threads: Intra-op threads used by ONNX Runtime (default: runtime's choice)
+        """
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r") as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_id"], pad_token=self.config["pad_token"])
+
+        self.model_path = os.path.join(model_dir, model_file)
+        self.threads = threads
+        self._create_session()
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        # The runtime's thread pool does not survive fork(); workers forked from
+        # a preloading parent get a fresh session
+        os.register_at_fork(after_in_child=functools.partial(_recreate_session, weakref.ref(self)))
+
+    def _create_session(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype('float32')
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        """Encode sentences into a (n, d) float32 matrix; a single string gives a (d,) vector"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        embeddings = np.empty((len(sentences), self.get_sentence_embedding_dimension()), dtype='float32')
+        # Batches of similar length need little padding
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        for start in range(0, len(sentences), batch_size):
+            positions = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([sentences[i] for i in positions])
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype='int64')
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype='int64'),
+                "attention_mask": attention_mask,
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype='int64')
+            hidden = self.session.run(None, feeds)[0]
+            embeddings[positions] = self._pool(hidden, attention_mask)
+
+        return embeddings[0] if single else embeddings
+
+def load_encoder(backend: str = "torch", model_dir: str = MODEL_DIR, threads: int = None,
+                 allow_download: bool = None):
+    """
+    Load the sentence encoder for a backend
+
+    All backends expose the SentenceTransformer encode() interface.
+
+    Args:
+        backend: "torch" (SentenceTransformer), "onnx", "onnx_int8" or "hash" (no model)
+        model_dir: Local model files written by scripts/export_encoder.py
+        threads: CPU threads used for inference (default: the runtime's choice)
+        allow_download: Let the torch backend fetch the model from the Hugging Face
+            hub when model_dir is missing (default: $ENCODER_ALLOW_DOWNLOAD)
+
+    Raises:
+        FileNotFoundError: The backend's model files are not in model_dir
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}; choose from {', '.join(ENCODER_BACKENDS)}")
+
+    if backend == "hash":
+        logger.info("Using the hash encoder; embeddings are not semantic")
+        return HashEncoder()
+
+    if backend == "torch":
+        local = os.path.exists(os.path.join(model_dir, "modules.json"))
+        if allow_download is None:
+            allow_download = os.environ.get("ENCODER_ALLOW_DOWNLOAD", "0") not in ("", "0", "false")
+        if not local and not allow_download:
+            raise FileNotFoundError(
+                f"No local model in {model_dir}. Run scripts/export_encoder.py first, "
+                f"or set ENCODER_ALLOW_DOWNLOAD=1 to download {MODEL_NAME} from the Hugging Face hub."
+            )
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        if not local:
+            logger.warning(f"No local model in {model_dir}; downloading {MODEL_NAME} from the Hugging Face hub")
+            return SentenceTransformer(MODEL_NAME, device="cpu")
+        logger.info(f"Loading torch encoder from {model_dir}")
+        return SentenceTransformer(model_dir, device="cpu")
+
+    model_file = ONNX_FILES[backend]
+    if not os.path.exists(os.path.join(model_dir, model_file)):
+        raise FileNotFoundError(
+            f"{os.path.join(model_dir, model_file)} not found. Run scripts/export_encoder.py first."
+        )
+    logger.info(f"Loading {backend} encoder from {os.path.join(model_dir, model_file)}")
+    return OnnxEncoder(model_dir, model_file=model_file, threads=threads)
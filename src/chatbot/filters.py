@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import threading
+import logging
+import numpy as np
+import faiss
+from typing import Any, Dict, List, Optional, Tuple
+from .cache import LRUCache
+from .dedup import chunk_sources
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PARTITIONS_FILE = "partitions.json"
+PARTITIONS_DIR = "partitions"
+# Metadata fields create_embeddings.py builds per-value sub-indexes for by default; partitioning is opt-in
+DEFAULT_PARTITION_FIELDS = []
+# Fields with more distinct values get no sub-indexes: one file per crawled URL costs more than it saves
+MAX_PARTITION_VALUES = 256
+# Filters matching at most this many vectors are searched exactly over the reconstructed vectors
+EXACT_SEARCH_MAX_IDS = 4096
+
+# ((field, (value, ...)), ...): a chunk matches if, for every field, it has one of the values
+FilterKey = Tuple[Tuple[str, Tuple], ...]
+
+def normalize_filters(filters) -> Optional[FilterKey]:
+    """
+    Canonical, hashable form of metadata filters
+
+    Args:
+        filters: {field: value or list of values}, or an already normalized key
+
+    Returns:
+        Fields and their values in sorted order; None when nothing is filtered
+    """
+    if not filters:
+        return None
+    if isinstance(filters, tuple):
+        return filters
+    normalized = []
+    for field, values in filters.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        normalized.append((field, tuple(sorted(set(values), key=repr))))
+    return tuple(sorted(normalized))
+
+def field_values(chunk: Dict, field: str) -> List:
+    """The values of a chunk that a filter on `field` can match"""
+    # A deduplicated chunk belongs to every document it appears in
+    if field == "source":
+        return chunk_sources(chunk)
+    value = chunk.get(field)
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values if isinstance(v, (str, int, float, bool))]
+
+def search_parameters(index, selector) -> faiss.SearchParameters:
+    """
+    FAISS search parameters that restrict a search to a selector's IDs
+
+    Index types read their own knobs from their parameter class, so the
+    index's current nprobe or efSearch is carried over. The selector must
+    stay referenced until the search returns.
+    """
+    # An ID map translates the selector to positions and passes the parameters on
+    inner = faiss.downcast_index(index.index) if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)) else index
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if isinstance(inner, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def enable_reconstruct(index):
+    """
+    Let an IVF index look its vectors up by ID, for exact_search
+
+    IVF lists are stored by centroid; the direct map records where each
+    vector is, at 8 bytes per vector. Other index types need nothing.
+    """
+    if isinstance(index, faiss.Index):
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None and ivf.direct_map.no():
+            ivf.make_direct_map()
+    return index
+
+def exact_search(index, query_vectors: np.ndarray, k: int, ids: np.ndarray):
+    """
+    Brute-force k-NN over the stored vectors of a few IDs
+
+    A graph index walking towards the query rarely reaches a handful of
+    allowed nodes, so a selective selector costs HNSW most of its recall;
+    scoring the allowed vectors directly is both exact and cheaper.
+
+    Returns:
+        (distances, labels) like Index.search, or None when the index cannot
+        reconstruct its vectors (an IVF index without enable_reconstruct)
+    """
+    try:
+        vectors = index.reconstruct_batch(np.ascontiguousarray(ids, dtype='int64'))
+    except RuntimeError:
+        return None
+    flat = faiss.IndexFlat(index.d, index.metric_type)
+    flat.add(vectors)
+    distances, positions = flat.search(query_vectors, min(k, len(ids)))
+    labels = np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+    if positions.shape[1] < k:
+        missing = k - positions.shape[1]
+        distances = np.hstack([distances, np.full((len(distances), missing), np.inf, dtype='float32')])
+        labels = np.hstack([labels, np.full((len(labels), missing), -1, dtype='int64')])
+    return distances, labels
+
+def search_ids(index, query_vectors: np.ndarray, k: int, ids: np.ndarray, selector=None):
+    """
+    k-NN search of an index restricted to sorted vector IDs it holds
+
+    Args:
+        selector: A cached IDSelector over `ids`, if the caller has one
+
+    Returns:
+        (distances, labels) like Index.search
+    """
+    if len(ids) == 0:
+        return (np.full((len(query_vectors), k), np.inf, dtype='float32'),
+                np.full((len(query_vectors), k), -1, dtype='int64'))
+    if len(ids) <= EXACT_SEARCH_MAX_IDS:
+        result = exact_search(index, query_vectors, k, ids)
+        if result is not None:
+            return result
+    if selector is None:
+        selector = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype='int64'))
+    return index.search(query_vectors, k, params=search_parameters(index, selector))
+
+class MetadataFilter:
+    def __init__(self, chunks, cache_size: int = 256):
+        """
+        Resolve metadata filters to the vector IDs of the matching chunks
+
+        The IDs of every value of a field are collected in one pass over the
+        chunk metadata the first time the field is filtered on. Resolved
+        filters and their FAISS selectors are cached, so repeated filters
+        cost a dictionary lookup.
+        """
+        self.chunks = chunks
+        self._postings = {}
+        self._lock = threading.Lock()
+        self._cache = LRUCache(max_size=cache_size, ttl=0)
+
+    def postings(self, field: str) -> Dict[Any, np.ndarray]:
+        """Sorted vector IDs of the chunks having each value of a field"""
+        with self._lock:
+            if field not in self._postings:
+                positions = {}
+                for position in range(len(self.chunks)):
+                    for value in field_values(self.chunks.metadata(position), field):
+                        positions.setdefault(value, []).append(position)
+                self._postings[field] = {
+                    value: np.sort(self.chunks.ids[np.array(p, dtype='int64')]) for value, p in positions.items()
+                }
+                logger.info(f"Indexed {len(positions)} values of chunk field {field!r} for filtering")
+            return self._postings[field]
+
+    def values(self, field: str) -> Dict[Any, int]:
+        """Number of chunks per value of a field"""
+        return {value: len(ids) for value, ids in self.postings(field).items()}
+
+    def resolve(self, filters) -> Tuple[np.ndarray, faiss.IDSelector]:
+        """Sorted IDs of the chunks matching the filters, and a FAISS selector over them"""
+        key = normalize_filters(filters)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        allowed = None
+        for field, values in key:
+            postings = self.postings(field)
+            matches = [postings[value] for value in values if value in postings]
+            ids = np.unique(np.concatenate(matches)) if matches else np.empty(0, dtype='int64')
+            allowed = ids if allowed is None else np.intersect1d(allowed, ids, assume_unique=True)
+        allowed.setflags(write=False)
+        resolved = (allowed, faiss.IDSelectorBatch(allowed))
+        self._cache.put(key, resolved)
+        return resolved
+
+    def ids(self, filters) -> np.ndarray:
+        return self.resolve(filters)[0]
+
+def write_partition_manifest(embeddings_dir: str, fields: Dict[str, List[Dict]], **info) -> str:
+    """
+    Record the per-value sub-indexes of each partitioned field
+
+    Args:
+        fields: {field: [{"value", "file" (relative to embeddings_dir), "num_vectors"}, ...]}
+    """
+    path = os.path.join(embeddings_dir, PARTITIONS_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"fields": fields, **info}, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def read_partition_manifest(path: str) -> Dict:
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for partitions in manifest["fields"].values():
+        for partition in partitions:
+            partition["path"] = os.path.join(base, partition["file"])
+    return manifest
+
+def remove_partitions(embeddings_dir: str = "data/embeddings"):
+    """Drop the sub-indexes of an older build, for builders that write the index without them"""
+    path = os.path.join(embeddings_dir, PARTITIONS_FILE)
+    directory = os.path.join(embeddings_dir, PARTITIONS_DIR)
+    # Manifest first, so a reader never finds it listing files that are gone
+    if os.path.exists(path):
+        os.remove(path)
+    # Also sub-index files left without a manifest by an interrupted build
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        logger.info(f"Removed stale partition sub-indexes from {embeddings_dir}")
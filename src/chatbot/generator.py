@@ -1,10 +1,15 @@
-from typing import List, Dict
+from typing import Iterator, List, Dict
 import logging
+import re
+from .dedup import chunk_sources
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# A sentence or line, with the whitespace that follows it
+PIECE_PATTERN = re.compile(r"[^\n.!?]*(?:[.!?]+|\n|$)\s*")
+
 class Generator:
     def __init__(self):
         """Initialize a simple generator that doesn't rely on external APIs"""
@@ -24,36 +29,52 @@ class Generator:
         Returns:
             A response based on the retrieved chunks
         """
+        return "".join(self.generate_response_stream(query, context_chunks))
+
+    def generate_response_stream(self, query: str, context_chunks: List[Dict]) -> Iterator[str]:
+        """
+        Generate the same response as generate_response, piece by piece
+
+        Pieces are yielded as soon as they are produced, so callers can
+        start sending the answer before it is complete. Joined, they give
+        exactly the text generate_response returns.
+
+        Args:
+            query: The user's question
+            context_chunks: List of relevant text chunks with metadata
+
+        Yields:
+            Consecutive pieces of the response text
+        """
         if not context_chunks:
             logger.warning(f"No relevant chunks found for query: '{query}'")
-            return "I don't know the answer to that question based on my available information. Please check that your PDFs were properly loaded and processed."
+            yield "I don't know the answer to that question based on my available information. Please check that your PDFs were properly loaded and processed."
+            return
         
-        logger.info(f"Generating response for query: '{query}' with {len(context_chunks)} chunks")
+        logger.debug(f"Generating response for query: '{query}' with {len(context_chunks)} chunks")
         
         # Sort chunks by similarity score (if available)
         if "similarity" in context_chunks[0]:
             context_chunks = sorted(context_chunks, key=lambda x: x.get("similarity", 0), reverse=True)
-            logger.info(f"Top chunk similarity: {context_chunks[0].get('similarity', 0)}")
+            logger.debug(f"Top chunk similarity: {context_chunks[0].get('similarity', 0)}")
         
         # Format the response
-        response = "Based on the available information:\n\n"
+        yield "Based on the available information:\n\n"
         
-        # Add the most relevant chunk content
+        # Add the most relevant chunk content, a sentence or line at a time
         most_relevant = context_chunks[0]
-        response += most_relevant["text"].strip()
+        yield from filter(None, PIECE_PATTERN.findall(most_relevant["text"].strip()))
         
         # Add sources
         sources = []
         for chunk in context_chunks:
-            source = chunk["source"]
-            if source not in sources:
-                sources.append(source)
+            for source in chunk_sources(chunk):
+                if source not in sources:
+                    sources.append(source)
         
         if sources:
-            response += "\n\nSources:\n"
+            yield "\n\nSources:\n"
             for source in sources:
-                response += f"- {source}\n"
+                yield f"- {source}\n"
         
-        logger.info(f"Generated response with {len(sources)} sources")
-                
-        return response
\ No newline at end of file
+        logger.debug(f"Generated response with {len(sources)} sources")
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from typing import Callable, Dict, Optional
+from .shards import ShardedIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VERSION_FILE = "version.json"
+
+def write_index_version(embeddings_dir: str = "data/embeddings", **info) -> str:
+    """
+    Record that a new index build is complete
+
+    Builders call this after the index and chunk store are in place; the
+    API treats a changed version file as a new index to load.
+
+    Returns:
+        The new version string
+    """
+    version = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    data = {"version": version, "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), **info}
+    path = os.path.join(embeddings_dir, VERSION_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+    return version
+
+def read_index_version(embeddings_dir: str = "data/embeddings", index_file: str = "docs.index") -> Optional[str]:
+    """
+    Return the version of the index currently on disk
+
+    Falls back to the index file's mtime and size for indexes built before
+    version files existed; None if there is no index at all.
+    """
+    try:
+        with open(os.path.join(embeddings_dir, VERSION_FILE), "r") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        stat = os.stat(os.path.join(embeddings_dir, index_file))
+    except OSError:
+        return None
+    return f"legacy-{stat.st_mtime_ns}-{stat.st_size}"
+
+class IndexManager:
+    def __init__(self, retriever_factory: Callable, embeddings_dir: str = "data/embeddings",
+                 on_swap: Callable = None):
+        """
+        Own the active retriever and swap in new index versions without downtime
+
+        A new version is loaded in a worker thread while the current retriever
+        keeps serving. Once it is ready the reference is swapped atomically;
+        requests that already hold the old retriever finish against it.
+
+        Args:
+            retriever_factory: Called as factory(previous_retriever) to build a
+                retriever for the index on disk; may reuse the previous model
+            embeddings_dir: Directory holding the index and its version file
+            on_swap: Called with the new retriever after every swap
+        """
+        self.retriever_factory = retriever_factory
+        self.embeddings_dir = embeddings_dir
+        self.on_swap = on_swap
+        self.retriever = None
+        self.version = None
+        self.loaded_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._reloading = False
+
+    def load(self) -> bool:
+        """Load the index version on disk if it differs from the active one; blocking"""
+        with self._lock:
+            version = read_index_version(self.embeddings_dir)
+            if version is None:
+                self.last_error = "No index found. Please run the embedding creation step first."
+                return False
+            if version == self.version:
+                return False
+
+            self._reloading = True
+            try:
+                logger.info(f"Loading index version {version}")
+                start_time = time.time()
+                retriever = self.retriever_factory(self.retriever)
+
+                # A build that finished while we were loading gets picked up next time
+                if read_index_version(self.embeddings_dir) != version:
+                    logger.warning(f"Index changed while loading version {version}; will retry")
+                    return False
+
+                retriever.version = version
+                self.retriever = retriever
+                self.version = version
+                self.loaded_at = time.time()
+                self.last_error = None
+                logger.info(f"Index version {version} is active (loaded in {time.time() - start_time:.1f}s)")
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error loading index version {version}: {e}", exc_info=True)
+                return False
+            finally:
+                self._reloading = False
+
+        if self.on_swap:
+            self.on_swap(retriever)
+        return True
+
+    async def reload(self) -> bool:
+        """Load a new index version in a worker thread without blocking the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, self.load)
+
+    async def watch(self, interval: float):
+        """Poll for new index versions every `interval` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            if read_index_version(self.embeddings_dir) != self.version and not self._reloading:
+                await self.reload()
+
+    def status(self) -> Dict:
+        status = {
+            "index_version": self.version,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)) if self.loaded_at else None,
+            "num_chunks": len(self.retriever.chunks) if self.retriever else 0,
+            "num_vectors": self.retriever.index.ntotal if self.retriever else 0,
+            "on_disk_version": read_index_version(self.embeddings_dir),
+            "reloading": self._reloading,
+            "last_error": self.last_error,
+        }
+        if self.retriever and isinstance(self.retriever.index, ShardedIndex):
+            status["shards"] = self.retriever.index.status()
+        return status
@@ -0,0 +1,244 @@
+import math
+import mmap
+import os
+import re
+import struct
+import logging
+import numpy as np
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# File layout, every section 8-byte aligned:
+#   header          MAGIC, doc/term/posting counts, average document length, k1 and b
+#   doc_ids         int64 chunk ID (FAISS label) of each document
+#   term_offsets    int64 start of each term's postings, plus the end of the last
+#   term_max        float32 highest posting weight of each term
+#   posting_docs    int32 document number of each posting, ascending within a term
+#   posting_weights float32 BM25 weight of each posting, idf included
+#   vocab_offsets   int64 start of each term in the vocabulary blob, plus the end
+#   vocab           sorted UTF-8 terms, concatenated
+MAGIC = b"RAGBM001"
+HEADER = struct.Struct("<8sQQQddd")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it my of on or the this to what when "
+    "where which who will with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric terms without stopwords; keeps numbers and codes like 7350 or 99213"""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def write_lexical_index(path: str, chunks: Iterable[Dict], ids: Iterable[int] = None,
+                        k1: float = 1.2, b: float = 0.75) -> int:
+    """
+    Build a BM25 inverted index over chunk texts and write it to `path`
+
+    Postings are stored as flat arrays sorted by term, with the full BM25
+    weight of every posting precomputed, so a query only sums weights.
+
+    Args:
+        path: Destination file
+        chunks: Chunk dictionaries
+        ids: Vector ID of each chunk; defaults to the chunk's position, like write_chunk_store
+        k1: BM25 term frequency saturation
+        b: BM25 document length normalization
+
+    Returns:
+        Number of documents indexed
+    """
+    vocabulary = {}
+    posting_terms = array("i")
+    posting_docs = array("i")
+    posting_tfs = array("i")
+    doc_lengths = array("i")
+    doc_ids = array("q")
+
+    ids = iter(ids) if ids is not None else None
+    for doc, chunk in enumerate(chunks):
+        doc_ids.append(int(next(ids)) if ids is not None else doc)
+        terms = tokenize(chunk.get("text", ""))
+        doc_lengths.append(len(terms))
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, tf in counts.items():
+            posting_terms.append(vocabulary.setdefault(term, len(vocabulary)))
+            posting_docs.append(doc)
+            posting_tfs.append(tf)
+
+    num_docs = len(doc_ids)
+    lengths = np.frombuffer(doc_lengths, dtype='int32').astype('float32')
+    avgdl = float(lengths.mean()) if num_docs and lengths.sum() else 1.0
+
+    # Renumber terms in sorted order so the vocabulary can be stored sorted
+    terms_sorted = sorted(vocabulary)
+    renumber = np.empty(len(vocabulary), dtype='int64')
+    for new_id, term in enumerate(terms_sorted):
+        renumber[vocabulary[term]] = new_id
+    term_ids = renumber[np.frombuffer(posting_terms, dtype='int32')]
+    docs = np.frombuffer(posting_docs, dtype='int32')
+    tfs = np.frombuffer(posting_tfs, dtype='int32').astype('float32')
+
+    order = np.lexsort((docs, term_ids))
+    term_ids, docs, tfs = term_ids[order], docs[order], tfs[order]
+
+    df = np.bincount(term_ids, minlength=len(terms_sorted))
+    term_offsets = np.zeros(len(terms_sorted) + 1, dtype='int64')
+    term_offsets[1:] = np.cumsum(df)
+
+    idf = np.log(1.0 + (num_docs - df + 0.5) / (df + 0.5)).astype('float32')
+    norm = k1 * (1.0 - b + b * lengths[docs] / avgdl)
+    weights = (idf[term_ids] * tfs * (k1 + 1.0) / (tfs + norm)).astype('float32')
+
+    term_max = np.zeros(len(terms_sorted), dtype='float32')
+    nonempty = df > 0
+    if weights.size:
+        term_max[nonempty] = np.maximum.reduceat(weights, term_offsets[:-1][nonempty])
+
+    encoded = [term.encode("utf-8") for term in terms_sorted]
+    vocab_offsets = np.zeros(len(encoded) + 1, dtype='int64')
+    vocab_offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+    sections = [
+        np.asarray(doc_ids, dtype='int64'),
+        term_offsets,
+        term_max,
+        docs.astype('int32'),
+        weights,
+        vocab_offsets,
+        np.frombuffer(b"".join(encoded), dtype='uint8'),
+    ]
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, num_docs, len(terms_sorted), len(docs), avgdl, k1, b))
+        position = HEADER.size
+        for section in sections:
+            padding = _aligned(position) - position
+            f.write(b"\0" * padding)
+            f.write(section.tobytes())
+            position += padding + section.nbytes
+    os.replace(tmp_path, path)
+    return num_docs
+
+class LexicalIndex:
+    def __init__(self, path: str):
+        """
+        Read-only, memory-mapped BM25 index
+
+        Opening the index maps the file and views its arrays in place; only
+        the term -> term number dictionary is built in memory.
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, num_docs, num_terms, num_postings, self.avgdl, self.k1, self.b = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a lexical index in the current format; rebuild it")
+
+        position = HEADER.size
+        arrays = []
+        for dtype, count in (('int64', num_docs), ('int64', num_terms + 1), ('float32', num_terms),
+                             ('int32', num_postings), ('float32', num_postings), ('int64', num_terms + 1)):
+            position = _aligned(position)
+            arrays.append(np.frombuffer(self._mmap, dtype=dtype, count=count, offset=position))
+            position += arrays[-1].nbytes
+        self.doc_ids, self.term_offsets, self.term_max, self.posting_docs, self.posting_weights, vocab_offsets = arrays
+
+        blob = self._mmap[_aligned(position):_aligned(position) + int(vocab_offsets[-1])]
+        bounds = vocab_offsets.tolist()
+        self.vocabulary = {blob[bounds[i]:bounds[i + 1]].decode("utf-8"): i for i in range(num_terms)}
+        logger.info(f"Opened lexical index {path} with {num_docs} documents and {num_terms} terms")
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def idf(self, term_id: int) -> float:
+        df = self.term_offsets[term_id + 1] - self.term_offsets[term_id]
+        return math.log(1.0 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def _score(self, term_ids: List[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Documents matching any term, with their BM25 scores and number of matched terms"""
+        if not term_ids:
+            return np.empty(0, dtype='int32'), np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+        slices = [slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.posting_docs[s] for s in slices])
+        weights = np.concatenate([self.posting_weights[s] for s in slices])
+        matched_docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights).astype('float32')
+        matched = np.bincount(inverse)
+        return matched_docs, scores, matched
+
+    def search(self, query: str, k: int, ids: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the chunk IDs and scores of the top k documents for a query
+
+        Scores are BM25 scores divided by the best score any document could
+        reach for these terms, so they fall between 0 and 1. With `ids`,
+        only those chunks are ranked.
+        """
+        term_ids = sorted({self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary})
+        docs, scores, _ = self._score(term_ids)
+        if ids is not None and len(docs):
+            # Masked before the top-k, so k allowed chunks are returned whenever they exist
+            keep = np.isin(self.doc_ids[docs], ids, assume_unique=True)
+            docs, scores = docs[keep], scores[keep]
+        if not len(docs):
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        best_possible = float(self.term_max[term_ids].sum())
+        return self.doc_ids[docs[top]], scores[top] / best_possible
+
+    def is_confident(self, query: str, max_terms: int = 4, min_idf: float = 2.0) -> bool:
+        """
+        Whether a lexical match alone can answer the query
+
+        True for short, keyword-like queries whose terms are all known, at
+        least one of which is specific (contains a digit or is rare), and
+        whose best document contains every term: plan names, codes and
+        acronyms rather than questions in natural language.
+        """
+        # Questions in natural language are long even though most of their words are stopwords
+        if len(TOKEN_PATTERN.findall(query.lower())) > max_terms:
+            return False
+        terms = set(tokenize(query))
+        if not terms or any(t not in self.vocabulary for t in terms):
+            return False
+        term_ids = sorted(self.vocabulary[t] for t in terms)
+        if not any(any(c.isdigit() for c in t) for t in terms) and max(self.idf(t) for t in term_ids) < min_idf:
+            return False
+        _, scores, matched = self._score(term_ids)
+        return bool(len(scores)) and matched[np.argmax(scores)] == len(term_ids)
+
+def open_lexical_index(path: str):
+    """Open the lexical index if it exists; None otherwise"""
+    if path and os.path.exists(path):
+        return LexicalIndex(path)
+    return None
+
+if __name__ == "__main__":
+    import argparse
+    from .chunk_store import open_chunk_store
+
+    parser = argparse.ArgumentParser(description="Build the BM25 lexical index from the chunk store")
+    parser.add_argument("--store-path", default="data/embeddings/chunks.store")
+    parser.add_argument("--metadata-path", default="data/embeddings/chunks_metadata.json")
+    parser.add_argument("--output", default="data/embeddings/lexical.bm25")
+    args = parser.parse_args()
+
+    chunks = open_chunk_store(args.store_path, args.metadata_path)
+    count = write_lexical_index(args.output, chunks, ids=chunks.ids)
+    print(f"✅ Wrote lexical index over {count} chunks to {args.output}")
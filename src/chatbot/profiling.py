@@ -0,0 +1,321 @@
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Machine-readable report of the last ingestion run, next to the index it built
+REPORT_PATH = "data/embeddings/ingest_profile.json"
+
+def peak_rss_mb(children: bool = False) -> float:
+    """High-water mark of the resident set size of this process, or of its finished child processes"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+def file_size(*paths: str) -> int:
+    """Total size in bytes of the files that exist; a directory counts the files directly in it"""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += file_size(*(os.path.join(path, name) for name in os.listdir(path)
+                                 if os.path.isfile(os.path.join(path, name))))
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+def profile_call(profile_dir: Optional[str], func: Callable, *args):
+    """
+    Call func(*args), typically in a worker process, timing it and profiling it if profile_dir is set
+
+    Returns:
+        (result, seconds, path of the cProfile dump in profile_dir or None),
+        for the parent to pass to StageProfile.add_worker_task
+    """
+    profile = cProfile.Profile() if profile_dir else None
+    start = time.perf_counter()
+    if profile is not None:
+        profile.enable()
+    try:
+        result = func(*args)
+    finally:
+        if profile is not None:
+            profile.disable()
+    seconds = time.perf_counter() - start
+
+    path = None
+    if profile is not None:
+        fd, path = tempfile.mkstemp(prefix="worker-", suffix=".prof", dir=profile_dir)
+        os.close(fd)
+        profile.dump_stats(path)
+    return result, seconds, path
+
+class StageProfile:
+    def __init__(self, name: str, profile_dir: str = None):
+        """
+        Counters and timers of one ingestion stage
+
+        Stages of the concurrent pipeline run side by side in their own
+        threads, so besides the wall time from start to end, a stage
+        records the time it was busy: inside busy() blocks, excluding time
+        spent waiting for the stages next to it or for worker processes.
+        Work done in worker processes (see profile_call) is added as
+        worker_seconds. Time inside the embedding model is added as
+        model_seconds. For stages that call the model, any busy or worker
+        time outside the model is reported as overhead.
+
+        Args:
+            name: Stage name, e.g. "extract" or "encode"
+            profile_dir: Directory for cProfile dumps of the stage's busy blocks,
+                <name>.prof, and of its worker tasks, <name>.workers.prof
+        """
+        self.name = name
+        self.counts: Dict[str, int] = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall_seconds = 0.0
+        self.busy_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.worker_seconds = 0.0
+        self.model_seconds = 0.0
+        self.peak_rss_mb = None
+        self.children_peak_rss_mb = None
+        self.python_peak_mb = None
+        self.profile_dir = profile_dir
+        self.profile_path = os.path.join(profile_dir, f"{name}.prof") if profile_dir else None
+        self.worker_profile_path = os.path.join(profile_dir, f"{name}.workers.prof") if profile_dir else None
+        self._profile = cProfile.Profile() if profile_dir else None
+        self._worker_stats = None
+        self._lock = threading.Lock()
+        # Depth of busy() blocks per thread; only the outermost one is timed
+        self._local = threading.local()
+
+    def count(self, **counts: int):
+        """Add to item counters such as documents=1 or chunks=64"""
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] = self.counts.get(key, 0) + value
+
+    def add(self, bytes_read: int = 0, bytes_written: int = 0, worker_seconds: float = 0.0,
+            model_seconds: float = 0.0):
+        with self._lock:
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            self.worker_seconds += worker_seconds
+            self.model_seconds += model_seconds
+
+    @contextmanager
+    def busy(self):
+        """Time a block of this stage's own work; nested blocks count once"""
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield self
+            finally:
+                self._local.depth = depth
+            return
+
+        self._local.depth = 1
+        profiling = False
+        if self._profile is not None:
+            try:
+                self._profile.enable()
+                profiling = True
+            except ValueError as e:
+                # Python 3.12+ allows one active profiler per process
+                logger.warning(f"Not profiling stage {self.name}: {e}")
+                self._profile = None
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield self
+        finally:
+            elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+            self._local.depth = 0
+            if profiling:
+                self._profile.disable()
+            with self._lock:
+                self.busy_seconds += elapsed
+                self.cpu_seconds += cpu
+
+    @contextmanager
+    def model(self):
+        """Time a call into the embedding model made by this process"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(model_seconds=time.perf_counter() - start)
+
+    def add_worker_task(self, seconds: float, profile_path: str = None, model_seconds: float = 0.0):
+        """Credit a task finished by profile_call, merging and removing its cProfile dump"""
+        self.add(worker_seconds=seconds, model_seconds=model_seconds)
+        if profile_path is None:
+            return
+        with self._lock:
+            if self._worker_stats is None:
+                self._worker_stats = pstats.Stats(profile_path)
+            else:
+                self._worker_stats.add(profile_path)
+        os.remove(profile_path)
+
+    def dump_profiles(self):
+        """Write the cProfile dumps of the stage, if it was profiled"""
+        if self._profile is not None:
+            self._profile.dump_stats(self.profile_path)
+        if self._worker_stats is not None:
+            self._worker_stats.dump_stats(self.worker_profile_path)
+
+    def to_dict(self) -> dict:
+        wall = self.wall_seconds
+        report = {
+            "wall_seconds": round(wall, 4),
+            "busy_seconds": round(self.busy_seconds, 4),
+            "cpu_seconds": round(self.cpu_seconds, 4),
+            "worker_seconds": round(self.worker_seconds, 4),
+            "model_seconds": round(self.model_seconds, 4),
+            # Python, I/O and IPC around the model calls
+            "overhead_seconds": (round(max(0.0, self.busy_seconds + self.worker_seconds - self.model_seconds), 4)
+                                 if self.model_seconds else None),
+            **self.counts,
+            **{f"{key}_per_second": round(value / wall, 2) if wall > 0 else None for key, value in self.counts.items()},
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "peak_rss_mb": self.peak_rss_mb,
+            "children_peak_rss_mb": self.children_peak_rss_mb,
+        }
+        if self.python_peak_mb is not None:
+            report["python_peak_mb"] = self.python_peak_mb
+        if self._profile is not None:
+            report["profile"] = self.profile_path
+        if self._worker_stats is not None:
+            report["worker_profile"] = self.worker_profile_path
+        return report
+
+class RunProfiler:
+    def __init__(self, script: str, profile_dir: str = None, trace_memory: bool = False):
+        """
+        Collect per-stage statistics of an ingestion run and save them as a report
+
+        Args:
+            script: Name of the script being run, recorded with each stage
+            profile_dir: Write a cProfile dump per stage into this directory
+            trace_memory: Track the peak Python heap per stage with tracemalloc;
+                this slows allocation-heavy stages down noticeably
+        """
+        self.script = script
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.stages: List[StageProfile] = []
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, busy: bool = True):
+        """
+        Profile a stage for the duration of the block
+
+        Args:
+            busy: Count the whole block as busy time; pass False for a stage that
+                runs alongside others and marks its own work with busy()
+        """
+        stage = StageProfile(name, self.profile_dir)
+        self.stages.append(stage)
+        if self.trace_memory:
+            # Process-wide: stages running side by side share one peak
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            if busy:
+                with stage.busy():
+                    yield stage
+            else:
+                yield stage
+        finally:
+            stage.wall_seconds = time.perf_counter() - start
+            stage.peak_rss_mb = round(peak_rss_mb(), 1)
+            stage.children_peak_rss_mb = round(peak_rss_mb(children=True), 1)
+            if self.trace_memory:
+                stage.python_peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            stage.dump_profiles()
+
+    def report(self) -> dict:
+        finished_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        return {
+            stage.name: {"script": self.script, "finished_at": finished_at, **stage.to_dict()}
+            for stage in self.stages
+        }
+
+    def print_summary(self):
+        columns = ["stage", "wall_seconds", "busy_seconds", "worker_seconds", "model_seconds", "overhead_seconds",
+                   "items_per_second", "mb_read", "mb_written", "peak_rss_mb"]
+        rows = []
+        for stage in self.stages:
+            data = stage.to_dict()
+            rates = [f"{data[f'{key}_per_second']} {key}" for key in stage.counts if data[f"{key}_per_second"]]
+            rows.append({
+                **data,
+                "stage": stage.name,
+                "items_per_second": ", ".join(rates) or "-",
+                "mb_read": round(stage.bytes_read / 2 ** 20, 2),
+                "mb_written": round(stage.bytes_written / 2 ** 20, 2),
+            })
+        if not rows:
+            return
+        cells = [["-" if r.get(c) is None else str(r[c]) for c in columns] for r in rows]
+        widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(columns)]
+        print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+        print("  ".join("-" * w for w in widths))
+        for row in cells:
+            print("  ".join(cell.ljust(w) for cell, w in zip(row, widths)))
+
+    def write(self, path: str = REPORT_PATH, replace: bool = False, **info) -> str:
+        """
+        Save the stages to the run report
+
+        The step-by-step scripts each add their stages to the report, replacing
+        the entries of their previous run; with `replace`, e.g. for a whole
+        pipeline run, stages of earlier runs are dropped.
+
+        Args:
+            info: Extra top-level fields, such as the index version built
+        """
+        report = {"stages": {}}
+        if not replace and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    report = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Starting a new profile report; {path} is unreadable: {e}")
+        report["stages"].update(self.report())
+        report.update(info, updated_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+def add_profiling_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--profile-dir", default=os.environ.get("INGEST_PROFILE_DIR"),
+                        help="Write a cProfile dump per stage into this directory (default: none, or $INGEST_PROFILE_DIR)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Record each stage's peak Python heap with tracemalloc (slower)")
+    parser.add_argument("--profile-report", default=REPORT_PATH,
+                        help=f"Where to save the per-stage run report (default: {REPORT_PATH})")
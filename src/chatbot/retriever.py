@@ -1,31 +1,178 @@
 import faiss
-import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import os
 import logging
+from .cache import LRUCache, normalize_query
+from .chunk_store import open_chunk_store
+from .encoder import MODEL_DIR, load_encoder
+from .filters import MetadataFilter, enable_reconstruct, normalize_filters, read_partition_manifest, search_ids
+from .lexical import open_lexical_index
+from .shards import ShardedIndex, merge_topk
+from typing import List, Dict
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# dense: embeddings only; lexical: BM25 only; hybrid: both, fused by reciprocal rank;
+# auto: BM25 alone for keyword-like queries it matches confidently, otherwise dense
+RETRIEVAL_MODES = ["dense", "lexical", "hybrid", "auto"]
+# Rank offset of reciprocal rank fusion
+RRF_K = 60
+# Candidates per requested chunk for L2 threshold filtering and hybrid fusion
+OVERFETCH = 3
+# Sub-indexes kept loaded at once; the others are read again when a filter needs them
+PARTITION_CACHE_SIZE = 32
+
+def read_index(path: str, mmap: bool = False):
+    """
+    Read a FAISS index, optionally memory-mapped read-only
+
+    A memory-mapped index is paged in from the file on demand and its pages
+    are shared by every process that maps the same file, so several API
+    workers hold one copy of the vectors. Index types that cannot be mapped
+    are read into memory as usual.
+    """
+    if mmap:
+        # IO_FLAG_MMAP_IFC also maps flat, SQ and PQ codes; older FAISS only maps IVF lists
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+        try:
+            return faiss.read_index(path, flags)
+        except RuntimeError as e:
+            logger.warning(f"Cannot memory-map {path}; reading it into memory instead: {e}")
+    return faiss.read_index(path)
+
 class Retriever:
-    def __init__(self, index_path="data/embeddings/docs.index", metadata_path="data/embeddings/chunks_metadata.json"):
+    def __init__(self, index_path="data/embeddings/docs.index", metadata_path="data/embeddings/chunks_metadata.json", embedding_cache=None,
+                 nprobe: int = None, ef_search: int = None, store_path="data/embeddings/chunks.store", model=None,
+                 encoder_backend: str = "torch", model_dir: str = MODEL_DIR, encoder_threads: int = None,
+                 lexical_path="data/embeddings/lexical.bm25", mode: str = "dense", mmap_index: bool = False,
+                 shards_path="data/embeddings/shards.json", shard_addresses: List[str] = None,
+                 shard_timeout: float = 1.0, partitions_path="data/embeddings/partitions.json",
+                 overfetch: int = OVERFETCH):
+        # An index built with --shards has a manifest instead of docs.index
+        sharded = not os.path.exists(index_path) and os.path.exists(shards_path)
         # Check if index exists before loading
-        if not os.path.exists(index_path) or not os.path.exists(metadata_path):
+        if not (os.path.exists(index_path) or sharded) or not (os.path.exists(store_path) or os.path.exists(metadata_path)):
             raise FileNotFoundError(
                 "Index or metadata files not found. Please run the embedding creation step first."
             )
             
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.index = faiss.read_index(index_path)
+        # A loaded model can be passed in, e.g. when swapping in a new index version
+        # Otherwise load the encoder backend: "torch", "onnx" or "onnx_int8"
+        self.model = model or load_encoder(encoder_backend, model_dir=model_dir, threads=encoder_threads)
+        # Version of the index artifacts, set by the IndexManager that loaded them
+        self.version = None
+        # Optional LRUCache of query embeddings keyed by normalized text
+        self.embedding_cache = embedding_cache
+        if sharded:
+            # Searched by shard processes, local or remote, behind the FAISS search interface
+            self.index = ShardedIndex(shards_path, addresses=shard_addresses, timeout=shard_timeout, mmap=mmap_index)
+        else:
+            # Memory-mapped, the index is shared by all worker processes like the chunk store and lexical index
+            self.index = read_index(index_path, mmap=mmap_index)
+        # Inner-product indexes hold L2-normalized vectors, so their scores are cosine similarities
+        self.cosine = self.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        # Cleared when the index type turns out not to implement range search (e.g. HNSW)
+        self._range_search = self.cosine
         
-        with open(metadata_path, "r") as f:
-            self.chunks = json.load(f)
-            
-        logger.info(f"Loaded {len(self.chunks)} chunks from metadata")
+        # Memory-mapped chunk store; chunk text is only decoded for search hits
+        self.chunks = open_chunk_store(store_path, metadata_path)
+        
+        # Metadata filters are resolved to vector IDs and applied inside the FAISS search
+        self.filter = MetadataFilter(self.chunks)
+        enable_reconstruct(self.index)
+        # Optional per-value sub-indexes, so a search scoped to one value only visits its vectors.
+        # A sharded index keeps its vectors out of this process, so filters go to the shards as IDs
+        self.partitions = {} if sharded else self._load_partitions(partitions_path)
+        # Sub-indexes are read on first use, like the index memory-mapped if it is
+        self._partition_indexes = LRUCache(max_size=PARTITION_CACHE_SIZE, ttl=0)
+        self._mmap_partitions = mmap_index
+        self._partition_params = {}
+        self.set_search_params(nprobe=nprobe, ef_search=ef_search)
+        
+        # Optional BM25 index over the same chunks, used by the non-dense modes
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; choose from {', '.join(RETRIEVAL_MODES)}")
+        self.lexical = open_lexical_index(lexical_path)
+        if mode != "dense" and self.lexical is None:
+            logger.warning(f"Lexical index {lexical_path} not found; falling back to dense retrieval")
+            mode = "dense"
+        self.mode = mode
+        # Candidates fetched per requested chunk where results are filtered or fused after the search
+        self.overfetch = max(1, overfetch)
     
-    def get_relevant_chunks(self, query: str, k: int = 5, threshold: float = 0.2):
+    def _load_partitions(self, path: str) -> Dict[str, Dict]:
+        """{field: {value: (sub-index file, number of vectors)}} from the partition manifest, if any"""
+        if not os.path.exists(path):
+            return {}
+        manifest = read_partition_manifest(path)
+        if manifest.get("metric", "l2") != ("cosine" if self.cosine else "l2"):
+            logger.warning(f"Partitions in {path} use a different metric than the index; ignoring them")
+            return {}
+        partitions = {
+            field: {p["value"]: (p["path"], p["num_vectors"]) for p in values}
+            for field, values in manifest["fields"].items()
+        }
+        logger.info(f"Found sub-indexes for {', '.join(f'{len(v)} {f} values' for f, v in partitions.items())}")
+        return partitions
+
+    def _partition_index(self, field: str, value):
+        """The sub-index of one field value, read on first use"""
+        index = self._partition_indexes.get((field, value))
+        if index is None:
+            index = enable_reconstruct(read_index(self.partitions[field][value][0], mmap=self._mmap_partitions))
+            # Large partitions may be IVF or HNSW too; small ones are flat and have no knobs
+            for name, setting in self._partition_params.items():
+                try:
+                    faiss.ParameterSpace().set_index_parameter(index, name, setting)
+                except RuntimeError:
+                    pass
+            self._partition_indexes.put((field, value), index)
+        return index
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """
+        Apply runtime search knobs to the loaded index
+        
+        Args:
+            nprobe: Number of inverted lists visited by IVF indexes
+            ef_search: Size of the candidate list explored by HNSW indexes
+        """
+        # Applied to sub-indexes as they are read; loaded ones are dropped to pick up the new values
+        for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+            if value is not None:
+                self._partition_params[name] = value
+        self._partition_indexes.clear()
+        
+        if isinstance(self.index, ShardedIndex):
+            try:
+                self.index.set_search_params(nprobe=nprobe, efSearch=ef_search)
+            except RuntimeError as e:
+                logger.warning(f"Cannot set search parameters on the shards: {e}")
+            return
+        params = faiss.ParameterSpace()
+        for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+            if value is None:
+                continue
+            try:
+                params.set_index_parameter(self.index, name, value)
+                logger.info(f"Set index search parameter {name}={value}")
+            except RuntimeError:
+                logger.warning(f"Index type {type(self.index).__name__} does not support {name}; ignoring")
+    
+    def missing_shards(self) -> List[int]:
+        """Shards that did not answer the calling thread's last search; always empty for one index"""
+        if isinstance(self.index, ShardedIndex):
+            return self.index.missing_shards()
+        return []
+
+    def _reset_missing_shards(self):
+        # Searches answered without the shards (sub-indexes, BM25) must not report an earlier scatter's gaps
+        if isinstance(self.index, ShardedIndex):
+            self.index.reset_missing()
+
+    def get_relevant_chunks(self, query: str, k: int = 5, threshold: float = 0.2, filters: Dict = None):
         """
         Get the most relevant chunks for a query
         
@@ -33,53 +180,302 @@ class Retriever:
             query: The user question
             k: Number of chunks to retrieve
             threshold: Similarity threshold (0-1) for relevance filtering
+            filters: Only search chunks whose metadata matches, e.g.
+                {"source": ["pdf:a.pdf", "pdf:b.pdf"], "doc_type": "pdf"}
             
         Returns:
             List of relevant chunk dictionaries
         """
-        logger.info(f"Searching for query: '{query}'")
+        relevant_chunks = self.get_relevant_chunks_batch([query], k=k, threshold=threshold, filters=filters)[0]
         
-        # Encode the query
-        query_vector = self.model.encode([query])[0].astype('float32')
-        query_vector = np.array([query_vector])
+        # Per-chunk logs cost real time on every query; only build them when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Found {len(relevant_chunks)} relevant chunks for query: '{query}'")
+            for i, chunk in enumerate(relevant_chunks[:2]):
+                logger.debug(f"Top chunk {i+1}: similarity={chunk['similarity']:.4f}, source={chunk['source']}")
+                logger.debug(f"Content preview: {chunk['text'][:100]}...")
         
-        # Get more candidates initially
-        k_init = min(k * 3, len(self.chunks))
-        distances, indices = self.index.search(query_vector, k_init)
-        
-        logger.info(f"Retrieved {len(indices[0])} initial chunks")
-        
-        # Filter results by threshold and prepare results
-        relevant_chunks = []
-        for i, idx in enumerate(indices[0]):
-            # Convert distance to similarity score (0-1)
-            # FAISS uses L2 distance, so we need to convert to similarity
-            # Lower distance = higher similarity
-            distance = distances[0][i]
-            # Normalize distance to similarity score between 0-1
-            # This is a simple conversion for L2 distance
-            similarity = 1 / (1 + distance)
+        return relevant_chunks
+
+    def get_relevant_chunks_batch(self, queries: List[str], k: int = 5, threshold: float = 0.2, filters: Dict = None):
+        """
+        Get the most relevant chunks for several queries at once
+        
+        Queries routed to the lexical index are answered without encoding.
+        The rest are encoded in a single model call and searched with a
+        single matrix query against the index.
+        
+        Args:
+            queries: The user questions
+            k: Number of chunks to retrieve per query
+            threshold: Similarity threshold (0-1) for filtering dense results
+            filters: Metadata filters applied to every query; see get_relevant_chunks
             
-            logger.info(f"Chunk {idx} similarity: {similarity:.4f}")
+        Returns:
+            One list of relevant chunk dictionaries per query, in input order
+        """
+        if not queries:
+            return []
+        
+        logger.debug(f"Searching for a batch of {len(queries)} queries")
+        
+        results = [None] * len(queries)
+        routed = self.route(queries)
+        lexical = [i for i, use_lexical in enumerate(routed) if use_lexical]
+        dense = [i for i, use_lexical in enumerate(routed) if not use_lexical]
+        
+        if lexical:
+            for i, chunks in zip(lexical, self.search_lexical([queries[i] for i in lexical], k=k, filters=filters)):
+                results[i] = chunks
+        
+        if dense:
+            texts = [queries[i] for i in dense]
+            query_vectors = self.encode_queries(texts)
+            for i, chunks in zip(dense, self.search_encoded(texts, query_vectors, k=k, threshold=threshold,
+                                                            filters=filters)):
+                results[i] = chunks
+        
+        return results
+
+    def route(self, queries: List[str]) -> List[bool]:
+        """For each query, whether it is answered from the lexical index alone, without encoding"""
+        if self.mode == "lexical":
+            return [True] * len(queries)
+        if self.mode == "auto":
+            return [self.lexical.is_confident(query) for query in queries]
+        return [False] * len(queries)
+
+    def search_lexical(self, queries: List[str], k: int = 5, filters: Dict = None) -> List[List[Dict]]:
+        """BM25 search; similarity is the BM25 score relative to the best possible for the query terms"""
+        self._reset_missing_shards()
+        allowed = self.filter.ids(filters) if filters else None
+        results = []
+        for query in queries:
+            ids, scores = self.lexical.search(query, k, ids=allowed)
+            positions = self.chunks.lookup(ids)
+            results.append([
+                self.chunks.get(int(position), similarity=float(score), retrieval="lexical")
+                for position, score in zip(positions, scores) if position >= 0
+            ])
+        return results
+
+    def search_encoded(self, queries: List[str], query_vectors: np.ndarray, k: int = 5,
+                       threshold: float = 0.2, filters: Dict = None) -> List[List[Dict]]:
+        """Search encoded queries: dense results, fused with BM25 results in hybrid mode"""
+        self._reset_missing_shards()
+        if self.mode != "hybrid":
+            return self.search_vectors(query_vectors, k=k, threshold=threshold, filters=filters)
+        return self._search_hybrid(queries, query_vectors, k, threshold, normalize_filters(filters))
+
+    def _search_hybrid(self, queries: List[str], query_vectors: np.ndarray, k: int, threshold: float,
+                       filters=None) -> List[List[Dict]]:
+        """
+        Fuse dense and BM25 candidate lists with reciprocal rank fusion
+        
+        Each list contributes 1/(RRF_K + rank) per chunk. The reported
+        similarity is the fused score scaled so that a chunk ranked first by
+        both lists scores 1.
+        """
+        k_init = min(k * self.overfetch, len(self.chunks))
+        if self.cosine:
+            query_vectors = self._normalize(query_vectors)
+        distances, indices = self._search(query_vectors, k_init, filters)
+        similarities = self._similarities(distances)
+        positions = self.chunks.lookup(indices)
+        allowed = self.filter.ids(filters) if filters else None
+        
+        results = []
+        for query, row_positions, row_similarities in zip(queries, positions, similarities):
+            scores = {}
+            dense = row_positions[(row_positions >= 0) & (row_similarities >= threshold)]
+            ids, _ = self.lexical.search(query, k_init, ids=allowed)
+            lexical = self.chunks.lookup(ids)
+            for ranked in (dense, lexical[lexical >= 0]):
+                for rank, position in enumerate(ranked.tolist()):
+                    scores[position] = scores.get(position, 0.0) + 1.0 / (RRF_K + rank + 1)
             
-            if similarity >= threshold and idx < len(self.chunks):
-                chunk = self.chunks[idx]
-                chunk["similarity"] = float(similarity)
-                relevant_chunks.append(chunk)
-                
-                # Break if we have enough chunks
-                if len(relevant_chunks) >= k:
-                    break
-        
-        # Sort by similarity (highest first)
-        relevant_chunks.sort(key=lambda x: x["similarity"], reverse=True)
-        
-        logger.info(f"Found {len(relevant_chunks)} relevant chunks after filtering")
-        
-        # Log the first few relevant chunks
-        for i, chunk in enumerate(relevant_chunks[:2]):
-            logger.info(f"Top chunk {i+1}: similarity={chunk['similarity']:.4f}, source={chunk['source']}")
-            logger.info(f"Content preview: {chunk['text'][:100]}...")
-        
-        # If we don't have enough chunks after filtering, return what we have
-        return relevant_chunks[:k] if relevant_chunks else []
\ No newline at end of file
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            results.append([
+                self.chunks.get(position, similarity=score * (RRF_K + 1) / 2, retrieval="hybrid")
+                for position, score in top
+            ])
+        
+        return results
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Encode queries into a (n, d) float32 matrix
+        
+        Embeddings found in the embedding cache are reused; the remaining
+        queries are encoded together in a single model call.
+        """
+        if self.embedding_cache is None:
+            return np.ascontiguousarray(self.model.encode(list(queries)), dtype='float32')
+        
+        keys = [normalize_query(query) for query in queries]
+        vectors = {}
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key in vectors or key in missing:
+                continue
+            vector = self.embedding_cache.get(key)
+            if vector is None:
+                missing[key] = query
+            else:
+                vectors[key] = vector
+        
+        if missing:
+            encoded = np.asarray(self.model.encode(list(missing.values())), dtype='float32')
+            for key, vector in zip(missing, encoded):
+                vector.setflags(write=False)
+                self.embedding_cache.put(key, vector)
+                vectors[key] = vector
+        
+        return np.ascontiguousarray(np.stack([vectors[key] for key in keys]), dtype='float32')
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int = 5, threshold: float = 0.2,
+                       filters: Dict = None) -> List[List[Dict]]:
+        """Search the index with already-encoded queries, one result list per row"""
+        self._reset_missing_shards()
+        if len(query_vectors) == 0:
+            return []
+        filters = normalize_filters(filters)
+        
+        if self.cosine:
+            query_vectors = self._normalize(query_vectors)
+            # Filtered searches are already narrow; the k-NN path below applies the threshold exactly
+            if threshold > 0 and self._range_search and not filters:
+                try:
+                    return self._search_range(query_vectors, k, threshold)
+                except RuntimeError as e:
+                    logger.warning(f"Range search unavailable for {type(self.index).__name__} ({e}); using k-NN search")
+                    self._range_search = False
+            # Cosine scores are filtered exactly, so no over-fetch is needed
+            distances, indices = self._search(query_vectors, min(k, len(self.chunks)), filters)
+            return self._select_results(distances, indices, k, threshold)
+        
+        # Get more candidates initially
+        k_init = min(k * self.overfetch, len(self.chunks))
+        distances, indices = self._search(query_vectors, k_init, filters)
+        
+        return self._select_results(distances, indices, k, threshold)
+
+    def _search(self, query_vectors: np.ndarray, k: int, filters=None):
+        """
+        k-NN search restricted to the chunks matching normalized filters
+        
+        When a filtered field has sub-indexes, only the sub-indexes of the
+        requested values are searched, so the cost follows the size of the
+        scope rather than of the corpus. Otherwise the matching IDs are
+        passed to FAISS as a selector and skipped over inside the search,
+        or, when only a few chunks match, scored exactly.
+        """
+        if not filters:
+            return self.index.search(query_vectors, k)
+        
+        # Of the partitioned fields, the one whose requested values hold the fewest vectors
+        plans = [
+            (sum(self.partitions[field][value][1] for value in values if value in self.partitions[field]), field)
+            for field, values in filters if field in self.partitions
+        ]
+        if plans:
+            _, field = min(plans)
+            rest = tuple(item for item in filters if item[0] != field)
+            rest = self.filter.ids(rest) if rest else None
+            parts = []
+            for value in dict(filters)[field]:
+                if value not in self.partitions[field]:
+                    continue
+                index = self._partition_index(field, value)
+                if rest is None:
+                    parts.append(index.search(query_vectors, k))
+                else:
+                    # A sub-index holds exactly the chunks with its value
+                    ids = np.intersect1d(self.filter.postings(field)[value], rest, assume_unique=True)
+                    parts.append(search_ids(index, query_vectors, k, ids))
+            if parts:
+                # A deduplicated chunk is in the sub-index of every source it appears in
+                return merge_topk(parts, k, self.index.metric_type, unique=len(parts) > 1)
+            return self._no_results(len(query_vectors), k)
+        
+        ids, selector = self.filter.resolve(filters)
+        if isinstance(self.index, ShardedIndex):
+            if len(ids) == 0:
+                return self._no_results(len(query_vectors), k)
+            return self.index.search(query_vectors, k, ids=ids)
+        return search_ids(self.index, query_vectors, k, ids, selector)
+
+    @staticmethod
+    def _no_results(n: int, k: int):
+        return np.full((n, k), np.inf, dtype='float32'), np.full((n, k), -1, dtype='int64')
+
+    @staticmethod
+    def _normalize(query_vectors: np.ndarray) -> np.ndarray:
+        """L2-normalized copy of the query vectors; cached embeddings stay untouched"""
+        query_vectors = np.array(query_vectors, dtype='float32', order='C')
+        faiss.normalize_L2(query_vectors)
+        return query_vectors
+
+    def _similarities(self, distances: np.ndarray) -> np.ndarray:
+        """Convert FAISS search scores into similarities where higher is better"""
+        if self.cosine:
+            return distances
+        # Convert L2 distance to a similarity score between 0-1
+        # Lower distance = higher similarity
+        return 1.0 / (1.0 + distances)
+
+    def _search_range(self, query_vectors: np.ndarray, k: int, threshold: float) -> List[List[Dict]]:
+        """
+        Return the top k chunks with cosine similarity >= threshold for every query
+        
+        FAISS range search applies the threshold in C++ and returns only the
+        qualifying hits as flat arrays. Ranking within each query and the
+        top-k cut are done for all queries at once.
+        """
+        lims, scores, labels = self.index.range_search(query_vectors, threshold)
+        rows = np.repeat(np.arange(len(query_vectors)), np.diff(lims.astype('int64')))
+        positions = self.chunks.lookup(labels)
+        
+        valid = positions >= 0
+        rows, scores, positions = rows[valid], scores[valid], positions[valid]
+        
+        # Sort by query, then by descending score; the rank is the offset from the query's first hit
+        order = np.lexsort((-scores, rows))
+        rows, scores, positions = rows[order], scores[order], positions[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        keep = rank < k
+        rows, scores, positions = rows[keep], scores[keep], positions[keep]
+        
+        bounds = np.searchsorted(rows, np.arange(len(query_vectors) + 1))
+        return [
+            [
+                self.chunks.get(int(position), similarity=float(score), retrieval="dense")
+                for position, score in zip(positions[start:end], scores[start:end])
+            ]
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+
+    def _select_results(self, distances: np.ndarray, indices: np.ndarray, k: int, threshold: float) -> List[List[Dict]]:
+        """
+        Turn FAISS search output into filtered chunks for every query row
+        
+        Threshold filtering and top-k selection run over the whole
+        (n_queries, k_init) arrays at once. FAISS returns each row sorted
+        by distance, so the first k qualifying columns are the top k.
+        """
+        similarities = self._similarities(distances)
+        
+        # FAISS pads missing results with -1, which maps to no chunk
+        positions = self.chunks.lookup(indices)
+        valid = (positions >= 0) & (similarities >= threshold)
+        keep = valid & (np.cumsum(valid, axis=1) <= k)
+        
+        results = []
+        for row_keep, row_positions, row_similarities in zip(keep, positions, similarities):
+            results.append([
+                # Fresh immutable mapping, so concurrent searches never share state
+                self.chunks.get(int(position), similarity=float(similarity), retrieval="dense")
+                for position, similarity in zip(row_positions[row_keep], row_similarities[row_keep])
+            ])
+        
+        return results
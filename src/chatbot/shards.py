@@ -0,0 +1,432 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+import logging
+import numpy as np
+import faiss
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional, Tuple
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARDS_FILE = "shards.json"
+SHARDS_DIR = "shards"
+# Environment variable holding the key shared by the coordinator and remote shard servers;
+# local shard processes get a random key per run
+AUTHKEY_ENV = "SHARD_AUTHKEY"
+
+def shard_authkey() -> bytes:
+    """
+    Key that remote shard servers and their coordinator authenticate each other with
+
+    Shard connections exchange pickled messages, so anyone holding the key
+    can run code on the other side; there is deliberately no default.
+    """
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        raise RuntimeError(f"Set {AUTHKEY_ENV} to a shared secret to serve or connect to remote shards")
+    return key.encode()
+
+def shard_of(ids: np.ndarray, num_shards: int) -> np.ndarray:
+    """Shard number of each vector ID; spreads IDs evenly and never moves an existing one"""
+    return np.asarray(ids, dtype='int64') % num_shards
+
+def write_shard_manifest(embeddings_dir: str, files: List[str], num_vectors: List[int], **info) -> str:
+    """
+    Record a complete set of shard indexes
+
+    Shard files are given relative to embeddings_dir and listed in shard
+    order. Written last, atomically, once every shard file is in place.
+    """
+    path = os.path.join(embeddings_dir, SHARDS_FILE)
+    data = {"num_shards": len(files), "files": files, "num_vectors": [int(n) for n in num_vectors], **info}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+def read_shard_manifest(path: str) -> Dict:
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    manifest["paths"] = [os.path.join(base, name) for name in manifest["files"]]
+    return manifest
+
+def merge_topk(parts: List[Tuple[np.ndarray, np.ndarray]], k: int, metric_type: int,
+               unique: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Merge per-index top-k results for the same queries into one top-k
+
+    Args:
+        parts: (distances, labels) of each index, as returned by faiss.Index.search
+        k: Results per query to keep
+        metric_type: faiss.METRIC_L2 (smaller is better) or METRIC_INNER_PRODUCT
+        unique: Drop repeated labels, for indexes that can hold the same vector
+    """
+    distances = np.concatenate([d for d, _ in parts], axis=1)
+    labels = np.concatenate([l for _, l in parts], axis=1)
+
+    # Smaller is better for L2, larger for inner product; empty slots (-1) sort last
+    keys = distances if metric_type == faiss.METRIC_L2 else -distances
+    keys = np.where(labels < 0, np.inf, keys)
+    order = np.argsort(keys, axis=1, kind="stable")
+    distances = np.take_along_axis(distances, order, axis=1)
+    labels = np.take_along_axis(labels, order, axis=1)
+    if unique:
+        for row_distances, row_labels in zip(distances, labels):
+            _, first = np.unique(row_labels, return_index=True)
+            repeated = np.ones(len(row_labels), dtype=bool)
+            repeated[first] = False
+            row_labels[repeated] = -1
+            row_distances[repeated] = np.inf
+        # Repeats now sort last; stable, so the rest keep their order
+        order = np.argsort(labels < 0, axis=1, kind="stable")
+        distances = np.take_along_axis(distances, order, axis=1)
+        labels = np.take_along_axis(labels, order, axis=1)
+
+    distances, labels = distances[:, :k], labels[:, :k]
+    if labels.shape[1] < k:
+        pad = k - labels.shape[1]
+        distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+        labels = np.pad(labels, ((0, 0), (0, pad)), constant_values=-1)
+    return distances, labels
+
+def serve_shard(index_path: str, address, authkey: bytes, mmap: bool = False):
+    """
+    Serve searches over one shard index until the process is stopped
+
+    Each client connection is handled in its own thread. Requests are
+    (request_id, op, args) tuples; every reply echoes the request ID so a
+    client can drop replies that arrive after it stopped waiting.
+    """
+    from .filters import enable_reconstruct, search_ids
+    from .retriever import read_index
+
+    index = enable_reconstruct(read_index(index_path, mmap=mmap))
+    # Sorted IDs of this shard, to narrow a filter's IDs to the ones held here
+    shard_ids = np.sort(faiss.vector_to_array(index.id_map))
+
+    def held_ids(ids: np.ndarray) -> np.ndarray:
+        if len(shard_ids) == 0:
+            return ids[:0]
+        positions = np.minimum(np.searchsorted(shard_ids, ids), len(shard_ids) - 1)
+        return ids[shard_ids[positions] == ids]
+
+    listener = Listener(address, authkey=authkey)
+    logger.info(f"Serving shard {index_path} ({index.ntotal} vectors) on {listener.address}")
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    request_id, op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op == "search":
+                        x, k, ids = args
+                        if ids is None:
+                            result = index.search(x, k)
+                        else:
+                            result = search_ids(index, x, k, held_ids(ids))
+                    elif op == "range_search":
+                        result = index.range_search(*args)
+                    elif op == "info":
+                        result = {"ntotal": index.ntotal, "d": index.d, "metric_type": index.metric_type}
+                    elif op == "set_params":
+                        params = faiss.ParameterSpace()
+                        for name, value in args.items():
+                            params.set_index_parameter(index, name, value)
+                        result = None
+                    else:
+                        raise ValueError(f"Unknown shard operation {op!r}")
+                    conn.send((request_id, True, result))
+                except Exception as e:
+                    conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # A client with the wrong key must not take the shard down
+            logger.warning(f"Rejected shard connection: {e}")
+            continue
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+class ShardUnavailable(Exception):
+    """The shard did not answer in time or could not be reached"""
+
+class ShardClient:
+    def __init__(self, address, authkey: bytes, name: str):
+        self.address = address
+        self.authkey = authkey
+        self.name = name
+        self.timeouts = 0
+        self.errors = 0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._retry_at = 0.0
+
+    def reset(self):
+        """Forget the connection, e.g. in a forked child that must not share its parent's socket"""
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def call(self, op: str, args, deadline: float):
+        """Send one request and wait for its reply until `deadline` (time.monotonic())"""
+        if not self._lock.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            self.timeouts += 1
+            raise ShardUnavailable(f"{self.name} is busy with a request that timed out")
+        try:
+            if self._conn is None:
+                # Don't retry a dead shard on every query
+                if time.monotonic() < self._retry_at:
+                    raise ShardUnavailable(f"{self.name} is down")
+                try:
+                    self._conn = Client(self.address, authkey=self.authkey)
+                except OSError as e:
+                    self._retry_at = time.monotonic() + 1.0
+                    self.errors += 1
+                    raise ShardUnavailable(f"Cannot reach {self.name}: {e}") from e
+
+            self._next_id += 1
+            request_id = self._next_id
+            try:
+                self._conn.send((request_id, op, args))
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._conn.poll(remaining):
+                        self.timeouts += 1
+                        raise ShardUnavailable(f"{self.name} timed out")
+                    reply_id, ok, result = self._conn.recv()
+                    # Replies to requests that timed out earlier arrive first; skip them
+                    if reply_id == request_id:
+                        break
+            except (EOFError, OSError) as e:
+                self._conn = None
+                self.errors += 1
+                raise ShardUnavailable(f"Lost connection to {self.name}: {e}") from e
+
+            if not ok:
+                raise RuntimeError(f"{self.name}: {result}")
+            return result
+        finally:
+            self._lock.release()
+
+def _stop_local_shards(processes: list, socket_dir: Optional[str], owner_pid: int):
+    # Forked API workers share the parent's shards; only the parent stops them
+    if os.getpid() != owner_pid:
+        return
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(timeout=5)
+    if socket_dir:
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+def _reset_after_fork(index_ref):
+    index = index_ref()
+    if index is not None:
+        index._reset_connections()
+
+class ShardedIndex:
+    def __init__(self, manifest_path: str, addresses: List[str] = None, timeout: float = 1.0,
+                 mmap: bool = False, startup_timeout: float = 300.0):
+        """
+        Coordinator searching a sharded index as if it were one FAISS index
+
+        Every query is sent to all shards in parallel. Each shard returns its
+        own top-k (or range search hits) with scores in the shared metric, so
+        merging them by score gives the same result as one unsharded index.
+        Shards that have not answered when `timeout` expires are left out;
+        the query is answered from the others and the missing shards are
+        reported by missing_shards().
+
+        Args:
+            manifest_path: shards.json written by create_embeddings.py --shards
+            addresses: "host:port" of a running shard server per shard, in
+                manifest order; if omitted, every shard is started as a local
+                process serving its file
+            timeout: Seconds to wait for the shards on each search
+            mmap: Memory-map the shard files in local shard processes
+            startup_timeout: Seconds to wait for local shards to load their files
+        """
+        self.manifest = read_shard_manifest(manifest_path)
+        self.num_shards = self.manifest["num_shards"]
+        self.timeout = timeout
+        self.metric_type = faiss.METRIC_INNER_PRODUCT if self.manifest.get("metric") == "cosine" else faiss.METRIC_L2
+        self.ntotal = int(sum(self.manifest["num_vectors"]))
+        self.d = self.manifest.get("dimension")
+        self._local = threading.local()
+        self._processes = []
+        self._socket_dir = None
+
+        if addresses:
+            if len(addresses) != self.num_shards:
+                raise ValueError(f"Got {len(addresses)} shard addresses for {self.num_shards} shards")
+            authkey = shard_authkey()
+            parsed = []
+            for address in addresses:
+                host, _, port = address.rpartition(":")
+                parsed.append((host, int(port)))
+        else:
+            authkey = os.urandom(32)
+            parsed = self._start_local_shards(authkey, mmap)
+
+        self.clients = [ShardClient(address, authkey, f"shard {i}") for i, address in enumerate(parsed)]
+        self._executor = ThreadPoolExecutor(max_workers=2 * self.num_shards, thread_name_prefix="shard-search")
+        weakref.finalize(self, _stop_local_shards, self._processes, self._socket_dir, os.getpid())
+        os.register_at_fork(after_in_child=lambda ref=weakref.ref(self): _reset_after_fork(ref))
+
+        self._check_shards(startup_timeout if not addresses else max(timeout, 5.0))
+
+    def _start_local_shards(self, authkey: bytes, mmap: bool) -> List[str]:
+        # Spawned rather than forked: the API process already runs threads
+        context = get_context("spawn")
+        self._socket_dir = tempfile.mkdtemp(prefix="rag-shards-")
+        addresses = []
+        for i, path in enumerate(self.manifest["paths"]):
+            address = os.path.join(self._socket_dir, f"shard_{i}.sock")
+            process = context.Process(target=serve_shard, args=(path, address, authkey, mmap),
+                                      name=f"shard-{i}", daemon=True)
+            process.start()
+            self._processes.append(process)
+            addresses.append(address)
+        logger.info(f"Started {self.num_shards} local shard processes")
+        return addresses
+
+    def _check_shards(self, startup_timeout: float):
+        """Wait for every shard and check that it serves the vectors the manifest lists"""
+        deadline = time.monotonic() + startup_timeout
+        for i, client in enumerate(self.clients):
+            while True:
+                try:
+                    info = client.call("info", None, time.monotonic() + 5.0)
+                    break
+                except ShardUnavailable:
+                    if any(not p.is_alive() for p in self._processes):
+                        raise RuntimeError(f"A local shard process exited while loading {self.manifest['paths'][i]}")
+                    if time.monotonic() > deadline:
+                        if self._processes:
+                            raise
+                        # Remote shards may come up later; searches skip them until then
+                        logger.warning(f"Shard {i} at {client.address} is not reachable yet")
+                        info = None
+                        break
+                    client._retry_at = 0.0
+                    time.sleep(0.2)
+            if info and info["ntotal"] != self.manifest["num_vectors"][i]:
+                raise RuntimeError(
+                    f"Shard {i} serves {info['ntotal']} vectors; the manifest lists {self.manifest['num_vectors'][i]}"
+                )
+            # Failed attempts while the shard was still loading don't count
+            client.timeouts = client.errors = 0
+
+    def _reset_connections(self):
+        for client in self.clients:
+            client.reset()
+        self._executor = ThreadPoolExecutor(max_workers=2 * self.num_shards, thread_name_prefix="shard-search")
+
+    def _scatter(self, op: str, args) -> List:
+        """Run an operation on every shard; None for shards that did not answer in time"""
+        deadline = time.monotonic() + self.timeout
+        futures = [self._executor.submit(client.call, op, args, deadline) for client in self.clients]
+        wait(futures, timeout=self.timeout)
+
+        results, missing = [], []
+        for i, future in enumerate(futures):
+            if not future.done():
+                results.append(None)
+                missing.append(i)
+                continue
+            try:
+                results.append(future.result())
+            except ShardUnavailable as e:
+                logger.warning(f"Answering from the other shards: {e}")
+                results.append(None)
+                missing.append(i)
+        self._local.missing = missing
+        if len(missing) == self.num_shards:
+            raise RuntimeError("No shard answered in time")
+        return results
+
+    def missing_shards(self) -> List[int]:
+        """Shards left out of the calling thread's last search"""
+        return getattr(self._local, "missing", [])
+
+    def reset_missing(self):
+        """Start a new search in the calling thread, for searches that may not reach the shards"""
+        self._local.missing = []
+
+    def search(self, x: np.ndarray, k: int, ids: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Global top-k over all shards, in the same layout as faiss.Index.search
+
+        With `ids`, every shard only considers those vector IDs.
+        """
+        x = np.ascontiguousarray(x, dtype='float32')
+        parts = [part for part in self._scatter("search", (x, k, ids)) if part is not None]
+        return merge_topk(parts, k, self.metric_type)
+
+    def range_search(self, x: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All hits within radius on every shard, in the same layout as faiss.Index.range_search"""
+        x = np.ascontiguousarray(x, dtype='float32')
+        parts = [part for part in self._scatter("range_search", (x, radius)) if part is not None]
+        counts = sum(np.diff(lims.astype('int64')) for lims, _, _ in parts)
+        lims = np.zeros(len(x) + 1, dtype='int64')
+        lims[1:] = np.cumsum(counts)
+
+        # Interleave the shards' hits query by query
+        distances = np.empty(lims[-1], dtype='float32')
+        labels = np.empty(lims[-1], dtype='int64')
+        offsets = lims[:-1].copy()
+        for part_lims, part_distances, part_labels in parts:
+            part_lims = part_lims.astype('int64')
+            sizes = np.diff(part_lims)
+            # Position of each hit within its query's slice of this shard
+            within = np.arange(part_lims[-1]) - np.repeat(part_lims[:-1], sizes)
+            targets = np.repeat(offsets, sizes) + within
+            distances[targets] = part_distances
+            labels[targets] = part_labels
+            offsets += sizes
+        return lims, distances, labels
+
+    def set_search_params(self, **params):
+        """Apply search parameters such as nprobe or efSearch on every shard"""
+        params = {name: value for name, value in params.items() if value is not None}
+        if params:
+            self._scatter("set_params", params)
+
+    def status(self) -> List[Dict]:
+        return [
+            {"shard": i, "address": str(client.address), "vectors": self.manifest["num_vectors"][i],
+             "timeouts": client.timeouts, "errors": client.errors}
+            for i, client in enumerate(self.clients)
+        ]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve one shard of a sharded index to a remote coordinator")
+    parser.add_argument("--manifest", default=os.path.join("data/embeddings", SHARDS_FILE))
+    parser.add_argument("--shard", type=int, required=True, help="Shard number in the manifest")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Interface to listen on (default: 127.0.0.1); the coordinator must be able to reach it")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the shard file")
+    args = parser.parse_args()
+
+    # Checked before loading the shard, so a misconfigured server fails fast
+    authkey = shard_authkey()
+    manifest = read_shard_manifest(args.manifest)
+    serve_shard(manifest["paths"][args.shard], (args.host, args.port), authkey, mmap=args.mmap)
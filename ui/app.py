@@ -10,42 +10,100 @@ load_dotenv()
 # API configuration
 API_URL = os.environ.get("API_URL", "http://localhost:8000")
 
+NO_ANSWER_TEXT = "I don't have information about that in my knowledge base. Please ask a question related to the content in the provided PDF documents."
+
+def normalize_answer(text):
+    """Handle "I don't know" responses consistently"""
+    if "I don't know" in text or "don't have information" in text:
+        return NO_ANSWER_TEXT
+    return text
+
+def status_message(response):
+    """Explain a failed API response; overload rejections say when to try again"""
+    if response.status_code in (429, 503) and response.headers.get("Retry-After"):
+        return f"The server is busy right now. Please try again in {response.headers['Retry-After']} seconds."
+    return f"Error: API returned status code {response.status_code}"
+
+def read_events(response):
+    """Yield (event, data) pairs from a Server-Sent Events response"""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def chat_once(message, history):
+    """Get the complete answer from /chat, for APIs without the streaming endpoint"""
+    response = requests.post(
+        f"{API_URL}/chat",
+        json={"text": message},
+        # The server stops working on the question when this client gives up
+        headers={"X-Request-Timeout": "30"},
+        timeout=30
+    )
+    
+    # Handle API errors
+    if response.status_code != 200:
+        history[-1] = (message, status_message(response))
+        return history
+    
+    # Parse response
+    result = response.json()
+    chatbot_response = result.get("response", "Sorry, I couldn't process your request.")
+    history[-1] = (message, normalize_answer(chatbot_response))
+    return history
+
 def chat(message, history):
-    """Process user message and get chatbot response"""
+    """Process user message and render the answer as it streams in"""
+    history = (history or []) + [(message, "Searching the documents...")]
+    yield "", history
+    
     try:
-        # Call the API
-        response = requests.post(
-            f"{API_URL}/chat",
+        # Connect quickly, then allow generous gaps between events
+        with requests.post(
+            f"{API_URL}/chat/stream",
             json={"text": message},
-            timeout=30
-        )
-        
-        # Handle API errors
-        if response.status_code != 200:
-            response_text = f"Error: API returned status code {response.status_code}"
-            history.append((message, response_text))
-            return "", history
-        
-        # Parse response
-        result = response.json()
-        
-        # Format response with sources if available
-        chatbot_response = result.get("response", "Sorry, I couldn't process your request.")
-        
-        # Handle "I don't know" responses consistently
-        if "I don't know" in chatbot_response or "don't have information" in chatbot_response:
-            chatbot_response = "I don't have information about that in my knowledge base. Please ask a question related to the content in the provided PDF documents."
-        
-        # Add the conversation to history
-        history.append((message, chatbot_response))
-        
-        # Return empty message (to clear the input) and updated history
-        return "", history
+            headers={"X-Request-Timeout": "60"},
+            stream=True,
+            timeout=(5, 60)
+        ) as response:
+            if response.status_code == 404:
+                yield "", chat_once(message, history)
+                return
+            
+            # Handle API errors
+            if response.status_code != 200:
+                history[-1] = (message, status_message(response))
+                yield "", history
+                return
+            
+            answer, sources = "", []
+            for event, data in read_events(response):
+                if event == "sources":
+                    # Show where the answer comes from while it is being written
+                    sources = data.get("sources", [])
+                    if sources:
+                        history[-1] = (message, "Found relevant passages in: " + ", ".join(sources))
+                elif event == "delta":
+                    answer += data.get("text", "")
+                    history[-1] = (message, answer)
+                elif event == "done":
+                    history[-1] = (message, normalize_answer(data.get("response", answer)))
+                elif event == "error":
+                    history[-1] = (message, f"Sorry, I encountered an error: {data.get('error')}")
+                yield "", history
         
     except Exception as e:
         error_message = f"Sorry, I encountered an error: {str(e)}"
-        history.append((message, error_message))
-        return "", history
+        history[-1] = (message, error_message)
+        yield "", history
 
 def main():
     # Create the Gradio interface with Gradio 3.x compatibility
@@ -78,7 +136,8 @@ def main():
             inputs=msg
         )
     
-    # Launch the app
+    # Launch the app; the queue lets streamed answers update the page as they arrive
+    demo.queue()
     demo.launch(server_name="0.0.0.0", server_port=7860, share=False)
 
 if __name__ == "__main__":